@@ -5,50 +5,139 @@ The admin page is useful to add, delete, or modify data defined in your ./models
 
 
 from django.contrib import admin
-from .models import Author, Genre, Book, BookInstance, Language
-
-
-# One way to register models defined in ./models.py.
-# In order to register a model, you need to provide the model and the rendering template.
-# This is sufficient for simple models like Genre and Language, which only has a string field.
-# By default, this way uses admin.ModelAdmin
-admin.site.register(Genre)
-admin.site.register(Language)
+from django.core.paginator import Paginator
+from django.forms.models import BaseInlineFormSet
+from django.http import QueryDict
+from django.utils.html import format_html
+from .models import Author, Genre, Book, BookInstance, Language, ProfileReport
+from .pagination import EstimatedCountPaginator
+
+
+# Genre and Language only have a name. Their admins are only needed for the name search, which the autocomplete
+# widgets of the book forms use (autocomplete_fields requires search_fields on the admin of the related model).
+@admin.register(Genre)
+class GenreAdmin(admin.ModelAdmin):
+    search_fields = ('name',)
+
+
+@admin.register(Language)
+class LanguageAdmin(admin.ModelAdmin):
+    search_fields = ('name',)
+
+
+class PaginatedInlineFormSet(BaseInlineFormSet):
+    '''
+    Inline formset showing one page of the related objects. The page is read from the query string of the change
+    page under the formset's prefix (e.g. ?bookinstance_set-page=2); the form posts back to the same URL, so the
+    page that was shown is the one saved.
+    '''
+    per_page = 20
+    # The query string of the change page, set by PaginatedTabularInline.get_formset()
+    query = None
+
+    @property
+    def page_parameter(self):
+        return '{0}-page'.format(self.prefix)
+
+    def get_queryset(self):
+        if not hasattr(self, '_queryset'):
+            # The inline's queryset, filtered on the parent object and ordered
+            queryset = super().get_queryset()
+            self.paginator = Paginator(queryset, self.per_page)
+            self.page = self.paginator.get_page(self.query.get(self.page_parameter) if self.query else None)
+            self._queryset = self.page.object_list
+        return self._queryset
+
+    def page_url(self, number):
+        query = self.query.copy() if self.query is not None else QueryDict(mutable=True)
+        query[self.page_parameter] = number
+        return '?' + query.urlencode()
+
+    @property
+    def previous_page_url(self):
+        return self.page_url(self.page.previous_page_number())
+
+    @property
+    def next_page_url(self):
+        return self.page_url(self.page.next_page_number())
+
+
+class PaginatedTabularInline(admin.TabularInline):
+    # Tabular inline that shows per_page related objects at a time, so that the size of the change page doesn't
+    # grow with the number of related objects
+    formset = PaginatedInlineFormSet
+    template = 'admin/catalog/paginated_tabular.html'
+    per_page = 20
+
+    def get_formset(self, request, obj=None, **kwargs):
+        formset = super().get_formset(request, obj, **kwargs)
+        formset.per_page = self.per_page
+        formset.query = request.GET
+        return formset
 
 
 # This class crates a type of inline model, which is used by another model (i.e AuthorAdmin)
-class BooksInline(admin.TabularInline):
+class BooksInline(PaginatedTabularInline):
     model = Book
+    # Searched through the admin's autocomplete view rather than listed in full in every row
+    autocomplete_fields = ('language', 'genre')
+
+    def get_queryset(self, request):
+        # The genres of the rows shown are loaded with one query
+        return super().get_queryset(request).prefetch_related('genre')
 
 
 # This class crates a type of inline model, which is used by another model (i.e BookAdmin)
-class BooksInstanceInline(admin.TabularInline):
+class BooksInstanceInline(PaginatedTabularInline):
     model = BookInstance
+    autocomplete_fields = ('borrower',)
+
+
+# Base class of the admins of the catalog's large tables. Their changelists take the number of rows from the
+# database's statistics once a table is large (see ./pagination.py), and don't count the unfiltered rows again
+# when a filter is applied.
+class CatalogModelAdmin(admin.ModelAdmin):
+    paginator = EstimatedCountPaginator
+    show_full_result_count = False
 
 
 # Registers AuthorAdmin with Author model
 @admin.register(Author)
-class AuthorAdmin(admin.ModelAdmin):
+class AuthorAdmin(CatalogModelAdmin):
     # Fields you see when you are viewing an author record. These strings are columns in the Author model/db table.
     list_display = ('last_name', 'first_name', 'date_of_birth', 'date_of_death')
     # Fields you see when you are creating a new record or modifying a record
     fields = ['first_name', 'last_name', ('date_of_birth', 'date_of_death')]
+    # Used by the autocomplete widgets of the book forms
+    search_fields = ('last_name', 'first_name')
     # Inlines allows you to register another model under Author
     inlines = [BooksInline]
 
 
-class BookAdmin(admin.ModelAdmin):
+class BookAdmin(CatalogModelAdmin):
     list_display = ('title', 'author', 'display_genre')
+    # The author of every row is joined into the changelist query
+    list_select_related = ('author',)
+    search_fields = ('title', 'isbn')
+    # Searched through the admin's autocomplete view rather than rendered as a <select> of every row
+    autocomplete_fields = ('author', 'language', 'genre')
     inlines = [BooksInstanceInline]
 
+    def get_queryset(self, request):
+        # display_genre reads the genres of every row: they are loaded for the whole page with one query
+        return super().get_queryset(request).prefetch_related('genre')
+
 
 # Manually register the BookAdmin with Book model
 admin.site.register(Book, BookAdmin)
 
 
 @admin.register(BookInstance)
-class BookInstanceAdmin(admin.ModelAdmin):
+class BookInstanceAdmin(CatalogModelAdmin):
     list_display = ('book', 'status', 'borrower', 'due_back', 'id')
+    # The book and borrower of every row are joined into the changelist query
+    list_select_related = ('book', 'borrower')
+    autocomplete_fields = ('book', 'borrower')
     # When you visit host:port/admin/catalog/bookinstance/, you get a navigation pane on the right
     # where you can filter based on these db columns. Note that "status" is a dropdown choice
     # and "due_back" is a date, both of which have default filter options.
@@ -64,3 +153,38 @@ class BookInstanceAdmin(admin.ModelAdmin):
             'fields': ('status', 'due_back', 'borrower')
         }),
     )
+
+
+# Profiles recorded by catalog.middleware.ProfilingMiddleware. They can be viewed and deleted, not edited.
+@admin.register(ProfileReport)
+class ProfileReportAdmin(admin.ModelAdmin):
+    list_display = ('created', 'method', 'path', 'status_code', 'duration_ms', 'query_count', 'query_time_ms',
+                    'template_time_ms', 'user')
+    list_filter = ('method', 'status_code')
+    list_select_related = ('user',)
+    search_fields = ('path',)
+    fields = ('created', 'user', 'method', 'path', 'status_code', 'duration_ms', 'query_count', 'query_time_ms',
+              'template_time_ms', 'query_list', 'template_list', 'profile_text')
+    readonly_fields = fields
+
+    def has_add_permission(self, request):
+        return False
+
+    def has_change_permission(self, request, obj=None):
+        return False
+
+    @admin.display(description='Queries')
+    def query_list(self, obj):
+        return format_html('<pre>{}</pre>', '\n'.join(
+            '{0:8.2f} ms  {1}  {2}'.format(query['duration_ms'], query['sql'], query.get('params', ''))
+            for query in obj.queries))
+
+    @admin.display(description='Templates')
+    def template_list(self, obj):
+        return format_html('<pre>{}</pre>', '\n'.join(
+            '{0:8.2f} ms  {1}{2}'.format(template['duration_ms'], '  ' * template['depth'], template['name'])
+            for template in obj.templates))
+
+    @admin.display(description='Profile')
+    def profile_text(self, obj):
+        return format_html('<pre>{}</pre>', obj.profile)
@@ -0,0 +1,229 @@
+'''
+This file contains the read-only JSON API, mapped to /catalog/api/v1/ in ./urls.py.
+
+    GET /catalog/api/v1/<resource>/        list, paged with ?cursor= (see ./pagination.py) and ?limit=
+    GET /catalog/api/v1/<resource>/<pk>/   single object
+
+where <resource> is books, authors, copies, genres or languages. Both accept:
+    ?fields=title,isbn       only return these fields (the id is always returned)
+    ?embed=author,genre      replace related ids by the related objects
+
+Rows are read with queryset.values() and serialized as dictionaries, without creating model instances.
+Related objects are loaded with one query per embedded relation (and one per many-to-many field), however many
+rows are returned. Responses carry an ETag, so clients can revalidate with If-None-Match and get a 304.
+Errors are answered with a 400 or 404 and a body of {"error": message}.
+'''
+
+
+from functools import wraps
+
+from django.core.exceptions import ValidationError
+from django.http import JsonResponse
+from django.urls import reverse
+from django.utils.cache import get_conditional_response, set_response_etag
+from django.utils.http import urlencode
+from django.views.decorators.http import require_GET
+
+from .models import Author, Book, BookInstance, Genre, Language
+from .pagination import Keyset, to_field_value
+
+
+DEFAULT_LIMIT = 20
+MAX_LIMIT = 100
+
+
+class Resource:
+    '''
+    Describes how a model is exposed: the fields returned by default, the ordering of lists (which must end
+    with a unique field, for cursor pagination), and the fields that refer to other resources and can be
+    embedded. Foreign keys are returned as the related id, many-to-many fields as a list of ids.
+    '''
+
+    def __init__(self, model, fields, ordering, related=None):
+        self.model = model
+        self.fields = fields
+        self.ordering = ordering
+        # Maps a field name to the name of the resource it refers to
+        self.related = related or {}
+
+    def is_many_to_many(self, name):
+        return self.model._meta.get_field(name).many_to_many
+
+    def attname(self, name):
+        return self.model._meta.get_field(name).attname
+
+
+# BookInstance.borrower is deliberately not exposed
+RESOURCES = {
+    'books': Resource(Book, ('id', 'title', 'summary', 'isbn', 'author', 'language', 'genre'),
+                      ('title', 'author', 'id'),
+                      related={'author': 'authors', 'language': 'languages', 'genre': 'genres'}),
+    'authors': Resource(Author, ('id', 'first_name', 'last_name', 'date_of_birth', 'date_of_death'),
+                        ('last_name', 'first_name', 'id')),
+    'copies': Resource(BookInstance, ('id', 'book', 'imprint', 'status', 'due_back'),
+                       ('due_back', 'id'),
+                       related={'book': 'books'}),
+    'genres': Resource(Genre, ('id', 'name'), ('name', 'id')),
+    'languages': Resource(Language, ('id', 'name'), ('name', 'id')),
+}
+
+
+class BadRequest(Exception):
+    pass
+
+
+class NotFound(Exception):
+    pass
+
+
+def _split(value):
+    return [part for part in value.split(',') if part] if value else []
+
+
+def _requested_fields(resource, request):
+    fields = _split(request.GET.get('fields'))
+    unknown = set(fields) - set(resource.fields)
+    if unknown:
+        raise BadRequest('Unknown fields: {0}'.format(', '.join(sorted(unknown))))
+    if not fields:
+        return list(resource.fields)
+    return ['id'] + [name for name in fields if name != 'id']
+
+
+def _requested_embeds(resource, request, fields):
+    embeds = _split(request.GET.get('embed'))
+    unknown = set(embeds) - set(resource.related)
+    if unknown:
+        raise BadRequest('Cannot embed: {0}'.format(', '.join(sorted(unknown))))
+    # A relation can only be embedded if its field is returned
+    return [name for name in embeds if name in fields]
+
+
+def _many_to_many_ids(resource, name, pks):
+    # Returns {pk: [related ids]} read from the through table in one query
+    field = resource.model._meta.get_field(name)
+    through = field.remote_field.through
+    source = field.m2m_field_name()
+    target = field.m2m_reverse_field_name()
+    ids = {pk: [] for pk in pks}
+    for source_id, target_id in through.objects.filter(**{source + '__in': pks}).values_list(
+            source + '_id', target + '_id').order_by(target + '_id'):
+        ids[source_id].append(target_id)
+    return ids
+
+
+def serialize(resource, rows, fields, embeds=()):
+    # rows are queryset.values() dictionaries holding at least the attnames of the non-many-to-many fields
+    pks = [row['id'] for row in rows]
+    many_to_many = {name: _many_to_many_ids(resource, name, pks)
+                    for name in fields if resource.is_many_to_many(name)}
+
+    objects = [
+        {name: many_to_many[name][row['id']] if name in many_to_many else row[resource.attname(name)]
+         for name in fields}
+        for row in rows
+    ]
+
+    for name in embeds:
+        related = RESOURCES[resource.related[name]]
+        if name in many_to_many:
+            related_ids = {pk for ids in many_to_many[name].values() for pk in ids}
+        else:
+            related_ids = {obj[name] for obj in objects if obj[name] is not None}
+        # Embedded objects are returned with their default fields, except many-to-many ones
+        related_fields = [field for field in related.fields if not related.is_many_to_many(field)]
+        related_rows = list(_values(related, related.model.objects.filter(pk__in=related_ids), related_fields))
+        by_id = {obj['id']: obj for obj in serialize(related, related_rows, related_fields)}
+        for obj in objects:
+            if name in many_to_many:
+                obj[name] = [by_id[pk] for pk in obj[name] if pk in by_id]
+            else:
+                obj[name] = by_id.get(obj[name])
+    return objects
+
+
+def _values(resource, queryset, fields, extra=()):
+    attnames = {resource.attname(name) for name in fields if not resource.is_many_to_many(name)}
+    attnames.update(extra)
+    return queryset.values(*attnames)
+
+
+def _json(request, data, status=200):
+    response = JsonResponse(data, status=status, json_dumps_params={'separators': (',', ':')})
+    if status == 200:
+        # The ETag is a hash of the body; a matching If-None-Match turns the response into a 304
+        set_response_etag(response)
+        return get_conditional_response(request, etag=response['ETag'], response=response)
+    return response
+
+
+def _get_resource(name):
+    if name not in RESOURCES:
+        raise NotFound('Unknown resource.')
+    return RESOURCES[name]
+
+
+def _page_url(request, resource_name, cursor):
+    if cursor is None:
+        return None
+    query = request.GET.copy()
+    query['cursor'] = cursor
+    return request.build_absolute_uri(
+        reverse('api-list', args=[resource_name]) + '?' + urlencode(sorted(query.items())))
+
+
+def api_view(view):
+    # Answers the errors raised by the view with a JSON body, like every other response of the API
+    @wraps(view)
+    def wrapper(request, *args, **kwargs):
+        try:
+            return view(request, *args, **kwargs)
+        except BadRequest as error:
+            return _json(request, {'error': str(error)}, status=400)
+        except NotFound as error:
+            return _json(request, {'error': str(error)}, status=404)
+    return wrapper
+
+
+@require_GET
+@api_view
+def api_list(request, resource_name):
+    resource = _get_resource(resource_name)
+    fields = _requested_fields(resource, request)
+    embeds = _requested_embeds(resource, request, fields)
+    try:
+        limit = min(max(int(request.GET.get('limit', DEFAULT_LIMIT)), 1), MAX_LIMIT)
+    except ValueError:
+        raise BadRequest('Invalid limit.')
+
+    keyset = Keyset(resource.model, resource.ordering)
+    queryset = _values(resource, resource.model.objects.all(), fields,
+                       extra=[field.attname for field in keyset.fields])
+    try:
+        page = keyset.paginate(queryset, limit, request.GET.get('cursor'))
+    except ValueError:
+        raise BadRequest('Invalid cursor.')
+
+    return _json(request, {
+        'results': serialize(resource, page.object_list, fields, embeds),
+        'next': _page_url(request, resource_name, page.next_cursor),
+        'previous': _page_url(request, resource_name, page.previous_cursor),
+    })
+
+
+@require_GET
+@api_view
+def api_detail(request, resource_name, pk):
+    resource = _get_resource(resource_name)
+    queryset = resource.model.objects.all()
+    try:
+        pk = to_field_value(resource.model._meta.pk, pk, queryset.db)
+    except ValidationError:
+        raise NotFound('Invalid id.')
+    fields = _requested_fields(resource, request)
+    embeds = _requested_embeds(resource, request, fields)
+
+    rows = list(_values(resource, queryset.filter(pk=pk), fields))
+    if not rows:
+        raise NotFound('No such object.')
+    return _json(request, serialize(resource, rows, fields, embeds)[0])
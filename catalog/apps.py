@@ -6,3 +6,8 @@ class CatalogConfig(AppConfig):
     # The type of primary key to use for models in this application when no primary key is explicitly specified.
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'catalog'
+
+    # Called once the app registry is ready. Importing ./signals.py connects its receivers, and importing
+    # ./checks.py registers the system checks.
+    def ready(self):
+        from . import checks, signals  # noqa: F401
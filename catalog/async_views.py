@@ -0,0 +1,246 @@
+'''
+Async versions of the catalog's read-only pages (index, book and author lists and details), served instead of the
+views in ./views.py when the project runs under ASGI with settings.CATALOG_ASYNC_VIEWS enabled (see ./urls.py and
+locallibrary/asgi.py). They render the same templates with the same context, and answer conditional requests and
+use the content cache in the same way.
+
+Django 4.0 has no async ORM, so every query still runs in a thread. The queries of a page that don't depend on
+each other (e.g. a list's COUNT and its rows, or a book and its copies) run at the same time, each in a thread of
+the pool with its own database connection, so the page waits for the slowest of them instead of their sum. The
+queries deciding whether anything else is needed (the Last-Modified lookup that answers conditional requests and
+finds missing objects) still run first.
+'''
+
+
+import asyncio
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.cache import cache
+from django.core.paginator import InvalidPage, Page, Paginator
+from django.db import close_old_connections
+from django.http import Http404
+from django.shortcuts import render
+from django.template.loader import render_to_string
+from django.utils.cache import get_conditional_response
+from django.utils.http import http_date, quote_etag
+
+from catalog import views
+from catalog.caching import detail_cache_key, get_catalog_counts, get_list_version, record_cache_access
+from catalog.models import Author, Book, BookInstance, Genre
+from catalog.pagination import Keyset
+
+
+def _in_thread(func, *args, **kwargs):
+    # Runs func in a thread of the pool, rather than the one thread shared by sync_to_async(thread_sensitive=True),
+    # so that it runs concurrently with the other queries of the page. The thread's connection is checked before
+    # and after use, as the request_started and request_finished signals do for a sync view.
+    def run():
+        close_old_connections()
+        try:
+            return func(*args, **kwargs)
+        finally:
+            close_old_connections()
+    return sync_to_async(run, thread_sensitive=False)()
+
+
+def _user_pk(request):
+    # request.user is loaded lazily from the session, with a query
+    return request.user.pk
+
+
+async def _conditional_page(request, model, last_modified, etag_parts, get_page):
+    # The same as the condition() decorator applied by views.ConditionalGetMixin: a 304 (or 412) response if the
+    # client's copy is current, otherwise the page from get_page(), with the ETag and Last-Modified headers set
+    user_pk = await sync_to_async(_user_pk)(request)
+    etag = views.page_etag(model, last_modified, user_pk, request.META.get('QUERY_STRING', ''), *etag_parts)
+    etag = quote_etag(etag) if etag is not None else None
+    timestamp = int(last_modified.timestamp()) if last_modified else None
+
+    response = get_conditional_response(request, etag=etag, last_modified=timestamp)
+    if response is None:
+        response = await get_page()
+    if request.method in ('GET', 'HEAD'):
+        if timestamp and not response.has_header('Last-Modified'):
+            response.headers['Last-Modified'] = http_date(timestamp)
+        if etag:
+            response.headers.setdefault('ETag', etag)
+    return response
+
+
+async def _render(request, template_name, context):
+    # Rendering may load request.user, so it runs in the thread of the request's other sync code
+    return await sync_to_async(render)(request, template_name, context)
+
+
+async def _cached_content(request, model, pk, variant, render_content):
+    # The async CachedContentMixin.get(): the content block is only rendered on a miss. The content is looked up
+    # by the requested variant, and cached under the variant render_content() returns with it, i.e. what was
+    # rendered.
+    key = await sync_to_async(detail_cache_key)(model, pk, *variant)
+    content = await sync_to_async(cache.get)(key)
+    await sync_to_async(record_cache_access)('{0}-detail'.format(model._meta.model_name), hit=content is not None)
+    if content is None:
+        content, variant = await render_content()
+        key = await sync_to_async(detail_cache_key)(model, pk, *variant)
+        await sync_to_async(cache.set)(key, content, settings.CATALOG_DETAIL_CACHE_TIMEOUT)
+    return content
+
+
+async def _paginate(request, queryset, page_size, keyset_ordering, count_queryset=None, strict=True):
+    # Returns (paginator, page), as views.KeysetPaginationMixin and ListView.paginate_queryset() would.
+    # With page numbers, the COUNT and the rows of the requested page are fetched concurrently; the number is
+    # checked against the count afterwards, and only a number beyond the last page costs another query.
+    if settings.CATALOG_PAGINATION == 'keyset' and keyset_ordering is not None:
+        keyset = Keyset(queryset.model, keyset_ordering)
+        try:
+            page = await _in_thread(keyset.paginate, queryset, page_size, request.GET.get('cursor'))
+        except ValueError:
+            raise Http404('Invalid cursor.')
+        return None, page
+
+    paginator = Paginator(queryset, page_size)
+    if count_queryset is None:
+        count_queryset = queryset
+    number = request.GET.get('page') or 1
+    try:
+        number = int(number)
+    except ValueError:
+        if strict and number != 'last':
+            raise Http404('Invalid page.')
+        number = None if number == 'last' else 1
+
+    rows = None
+    fetched = number if number is not None and number >= 1 else None
+    if fetched is None:
+        count = await _in_thread(count_queryset.count)
+    else:
+        offset = (fetched - 1) * page_size
+        count, rows = await asyncio.gather(
+            _in_thread(count_queryset.count),
+            _in_thread(list, queryset[offset:offset + page_size]),
+        )
+    # Paginator.count is a cached property, so the count fetched above is used instead of another query
+    paginator.count = count
+
+    if number is None:
+        number = paginator.num_pages
+    elif not strict:
+        # Like Paginator.get_page(): the first page for a number below it, the last page for one beyond it
+        number = min(max(number, 1), paginator.num_pages)
+    try:
+        number = paginator.validate_number(number)
+    except InvalidPage as error:
+        raise Http404(str(error))
+    if number != fetched:
+        offset = (number - 1) * page_size
+        rows = await _in_thread(list, queryset[offset:offset + page_size])
+    return paginator, Page(rows, number, paginator)
+
+
+async def _list_page(request, model, queryset, template_name, page_size, keyset_ordering):
+    # The async ConditionalListMixin + KeysetPaginationMixin + ListView
+    last_modified, version = await asyncio.gather(
+        _in_thread(views.list_last_modified, model),
+        sync_to_async(get_list_version)(model),
+    )
+
+    async def get_page():
+        paginator, page = await _paginate(request, queryset, page_size, keyset_ordering)
+        context = {
+            'paginator': paginator,
+            'page_obj': page,
+            'is_paginated': page.has_other_pages(),
+            'object_list': page.object_list,
+            '{0}_list'.format(model._meta.model_name): page.object_list,
+        }
+        return await _render(request, template_name, context)
+
+    return await _conditional_page(request, model, last_modified, (version, settings.CATALOG_PAGINATION), get_page)
+
+
+async def index(request):
+    # The counts are a single query (or a cache hit, see ./caching.py), so there is nothing to run concurrently
+    counts = await sync_to_async(get_catalog_counts)()
+    num_visits = views.get_num_visits(request)
+    response = await _render(request, 'index.html', views.index_context(counts, num_visits))
+    views.set_num_visits(response, num_visits + 1)
+    return response
+
+
+async def book_list(request):
+    view = views.BookListView
+    return await _list_page(request, Book, Book.objects.select_related('author'), 'catalog/book_list.html',
+                            view.paginate_by, view.keyset_ordering)
+
+
+async def author_list(request):
+    view = views.AuthorListView
+    return await _list_page(request, Author, Author.objects.all(), 'catalog/author_list.html',
+                            view.paginate_by, view.keyset_ordering)
+
+
+async def book_detail(request, pk):
+    last_modified = await _in_thread(views.detail_last_modified, Book, pk)
+    if last_modified is None:
+        raise Http404('No book found matching the query')
+
+    async def render_content():
+        book, genres, copies, availability = await asyncio.gather(
+            _in_thread(Book.objects.select_related('author', 'language').filter(pk=pk).first),
+            _in_thread(list, Genre.objects.filter(book__pk=pk)),
+            _in_thread(list, BookInstance.objects.filter(book_id=pk)),
+            _in_thread(views.book_availability, pk),
+        )
+        if book is None:
+            raise Http404('No book found matching the query')
+        # The template reads book.genre.all and book.bookinstance_set.all from the prefetch cache
+        book._prefetched_objects_cache = {'genre': genres, 'bookinstance_set': copies}
+        context = {'object': book, 'book': book, 'availability': availability}
+        content = await sync_to_async(render_to_string)(views.BookDetailView.content_template_name, context, request)
+        return content, ()
+
+    async def get_page():
+        content = await _cached_content(request, Book, pk, (), render_content)
+        return await _render(request, views.BookDetailView.template_name, {'content': content})
+
+    return await _conditional_page(request, Book, last_modified, (), get_page)
+
+
+async def author_detail(request, pk):
+    view = views.AuthorDetailView
+    last_modified = await _in_thread(views.detail_last_modified, Author, pk)
+    if last_modified is None:
+        raise Http404('No author found matching the query')
+    # Anything but a number is shown as the first page
+    try:
+        number = int(request.GET.get('page', 1))
+    except ValueError:
+        number = 1
+
+    async def render_content():
+        books = views.author_books(pk)
+        (paginator, page), author = await asyncio.gather(
+            _paginate(request, books, view.paginate_books_by, None,
+                      count_queryset=Book.objects.filter(author_id=pk), strict=False),
+            _in_thread(Author.objects.filter(pk=pk).first),
+        )
+        if author is None:
+            raise Http404('No author found matching the query')
+        context = {
+            'object': author,
+            'author': author,
+            'book_list': await _in_thread(views.add_availability, page.object_list),
+            'page_obj': page,
+            'is_paginated': page.has_other_pages(),
+            'show_status_breakdown': view.show_status_breakdown,
+        }
+        content = await sync_to_async(render_to_string)(view.content_template_name, context, request)
+        # An out-of-range number shows the first or last page, which is cached under its own number
+        return content, (page.number,)
+
+    async def get_page():
+        content = await _cached_content(request, Author, pk, (number,), render_content)
+        return await _render(request, view.template_name, {'content': content})
+
+    return await _conditional_page(request, Author, last_modified, (), get_page)
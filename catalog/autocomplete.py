@@ -0,0 +1,215 @@
+'''
+This file contains the in-memory prefix index behind the autocomplete endpoint in ./views.py.
+
+Each worker process keeps its own index of normalized book titles and author names as sorted arrays, so a
+lookup is a binary search instead of a LIKE 'prefix%' query. The index is built on first use. Afterwards every
+save or delete of a Book or Author is recorded by ./signals.py as a numbered change in the shared cache, and each
+worker replays the changes it has not seen yet before answering, so it never needs a full rebuild unless the
+change log has expired from the cache.
+'''
+
+
+import bisect
+import threading
+import unicodedata
+
+from django.conf import settings
+from django.core.cache import cache
+
+from .models import Author, Book
+
+
+VERSION_KEY = 'catalog:autocomplete:version'
+CHANGE_KEY = 'catalog:autocomplete:change:{0}'
+# Changes are kept for a day; a worker that is further behind rebuilds its index
+CHANGE_TIMEOUT = 60 * 60 * 24
+# Longer keys don't help to tell entries apart and only cost memory
+MAX_KEY_LENGTH = 60
+
+BOOK = 'book'
+AUTHOR = 'author'
+
+
+def normalize(text):
+    # Case, accents and repeated whitespace are ignored: 'Émile  Zola' -> 'emile zola'
+    text = unicodedata.normalize('NFKD', text)
+    text = ''.join(char for char in text if not unicodedata.combining(char))
+    return ' '.join(text.casefold().split())[:MAX_KEY_LENGTH]
+
+
+def book_entries(pk, title):
+    return [(normalize(title), title)]
+
+
+def author_entries(pk, first_name, last_name):
+    # Authors can be found by either name
+    label = '{0}, {1}'.format(last_name, first_name)
+    keys = {normalize('{0} {1}'.format(first_name, last_name)), normalize('{0} {1}'.format(last_name, first_name))}
+    return [(key, label) for key in keys]
+
+
+class PrefixIndex:
+    '''
+    Sorted parallel arrays of keys and (key, kind, pk, label) entries. At most max_entries entries are kept;
+    anything beyond is left out of the index (and reported by the truncated flag).
+    '''
+
+    def __init__(self, max_entries):
+        self.max_entries = max_entries
+        self.keys = []
+        self.entries = []
+        self.truncated = False
+
+    def __len__(self):
+        return len(self.keys)
+
+    def copy(self):
+        index = PrefixIndex(self.max_entries)
+        index.keys = list(self.keys)
+        index.entries = list(self.entries)
+        index.truncated = self.truncated
+        return index
+
+    def add(self, kind, pk, key_labels):
+        for key, label in key_labels:
+            if not key:
+                continue
+            if len(self.keys) >= self.max_entries:
+                self.truncated = True
+                return
+            entry = (key, kind, pk, label)
+            position = bisect.bisect_left(self.entries, entry)
+            self.keys.insert(position, key)
+            self.entries.insert(position, entry)
+
+    def remove(self, kind, pks):
+        # Entries are only sorted by key, so the objects' entries are found by a single pass over the arrays.
+        # Changes are much rarer than lookups.
+        pks = set(pks)
+        entries = [entry for entry in self.entries if not (entry[1] == kind and entry[2] in pks)]
+        if len(entries) != len(self.entries):
+            self.entries = entries
+            self.keys = [entry[0] for entry in entries]
+
+    def search(self, prefix, limit):
+        prefix = normalize(prefix)
+        if not prefix:
+            return []
+        results = []
+        seen = set()
+        position = bisect.bisect_left(self.keys, prefix)
+        while position < len(self.keys) and len(results) < limit:
+            if not self.keys[position].startswith(prefix):
+                break
+            key, kind, pk, label = self.entries[position]
+            # An author found by both names is returned once
+            if (kind, pk) not in seen:
+                seen.add((kind, pk))
+                results.append({'type': kind, 'id': pk, 'label': label})
+            position += 1
+        return results
+
+
+def _load(kind, pks=None):
+    # Yields (pk, [(key, label), ...]) for the given objects, or for all of them if pks is None
+    if kind == BOOK:
+        books = Book.objects.all() if pks is None else Book.objects.filter(pk__in=pks)
+        for pk, title in books.values_list('pk', 'title').iterator(chunk_size=5000):
+            yield pk, book_entries(pk, title)
+    else:
+        authors = Author.objects.all() if pks is None else Author.objects.filter(pk__in=pks)
+        for pk, first_name, last_name in authors.values_list('pk', 'first_name', 'last_name').iterator(
+                chunk_size=5000):
+            yield pk, author_entries(pk, first_name, last_name)
+
+
+def build_index():
+    index = PrefixIndex(settings.CATALOG_AUTOCOMPLETE_MAX_ENTRIES)
+    # The entries are sorted once at the end instead of being inserted one by one
+    entries = []
+    for kind in (BOOK, AUTHOR):
+        for pk, key_labels in _load(kind):
+            entries.extend((key, kind, pk, label) for key, label in key_labels if key)
+            if len(entries) >= index.max_entries:
+                index.truncated = True
+                break
+    entries = entries[:index.max_entries]
+    entries.sort()
+    index.entries = entries
+    index.keys = [entry[0] for entry in entries]
+    return index
+
+
+def record_change(kind, pks):
+    # Called by ./signals.py. The version is a counter so that workers can fetch exactly the changes they missed.
+    cache.add(VERSION_KEY, 0, None)
+    try:
+        version = cache.incr(VERSION_KEY)
+    except ValueError:
+        # The key was evicted between add() and incr(): workers will notice the version went back and rebuild
+        return
+    cache.set(CHANGE_KEY.format(version), (kind, list(pks)), CHANGE_TIMEOUT)
+
+
+_lock = threading.Lock()
+_index = None
+_index_version = None
+
+
+def _catch_up(index, from_version, to_version):
+    # Returns a copy of the index with the changes after from_version replayed, or None if any of them is no
+    # longer in the cache. The copy leaves the current index intact for the threads still searching it.
+    if to_version - from_version > settings.CATALOG_AUTOCOMPLETE_MAX_REPLAY:
+        return None
+    keys = [CHANGE_KEY.format(version) for version in range(from_version + 1, to_version + 1)]
+    changes = cache.get_many(keys)
+    if len(changes) != len(keys):
+        return None
+
+    pending = {BOOK: set(), AUTHOR: set()}
+    for key in keys:
+        kind, pks = changes[key]
+        pending[kind].update(pks)
+
+    index = index.copy()
+    for kind, pks in pending.items():
+        if not pks:
+            continue
+        index.remove(kind, pks)
+        # Deleted objects are simply not found again
+        for pk, key_labels in _load(kind, pks):
+            index.add(kind, pk, key_labels)
+    return index
+
+
+def get_index():
+    global _index, _index_version
+
+    version = cache.get(VERSION_KEY, 0)
+    if _index is not None and version == _index_version:
+        return _index
+
+    with _lock:
+        if _index is not None and version == _index_version:
+            return _index
+        index = None
+        # A version lower than ours means the cache was cleared and the change log is gone
+        if _index is not None and version > _index_version:
+            index = _catch_up(_index, _index_version, version)
+        if index is None:
+            # The version is read before loading, so changes made while building are replayed next time
+            index = build_index()
+        _index, _index_version = index, version
+        return index
+
+
+def reset_index():
+    # Drops this worker's index; it is rebuilt on next use
+    global _index, _index_version
+    with _lock:
+        _index = None
+        _index_version = None
+
+
+def autocomplete(prefix, limit=10):
+    return get_index().search(prefix, limit)
@@ -0,0 +1,131 @@
+'''
+This file contains the caching helpers used by ./views.py and kept up to date by ./signals.py.
+Values are stored in the cache configured by settings.CACHES, which should be a shared backend
+(memcached, redis, etc.) in production so that every worker sees the same data.
+'''
+
+
+import uuid
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import connection
+
+from .models import Author, Book, BookAvailability, BookInstance
+
+
+CATALOG_COUNTS_KEY = 'catalog:counts'
+
+
+def _count_catalog():
+    # All four counts are computed by a single statement. The available copies are summed from the
+    # BookAvailability counters (see ./models.py), a few rows per book, instead of scanning BookInstance. The
+    # copies are counted in BookInstance itself, as the counters leave out copies with a blank status.
+    sql = (
+        'SELECT '
+        '(SELECT COUNT(*) FROM {book}), '
+        '(SELECT COUNT(*) FROM {instance}), '
+        '(SELECT COALESCE(SUM(available), 0) FROM {availability}), '
+        '(SELECT COUNT(*) FROM {author})'
+    ).format(
+        book=connection.ops.quote_name(Book._meta.db_table),
+        instance=connection.ops.quote_name(BookInstance._meta.db_table),
+        author=connection.ops.quote_name(Author._meta.db_table),
+        availability=connection.ops.quote_name(BookAvailability._meta.db_table),
+    )
+    with connection.cursor() as cursor:
+        cursor.execute(sql)
+        num_books, num_instances, num_instances_available, num_authors = cursor.fetchone()
+
+    return {
+        'num_books': num_books,
+        'num_instances': num_instances,
+        'num_instances_available': num_instances_available,
+        'num_authors': num_authors,
+    }
+
+
+def get_catalog_counts():
+    # Returns the record counts shown on the index page, computing them only on a cache miss
+    counts = cache.get(CATALOG_COUNTS_KEY)
+    if counts is None:
+        counts = _count_catalog()
+        cache.set(CATALOG_COUNTS_KEY, counts, settings.CATALOG_COUNTS_CACHE_TIMEOUT)
+    return counts
+
+
+def invalidate_catalog_counts():
+    # Called from ./signals.py whenever a Book, BookInstance or Author is saved or deleted
+    cache.delete(CATALOG_COUNTS_KEY)
+
+
+# Version keys
+#
+# Every cached rendering of an object is stored under a key that includes the object's current version.
+# Bumping the version (see ./signals.py) makes all the old renderings unreachable; they expire on their own.
+
+def _version_key(model, pk):
+    return 'catalog:version:{0}:{1}'.format(model._meta.model_name, pk)
+
+
+def get_version(model, pk):
+    key = _version_key(model, pk)
+    version = cache.get(key)
+    if version is None:
+        # add() does nothing if another process has just created the version; read whichever one won
+        cache.add(key, uuid.uuid4().hex, None)
+        version = cache.get(key)
+    return version
+
+
+def bump_versions(model, pks):
+    # A random token rather than a counter: it cannot collide with a version that was evicted from the cache
+    versions = {_version_key(model, pk): uuid.uuid4().hex for pk in pks if pk is not None}
+    if versions:
+        cache.set_many(versions, None)
+
+
+def _list_version_key(model):
+    return 'catalog:list-version:{0}'.format(model._meta.model_name)
+
+
+def get_list_version(model):
+    # Version of the pages listing the objects of a model, bumped by ./signals.py when any of them is changed
+    key = _list_version_key(model)
+    version = cache.get(key)
+    if version is None:
+        cache.add(key, uuid.uuid4().hex, None)
+        version = cache.get(key)
+    return version
+
+
+def bump_list_versions(*models):
+    cache.set_many({_list_version_key(model): uuid.uuid4().hex for model in models}, None)
+
+
+def detail_cache_key(model, pk, *variant):
+    # variant holds anything else the rendering depends on, e.g. the page number of a paginated list
+    parts = [model._meta.model_name, str(pk), get_version(model, pk)] + [str(part) for part in variant]
+    return 'catalog:detail:' + ':'.join(parts)
+
+
+# Hit/miss counters of the detail page caches, reported by the catalog_cache_stats command
+
+def _stats_key(name, outcome):
+    return 'catalog:stats:{0}:{1}'.format(name, outcome)
+
+
+def record_cache_access(name, hit):
+    key = _stats_key(name, 'hits' if hit else 'misses')
+    # incr() is atomic in shared backends but fails on a missing key, hence the add() first
+    cache.add(key, 0, None)
+    try:
+        cache.incr(key)
+    except ValueError:
+        pass
+
+
+def get_cache_stats(name):
+    hits = cache.get(_stats_key(name, 'hits'), 0)
+    misses = cache.get(_stats_key(name, 'misses'), 0)
+    return {'hits': hits, 'misses': misses}
@@ -0,0 +1,62 @@
+'''
+System checks of the catalog settings, run by manage.py commands (including migrate in the Procfile) at startup.
+The checks are registered when the module is imported by CatalogConfig.ready() in ./apps.py.
+'''
+
+
+from django.conf import settings
+from django.core.checks import Error, Tags, Warning, register
+
+
+# Cache backends whose data only the current process sees
+PROCESS_LOCAL_BACKENDS = {
+    'django.core.cache.backends.locmem.LocMemCache',
+    'django.core.cache.backends.dummy.DummyCache',
+}
+
+
+# The keys of the full-page cache include versions read from the default cache (see ./middleware.py), as do
+# the catalog counts and the autocomplete change log. A page cache shared by the workers with a default cache
+# private to each of them would keep serving a page changed through another worker.
+@register(Tags.caches)
+def check_shared_default_cache(app_configs, **kwargs):
+    alias = settings.CATALOG_PAGE_CACHE_ALIAS
+    if not alias or alias not in settings.CACHES:
+        return []
+    pages_backend = settings.CACHES[alias]['BACKEND']
+    default_backend = settings.CACHES['default']['BACKEND']
+    if pages_backend not in PROCESS_LOCAL_BACKENDS and default_backend in PROCESS_LOCAL_BACKENDS:
+        return [Error(
+            'The page cache {0!r} is shared between processes, but the default cache is private to each '
+            'process.'.format(alias),
+            hint='Point the default cache at a shared backend too, e.g. with the CACHE_BACKEND and '
+                 'CACHE_LOCATION environment variables.',
+            id='catalog.E001',
+        )]
+    return []
+
+
+# The cache versions of the detail and full pages (see ./caching.py) are bumped in the default cache. Private to
+# each process, a bump made by one worker isn't seen by the others, which keep serving the old pages until they
+# expire (CATALOG_DETAIL_CACHE_TIMEOUT and CATALOG_PAGE_CACHE_TIMEOUT).
+@register(Tags.caches)
+def check_process_local_default_cache(app_configs, **kwargs):
+    if settings.CACHES['default']['BACKEND'] not in PROCESS_LOCAL_BACKENDS:
+        return []
+    enabled = []
+    # A timeout of 0 caches nothing, None caches for good
+    if settings.CATALOG_DETAIL_CACHE_TIMEOUT != 0:
+        enabled.append('detail')
+    if settings.CATALOG_PAGE_CACHE_ALIAS and settings.CATALOG_PAGE_CACHE_ALIAS in settings.CACHES:
+        enabled.append('full-page')
+    if not enabled:
+        return []
+    return [Warning(
+        'The default cache is private to each process, so with several worker processes the {0} cache{1} may '
+        'serve pages that were changed through another worker.'.format(' and '.join(enabled),
+                                                                       's' if len(enabled) > 1 else ''),
+        hint='Point the default cache at a backend shared by the workers with the CACHE_BACKEND and '
+             'CACHE_LOCATION environment variables, or disable the caches (CATALOG_DETAIL_CACHE_TIMEOUT = 0 and '
+             'CATALOG_PAGE_CACHE_ALIAS=""). A single process can add catalog.W001 to SILENCED_SYSTEM_CHECKS.',
+        id='catalog.W001',
+    )]
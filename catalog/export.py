@@ -0,0 +1,96 @@
+'''
+This file contains the full-catalog export used by the export_catalog management command and the staff-only
+export view in ./views.py.
+
+The books are read with a server-side cursor (queryset.iterator()), so only one chunk of rows is held in memory
+at any time, whatever the size of the catalog. The author and language names are joined into the same query;
+the genre names of each chunk are read with one extra query. The output is produced as a generator of encoded
+(and optionally gzip-compressed) pieces, which can be written to a file or streamed in a response.
+'''
+
+
+import csv
+import io
+import json
+import zlib
+
+from .models import Book
+
+
+FIELDS = ('id', 'title', 'isbn', 'summary', 'author_first_name', 'author_last_name', 'language', 'genres')
+FORMATS = ('csv', 'jsonl')
+CONTENT_TYPES = {'csv': 'text/csv', 'jsonl': 'application/x-ndjson'}
+
+
+def iter_books(chunk_size=2000):
+    # Yields one dictionary per book, with FIELDS as keys and the genres as a list of names
+    rows = Book.objects.order_by('pk').values_list(
+        'pk', 'title', 'isbn', 'summary', 'author__first_name', 'author__last_name', 'language__name',
+    ).iterator(chunk_size=chunk_size)
+
+    chunk = []
+    for row in rows:
+        chunk.append(row)
+        if len(chunk) == chunk_size:
+            yield from _with_genres(chunk)
+            chunk = []
+    if chunk:
+        yield from _with_genres(chunk)
+
+
+def _with_genres(chunk):
+    genres = {row[0]: [] for row in chunk}
+    links = Book.genre.through.objects.filter(book_id__in=genres).order_by('genre__name').values_list(
+        'book_id', 'genre__name')
+    for book_id, name in links:
+        genres[book_id].append(name)
+    for row in chunk:
+        yield dict(zip(FIELDS, row + (genres[row[0]],)))
+
+
+def _csv_lines(books):
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(FIELDS)
+    for book in books:
+        writer.writerow([
+            '' if book[name] is None else (';'.join(book[name]) if name == 'genres' else book[name])
+            for name in FIELDS
+        ])
+        yield buffer.getvalue()
+        buffer.seek(0)
+        buffer.truncate()
+    yield buffer.getvalue()
+
+
+def _jsonl_lines(books):
+    for book in books:
+        yield json.dumps(book, ensure_ascii=False, separators=(',', ':')) + '\n'
+
+
+def export_catalog(output_format='csv', compress=False, chunk_size=2000, batch_bytes=64 * 1024):
+    '''
+    Yields the catalog as encoded bytes in the given format ('csv' or 'jsonl'), gzip-compressed if compress is
+    True. Lines are collected into pieces of about batch_bytes, so a file or response isn't written per line.
+    '''
+    lines = _csv_lines if output_format == 'csv' else _jsonl_lines
+    # wbits=31 makes zlib write the gzip header and trailer
+    compressor = zlib.compressobj(6, zlib.DEFLATED, 31) if compress else None
+
+    pending = []
+    size = 0
+    for line in lines(iter_books(chunk_size)):
+        pending.append(line)
+        size += len(line)
+        if size >= batch_bytes:
+            data = ''.join(pending).encode('utf-8')
+            pending, size = [], 0
+            data = compressor.compress(data) if compressor else data
+            if data:
+                yield data
+
+    data = ''.join(pending).encode('utf-8')
+    if compressor:
+        data = compressor.compress(data) + compressor.flush()
+    if data:
+        yield data
@@ -4,11 +4,15 @@ This file contains the logic for forms used by the application. This logic is im
 
 
 import datetime
+import uuid
 
 from django import forms
 from django.core.exceptions import ValidationError
+from django.urls import reverse
 from django.utils.translation import gettext_lazy as _
 
+from catalog.models import Book
+
 
 class RenewBookForm(forms.Form):
     renewal_date = forms.DateField(help_text="Enter a date between now and 4 weeks (default 3).")
@@ -26,3 +30,133 @@ class RenewBookForm(forms.Form):
 
         # Remember to always return the cleaned data.
         return data
+
+
+class RenewLoanForm(RenewBookForm):
+    # The version of the copy the librarian saw (see loans.renew()); a renewal posted without it is not checked
+    # against changes made since the form was shown
+    version = forms.IntegerField(min_value=0, required=False, widget=forms.HiddenInput)
+
+    # copy is the BookInstance being renewed, as currently stored
+    def __init__(self, *args, copy=None, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.copy = copy
+
+    def clean(self):
+        cleaned_data = super().clean()
+        if self.copy is not None and self.copy.status != 'o':
+            raise ValidationError(_('This copy is not on loan, so it cannot be renewed.'))
+        return cleaned_data
+
+
+# Upper bound on the copies changed by one bulk renewal or return, which keeps the IN list of the UPDATE short
+MAX_BULK_COPIES = 500
+
+
+class CopyListField(forms.Field):
+    # The ids of the copies ticked in the list of loans, as UUIDs
+    widget = forms.MultipleHiddenInput
+    default_error_messages = {
+        'invalid': _('Invalid copy id.'),
+        'too_many': _('Select at most %(max)d copies at a time.'),
+    }
+
+    def to_python(self, value):
+        if not value:
+            return []
+        try:
+            copy_ids = [uuid.UUID(str(item)) for item in value]
+        except ValueError:
+            raise ValidationError(self.error_messages['invalid'], code='invalid')
+        if len(copy_ids) > MAX_BULK_COPIES:
+            raise ValidationError(self.error_messages['too_many'], code='too_many', params={'max': MAX_BULK_COPIES})
+        return copy_ids
+
+
+class BulkLoanForm(RenewBookForm):
+    # Renews or returns the selected loans at once (see bulk_renew_return in ./views.py). A renewal date is
+    # checked with the rules of RenewBookForm; a return doesn't need one.
+    RENEW = 'renew'
+    RETURN = 'return'
+
+    action = forms.ChoiceField(choices=((RENEW, _('Renew')), (RETURN, _('Mark returned'))))
+    copies = CopyListField(error_messages={'required': _('Select the loans to change.')})
+    renewal_date = forms.DateField(required=False, help_text="Enter a date between now and 4 weeks (default 3).")
+
+    def clean_renewal_date(self):
+        if self.cleaned_data['renewal_date'] is None:
+            return None
+        return super().clean_renewal_date()
+
+    def clean(self):
+        cleaned_data = super().clean()
+        if cleaned_data.get('action') == self.RENEW and 'renewal_date' in cleaned_data \
+                and cleaned_data['renewal_date'] is None:
+            self.add_error('renewal_date', _('Enter the new due date of the renewed loans.'))
+        return cleaned_data
+
+
+class LookupWidgetMixin:
+    '''
+    Mixin for the Select widgets of model choice fields with too many choices to list. Only the selected options
+    are rendered (with one query for their ids); static/js/lookup.js adds a search box that fills in the others
+    from the lookup endpoint (see ./lookups.py) as the user types.
+    '''
+
+    class Media:
+        js = ('js/lookup.js',)
+
+    def __init__(self, lookup_name, attrs=None):
+        super().__init__(attrs)
+        self.lookup_name = lookup_name
+
+    def build_attrs(self, base_attrs, extra_attrs=None):
+        attrs = super().build_attrs(base_attrs, extra_attrs)
+        attrs['data-lookup-url'] = reverse('lookup', args=[self.lookup_name])
+        return attrs
+
+    def selected_objects(self, values):
+        # Submitted values that aren't ids of the model are left out, the field reports them as invalid
+        queryset = self.choices.queryset
+        pks = []
+        for value in values:
+            try:
+                pks.append(queryset.model._meta.pk.to_python(value))
+            except ValidationError:
+                pass
+        return queryset.filter(pk__in=pks) if pks else queryset.none()
+
+    def optgroups(self, name, value, attrs=None):
+        selected = [item for item in value if item not in (None, '')]
+        options = []
+        if not self.allow_multiple_selected:
+            # The empty option, which lets a field that isn't required be cleared
+            options.append(self.create_option(name, '', self.choices.field.empty_label or '', not selected, 0,
+                                              attrs=attrs))
+        for obj in self.selected_objects(selected):
+            options.append(self.create_option(name, self.choices.field.prepare_value(obj),
+                                              self.choices.field.label_from_instance(obj), True, len(options),
+                                              attrs=attrs))
+        return [(None, [option], option['index']) for option in options]
+
+
+class LookupSelect(LookupWidgetMixin, forms.Select):
+    pass
+
+
+class LookupSelectMultiple(LookupWidgetMixin, forms.SelectMultiple):
+    pass
+
+
+# Form of the BookCreate and BookUpdate views. A submitted author, genre or language is validated by looking up
+# the submitted ids only (ModelChoiceField and ModelMultipleChoiceField filter their queryset on them).
+class BookForm(forms.ModelForm):
+
+    class Meta:
+        model = Book
+        fields = ['title', 'author', 'summary', 'isbn', 'genre', 'language']
+        widgets = {
+            'author': LookupSelect('authors'),
+            'genre': LookupSelectMultiple('genres'),
+            'language': LookupSelect('languages'),
+        }
@@ -0,0 +1,64 @@
+'''
+This file contains the validation of catalog import records, used by the import_catalog management command.
+
+It runs in the command's worker processes, so it deliberately doesn't import Django models: everything it needs
+to know about the models (field lengths, loan statuses) is passed in by the command.
+'''
+
+
+import json
+import re
+
+
+# Columns of the CSV format. JSON lines use the same keys, and may give genres as a list.
+FIELDS = ('title', 'isbn', 'summary', 'author_first_name', 'author_last_name', 'language', 'genres',
+          'copies', 'imprint', 'status')
+
+
+def _text(record, name):
+    value = record.get(name)
+    return '' if value is None else ' '.join(str(value).split())
+
+
+def parse_record(raw, limits, statuses):
+    '''
+    Validates one record: a dictionary (a CSV row) or a string (a JSON line).
+    Returns (record, None) with the cleaned values, or (None, error message).
+    limits maps field names to their maximum length and statuses lists the valid copy statuses.
+    '''
+    if isinstance(raw, str):
+        try:
+            raw = json.loads(raw)
+        except ValueError as error:
+            return None, 'invalid JSON: {0}'.format(error)
+        if not isinstance(raw, dict):
+            return None, 'a record must be a JSON object'
+
+    record = {name: _text(raw, name) for name in FIELDS if name not in ('genres', 'copies')}
+    record['isbn'] = re.sub(r'[\s-]', '', record['isbn'])
+
+    genres = raw.get('genres') or []
+    if isinstance(genres, str):
+        genres = genres.split(';')
+    record['genres'] = sorted({' '.join(str(genre).split()) for genre in genres} - {''})
+
+    try:
+        record['copies'] = int(raw.get('copies') or 0)
+    except (TypeError, ValueError):
+        return None, 'copies must be a number'
+    if record['copies'] < 0:
+        return None, 'copies must not be negative'
+
+    record['status'] = record['status'] or 'a'
+    if record['status'] not in statuses:
+        return None, 'unknown status {0!r}'.format(record['status'])
+
+    for name in ('title', 'isbn'):
+        if not record[name]:
+            return None, '{0} is required'.format(name)
+    for name, limit in limits.items():
+        values = record[name] if name == 'genres' else [record[name]]
+        if any(len(value) > limit for value in values):
+            return None, '{0} is longer than {1} characters'.format(name, limit)
+
+    return record, None
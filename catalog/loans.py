@@ -0,0 +1,118 @@
+'''
+This file contains the changes librarians make to loans, used by the views in ./views.py.
+
+bulk_renew() and bulk_return() change any number of copies with a single UPDATE. The UPDATE only matches the
+copies that are still on loan, so a copy returned by someone else in the meantime is left alone (and not counted),
+and the number of copies changed is returned. An UPDATE sends no signals, so a return moves the availability
+counters of each book by the number of its copies returned, in the same transaction, and the caches that depend
+on the copies are refreshed once the transaction commits.
+
+checkout(), return_copy() and renew() change a single copy at the desk, with optimistic locking instead of row
+locks: the UPDATE only sets the changed columns, and only matches the copy if it still has the status the change
+expects and the version it was read with (UPDATE ... WHERE id = %s AND status = 'a' AND version = 3). When someone
+else changed the copy in the meantime no row matches and LoanConflict is raised, so the caller can reload the copy
+and decide again, instead of overwriting the other change. The availability counters are moved in the same
+transaction, as the post_save receivers would.
+'''
+
+
+from collections import Counter
+from contextlib import nullcontext
+
+from django.db import transaction
+from django.db.models import F
+from django.utils import timezone
+
+from .caching import invalidate_catalog_counts
+from .models import BookAvailability, BookInstance
+from .signals import books_changed
+
+
+class LoanConflict(Exception):
+    '''
+    Raised when a copy was changed by someone else after it was read, or isn't in the status the change expects.
+    '''
+
+    def __init__(self, copy, expected_status):
+        super().__init__('Copy {0} changed since version {1} was read, or is not {2}.'.format(
+            copy.pk, copy.version, dict(BookInstance.LOAN_STATUS).get(expected_status, expected_status).lower()))
+        self.copy = copy
+        self.expected_status = expected_status
+
+
+def _update_loans(copy_ids, **values):
+    copy_ids = list(copy_ids)
+    if not copy_ids:
+        return 0
+    new_status = values.get('status', 'o')
+    with transaction.atomic():
+        # The copies on loan are locked first, so the UPDATE changes exactly these and the counters can be moved
+        # by the known number of copies per book
+        loans = list(BookInstance.objects.select_for_update().filter(pk__in=copy_ids, status='o')
+                     .order_by('pk').values_list('pk', 'book_id'))
+        if not loans:
+            return 0
+        # updated_at is only set by save(), for auto_now fields
+        changed = BookInstance.objects.filter(pk__in=[pk for pk, book_id in loans], status='o').update(
+            updated_at=timezone.now(), version=F('version') + 1, **values)
+
+        book_ids = {book_id for pk, book_id in loans}
+        if new_status != 'o':
+            if changed == len(loans):
+                for book_id, copies in Counter(book_id for pk, book_id in loans).items():
+                    BookAvailability.adjust(book_id, {'o': -copies, new_status: copies})
+            else:
+                # Only databases without row locks get here; the copies are recounted instead
+                transaction.on_commit(lambda: BookAvailability.rebuild(book_ids))
+            transaction.on_commit(invalidate_catalog_counts)
+        # A renewal leaves the counters alone
+        transaction.on_commit(lambda: books_changed(book_ids))
+    return changed
+
+
+def bulk_renew(copy_ids, due_back):
+    # Sets the new due date of the copies that are on loan. Returns the number of copies renewed.
+    return _update_loans(copy_ids, due_back=due_back)
+
+
+def bulk_return(copy_ids):
+    # Makes the copies that are on loan available again. Returns the number of copies returned.
+    return _update_loans(copy_ids, status='a', due_back=None, borrower=None)
+
+
+def _change_copy(copy, expected_status, **values):
+    now = timezone.now()
+    new_status = values.get('status', expected_status)
+    # A renewal is a single UPDATE, a checkout or return also moves the counters in the same transaction
+    with transaction.atomic() if new_status != expected_status else nullcontext():
+        changed = BookInstance.objects.filter(pk=copy.pk, status=expected_status, version=copy.version).update(
+            updated_at=now, version=F('version') + 1, **values)
+        if not changed:
+            raise LoanConflict(copy, expected_status)
+        if new_status != expected_status:
+            BookAvailability.adjust(copy.book_id, {expected_status: -1, new_status: 1})
+            transaction.on_commit(invalidate_catalog_counts)
+        transaction.on_commit(lambda: books_changed({copy.book_id}))
+
+        # The copy now holds what was written, as after save()
+        for name, value in values.items():
+            setattr(copy, name, value)
+        copy.updated_at = now
+        copy.version += 1
+        copy._remember_loaded_values()
+    return copy
+
+
+def checkout(copy, borrower, due_back):
+    # Lends an available copy to the borrower. Raises LoanConflict if it isn't available or changed since it was read.
+    return _change_copy(copy, 'a', status='o', borrower=borrower, due_back=due_back)
+
+
+def return_copy(copy):
+    # Makes a copy on loan available again. Raises LoanConflict if it isn't on loan or changed since it was read.
+    return _change_copy(copy, 'o', status='a', borrower=None, due_back=None)
+
+
+def renew(copy, due_back):
+    # Sets the new due date of a copy on loan. Raises LoanConflict if it isn't on loan or changed since it was read.
+    return _change_copy(copy, 'o', due_back=due_back)
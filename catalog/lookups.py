@@ -0,0 +1,49 @@
+'''
+This file contains the name lookups behind the lookup endpoint in ./views.py, which the choice widgets of the
+book forms (see ./forms.py and static/js/lookup.js) query as the user types, instead of listing every author,
+genre and language in the page.
+
+Objects are matched on a prefix of the name they are sorted by, with a range condition (name >= 'Smi' AND
+name < 'Smi' + the largest character) that the database answers from the model's index on its sort fields (see
+Meta.indexes in ./models.py), and paged with a keyset cursor (see ./pagination.py), so every page of results costs
+the same. The range is case-sensitive: the term is tried as typed and with its first letter in upper case, as
+names are usually capitalized.
+'''
+
+
+from django.db.models import Q
+
+from .models import Author, Genre, Language
+from .pagination import Keyset
+
+
+# Lookup names (in the endpoint's URL) mapped to the model and the fields its objects are sorted by; the first
+# field is the one matched
+LOOKUPS = {
+    'authors': (Author, ('last_name', 'first_name', 'id')),
+    'genres': (Genre, ('name', 'id')),
+    'languages': (Language, ('name', 'id')),
+}
+
+PAGE_SIZE = 20
+MAX_PAGE_SIZE = 100
+# Sorts after every character a name can contain
+LAST_CHARACTER = '\U0010ffff'
+
+
+def prefix_condition(field_name, term):
+    condition = Q()
+    for variant in {term, term[:1].upper() + term[1:]}:
+        condition |= Q(**{field_name + '__gte': variant, field_name + '__lt': variant + LAST_CHARACTER})
+    return condition
+
+
+def lookup(name, term='', cursor=None, page_size=PAGE_SIZE):
+    # Returns a KeysetPage of the objects whose name starts with the term. Raises KeyError for an unknown lookup
+    # and ValueError for an invalid cursor.
+    model, ordering = LOOKUPS[name]
+    queryset = model.objects.all()
+    term = ' '.join(term.split())
+    if term:
+        queryset = queryset.filter(prefix_condition(ordering[0], term))
+    return Keyset(model, ordering).paginate(queryset, min(page_size, MAX_PAGE_SIZE), cursor)
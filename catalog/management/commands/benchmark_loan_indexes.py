@@ -0,0 +1,166 @@
+'''
+Measures the loan queries with and without the BookInstance indexes added by migration 0029, and prints their
+query plans.
+
+The indexes are dropped for the "before" measurements and created again afterwards, so only run this against
+a scratch database, e.g. DATABASE_URL=sqlite:////tmp/benchmark.sqlite3 after running migrate there.
+--populate first fills the database with a reproducible synthetic dataset (the random generator is seeded).
+
+Usage: python manage.py benchmark_loan_indexes [--populate 2000000] [--repeat 20] [--seed 1]
+'''
+
+
+import datetime
+import random
+import statistics
+import time
+import uuid
+
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand
+from django.db import connection, transaction
+
+from catalog.caching import _count_catalog
+from catalog.models import Book, BookInstance
+from catalog.signals import catalog_bulk_changed
+
+
+# Share of the copies in each status in the synthetic dataset
+STATUS_WEIGHTS = {'a': 70, 'o': 15, 'r': 5, 'd': 10}
+
+
+class Command(BaseCommand):
+    help = 'Benchmarks the loan queries before and after the BookInstance indexes (drops and recreates them).'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--populate', type=int, default=0,
+                            help='Number of synthetic copies to create first.')
+        parser.add_argument('--books', type=int, default=50000, help='Number of synthetic books.')
+        parser.add_argument('--borrowers', type=int, default=5000, help='Number of synthetic borrowers.')
+        parser.add_argument('--repeat', type=int, default=20, help='Number of timed runs of each query.')
+        parser.add_argument('--seed', type=int, default=1, help='Seed of the synthetic dataset.')
+
+    def handle(self, *args, **options):
+        if options['populate']:
+            self.populate(options['populate'], options['books'], options['borrowers'], random.Random(options['seed']))
+
+        borrower = (BookInstance.objects.filter(status='o', borrower__isnull=False)
+                    .values_list('borrower_id', flat=True).order_by('borrower_id').first())
+        today = datetime.date.today()
+        queries = {
+            # LoanedBooksByUserListView, first page
+            'loans of one borrower': lambda: list(
+                BookInstance.objects.filter(borrower_id=borrower, status='o').order_by('due_back', 'id')[:10]),
+            # LoanedBooksAllListView, first page
+            'all loans': lambda: list(
+                BookInstance.objects.filter(status='o').select_related('book', 'borrower')
+                .order_by('due_back', 'id')[:10]),
+            # The process_overdue command
+            'newly overdue loans': lambda: list(
+                BookInstance.objects.filter(status='o', due_back__gte=today - datetime.timedelta(days=1),
+                                            due_back__lt=today).values_list('pk', flat=True)),
+            # The record counts of the index page, computed on a cache miss
+            'index page counts': _count_catalog,
+        }
+        self.stdout.write('{0} copies, {1} on loan'.format(
+            BookInstance.objects.count(), BookInstance.objects.filter(status='o').count()))
+
+        indexes = BookInstance._meta.indexes
+        with connection.schema_editor() as editor:
+            for index in indexes:
+                editor.remove_index(BookInstance, index)
+        try:
+            self.analyze()
+            before = self.measure(queries, options['repeat'])
+        finally:
+            with connection.schema_editor() as editor:
+                for index in indexes:
+                    editor.add_index(BookInstance, index)
+        self.analyze()
+        after = self.measure(queries, options['repeat'])
+
+        for name in queries:
+            self.stdout.write('\n== {0}'.format(name))
+            for label, results in (('without indexes', before), ('with indexes', after)):
+                median, p95, plan = results[name]
+                self.stdout.write('-- {0}: median {1:.3f} ms, p95 {2:.3f} ms'.format(label, median, p95))
+                for line in plan.splitlines():
+                    self.stdout.write('   ' + line)
+
+    def measure(self, queries, repeat):
+        results = {}
+        for name, run in queries.items():
+            run()  # warm the cache
+            timings = []
+            for _ in range(repeat):
+                started = time.perf_counter()
+                run()
+                timings.append((time.perf_counter() - started) * 1000)
+            timings.sort()
+            p95 = timings[min(len(timings) - 1, int(len(timings) * 0.95))]
+            results[name] = (statistics.median(timings), p95, self.explain(run))
+        return results
+
+    def explain(self, run):
+        # The plan of the last statement the query ran, with its parameters substituted as the database sees them
+        with connection.execute_wrapper(self.capture):
+            run()
+        with connection.cursor() as cursor:
+            cursor.execute(connection.ops.explain_query_prefix() + ' ' + self.captured_sql, self.captured_params)
+            return '\n'.join(' '.join(str(column) for column in row) for row in cursor.fetchall())
+
+    def capture(self, execute, sql, params, many, context):
+        self.captured_sql, self.captured_params = sql, params
+        return execute(sql, params, many, context)
+
+    def analyze(self):
+        # Fresh statistics, so the planner knows how selective the status values are
+        with connection.cursor() as cursor:
+            cursor.execute('ANALYZE')
+
+    def populate(self, copies, books, borrowers, rng):
+        started = time.monotonic()
+        with transaction.atomic():
+            first_user = User.objects.count()
+            User.objects.bulk_create([
+                User(username='benchmark{0}'.format(first_user + number), password='!')
+                for number in range(borrowers)
+            ], batch_size=5000)
+            user_ids = list(User.objects.values_list('pk', flat=True))
+            first_book = Book.objects.count()
+            new_books = Book.objects.bulk_create([
+                Book(title='Benchmark book {0}'.format(first_book + number), summary='Synthetic',
+                     isbn='B{0:012d}'.format(first_book + number))
+                for number in range(books)
+            ], batch_size=5000)
+            # bulk_create() sends no signals, so the counters, search index and caches are updated here
+            new_book_ids = [book.pk for book in new_books]
+            for start in range(0, len(new_book_ids), 5000):
+                ids = new_book_ids[start:start + 5000]
+                transaction.on_commit(lambda ids=ids: catalog_bulk_changed(ids))
+            book_ids = list(Book.objects.values_list('pk', flat=True))
+
+        statuses = list(STATUS_WEIGHTS)
+        weights = list(STATUS_WEIGHTS.values())
+        today = datetime.date.today()
+        batch = 20000
+        for start in range(0, copies, batch):
+            rows = []
+            for _ in range(min(batch, copies - start)):
+                status = rng.choices(statuses, weights)[0]
+                on_loan = status == 'o'
+                rows.append(BookInstance(
+                    id=uuid.UUID(int=rng.getrandbits(128)),
+                    book_id=rng.choice(book_ids),
+                    imprint='Synthetic',
+                    status=status,
+                    # Loans are due between a month ago and a month from now
+                    due_back=today + datetime.timedelta(days=rng.randint(-30, 30)) if on_loan else None,
+                    borrower_id=rng.choice(user_ids) if on_loan else None,
+                ))
+            with transaction.atomic():
+                BookInstance.objects.bulk_create(rows)
+                ids = list({row.book_id for row in rows})
+                transaction.on_commit(lambda ids=ids: catalog_bulk_changed(ids, copies_only=True))
+            self.stdout.write('Created {0} copies ({1:.0f} s)'.format(start + len(rows),
+                                                                     time.monotonic() - started))
@@ -0,0 +1,240 @@
+'''
+Drives every URL of catalog/urls.py through the test client and reports latency percentiles, query counts
+and memory allocations per URL, optionally saving them as JSON to compare runs across commits.
+
+Run it against a database filled by the generate_dataset command. The URLs that take arguments are requested
+for representative objects: the book with the most copies, the author with the most books, a copy on loan and
+the borrower with the most loans. Pages that need a login are requested as that borrower, or as a librarian
+user ("benchmark-librarian", created if needed) for the staff pages. Only GET requests are made, so the
+benchmark doesn't change the catalog.
+
+Usage: python manage.py benchmark_views [--repeat 50] [--output results.json] [--only books book-detail ...]
+'''
+
+
+import datetime
+import json
+import statistics
+import subprocess
+import time
+import tracemalloc
+
+from django.conf import settings
+from django.contrib.auth.models import Permission, User
+from django.core.cache import cache
+from django.core.management.base import BaseCommand
+from django.db import connection
+from django.db.models import Count
+from django.test import Client, override_settings
+from django.urls import reverse
+
+from catalog import urls
+from catalog.models import Author, Book, BookInstance
+
+
+LIBRARIAN_USERNAME = 'benchmark-librarian'
+# URL names requested as the borrower with the most loans; those needing a permission or staff status are
+# requested as the librarian, everything else anonymously
+BORROWER_URLS = {'my-borrowed'}
+LIBRARIAN_URLS = {'all-borrowed', 'renew-book-librarian', 'author-create', 'author-update', 'author-delete',
+                  'book-create', 'book-update', 'book-delete', 'export'}
+# export streams the whole catalog: benchmark it explicitly with --only export. bulk-renew-return only accepts
+# POST requests, which would change the loans.
+SKIPPED_BY_DEFAULT = {'export', 'bulk-renew-return'}
+WRITE_STATEMENTS = ('INSERT', 'UPDATE', 'DELETE', 'REPLACE')
+
+
+def percentile(sorted_values, percent):
+    # Nearest-rank percentile
+    if not sorted_values:
+        return None
+    rank = max(1, -(-len(sorted_values) * percent // 100))
+    return sorted_values[int(rank) - 1]
+
+
+class QueryCounter:
+
+    def __init__(self):
+        self.queries = 0
+        self.writes = 0
+
+    def __call__(self, execute, sql, params, many, context):
+        self.queries += 1
+        if sql.lstrip().upper().startswith(WRITE_STATEMENTS):
+            self.writes += 1
+        return execute(sql, params, many, context)
+
+
+class Command(BaseCommand):
+    help = 'Benchmarks the latency, queries and memory of every catalog URL.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--repeat', type=int, default=50, help='Timed requests per URL.')
+        parser.add_argument('--warmup', type=int, default=3, help='Untimed requests per URL before timing.')
+        parser.add_argument('--only', nargs='+', metavar='URL_NAME', help='Only benchmark these URL names.')
+        parser.add_argument('--clear-cache', action='store_true',
+                            help='Clear the cache before every request, to measure cold pages.')
+        parser.add_argument('--output', help='Save the results to this JSON file.')
+
+    def handle(self, *args, **options):
+        self.samples = self.find_samples()
+        clients = {
+            None: Client(HTTP_HOST='127.0.0.1'),
+            'borrower': Client(HTTP_HOST='127.0.0.1'),
+            'librarian': Client(HTTP_HOST='127.0.0.1'),
+        }
+        if self.samples['borrower']:
+            clients['borrower'].force_login(self.samples['borrower'])
+        clients['librarian'].force_login(self.get_librarian())
+
+        results = {}
+        # DEBUG would make every query be kept in connection.queries, which is not what production measures
+        with override_settings(DEBUG=False):
+            for name in self.url_names(options['only']):
+                url = self.build_url(name)
+                if url is None:
+                    self.stderr.write('{0}: skipped, no sample object to request.'.format(name))
+                    continue
+                user = 'borrower' if name in BORROWER_URLS else 'librarian' if name in LIBRARIAN_URLS else None
+                results[name] = self.measure(clients[user], url, options)
+                results[name]['user'] = user or 'anonymous'
+                self.report(name, results[name])
+
+        if options['output']:
+            with open(options['output'], 'w') as stream:
+                json.dump({'metadata': self.metadata(options), 'results': results}, stream, indent=2)
+            self.stdout.write(self.style.SUCCESS('Saved the results to {0}.'.format(options['output'])))
+
+    def url_names(self, only):
+        names = [pattern.name for pattern in urls.urlpatterns if pattern.name]
+        if only:
+            return [name for name in names if name in only]
+        return [name for name in names if name not in SKIPPED_BY_DEFAULT]
+
+    def find_samples(self):
+        book = (BookInstance.objects.values('book_id').annotate(copies=Count('pk'))
+                .order_by('-copies').values_list('book_id', flat=True).first())
+        author = (Book.objects.filter(author__isnull=False).values('author_id').annotate(books=Count('pk'))
+                  .order_by('-books').values_list('author_id', flat=True).first())
+        borrower = (BookInstance.objects.filter(status='o', borrower__isnull=False).values('borrower_id')
+                    .annotate(loans=Count('pk')).order_by('-loans').values_list('borrower_id', flat=True).first())
+        title = Book.objects.filter(pk=book).values_list('title', flat=True).first() or ''
+        last_name = Author.objects.filter(pk=author).values_list('last_name', flat=True).first() or ''
+        return {
+            'book': book or Book.objects.values_list('pk', flat=True).first(),
+            'author': author or Author.objects.values_list('pk', flat=True).first(),
+            'copy': BookInstance.objects.filter(status='o').values_list('pk', flat=True).first(),
+            'borrower': User.objects.filter(pk=borrower).first(),
+            'word': title.split()[0] if title else 'a',
+            'name': last_name[:3] or 'a',
+        }
+
+    def get_librarian(self):
+        librarian, created = User.objects.get_or_create(username=LIBRARIAN_USERNAME, defaults={'is_staff': True})
+        if created:
+            librarian.set_unusable_password()
+            librarian.save()
+            librarian.user_permissions.add(Permission.objects.get(codename='can_mark_returned'))
+        return librarian
+
+    def build_url(self, name):
+        samples = self.samples
+        query = ''
+        if name in ('book-detail', 'book-update', 'book-delete'):
+            args = [samples['book']]
+        elif name in ('author-detail', 'author-update', 'author-delete'):
+            args = [samples['author']]
+        elif name == 'renew-book-librarian':
+            args = [samples['copy']]
+        elif name == 'api-list':
+            args = ['books']
+        elif name == 'api-detail':
+            args = ['books', samples['book']]
+        elif name == 'lookup':
+            args = ['authors']
+            query = '?q=' + samples['name']
+        else:
+            args = []
+            if name == 'search':
+                query = '?q=' + samples['word']
+            elif name == 'autocomplete':
+                query = '?q=' + samples['word'][:3]
+        if any(arg is None for arg in args):
+            return None
+        return reverse(name, args=args) + query
+
+    def request(self, client, url, clear_cache):
+        if clear_cache:
+            cache.clear()
+        response = client.get(url)
+        if response.streaming:
+            for _ in response.streaming_content:
+                pass
+        if response.status_code >= 400:
+            raise RuntimeError('{0} returned {1}'.format(url, response.status_code))
+        return response
+
+    def measure(self, client, url, options):
+        for _ in range(options['warmup']):
+            self.request(client, url, options['clear_cache'])
+
+        timings = []
+        counter = QueryCounter()
+        with connection.execute_wrapper(counter):
+            for _ in range(options['repeat']):
+                started = time.perf_counter()
+                response = self.request(client, url, options['clear_cache'])
+                timings.append((time.perf_counter() - started) * 1000)
+        timings.sort()
+
+        # Memory is measured on a separate request, since tracing slows every allocation down
+        tracemalloc.start()
+        try:
+            before, _ = tracemalloc.get_traced_memory()
+            self.request(client, url, options['clear_cache'])
+            after, peak = tracemalloc.get_traced_memory()
+        finally:
+            tracemalloc.stop()
+
+        repeat = max(options['repeat'], 1)
+        return {
+            'url': url,
+            'status': response.status_code if options['repeat'] else None,
+            'p50_ms': percentile(timings, 50),
+            'p95_ms': percentile(timings, 95),
+            'p99_ms': percentile(timings, 99),
+            'mean_ms': statistics.mean(timings) if timings else None,
+            'queries': counter.queries / repeat,
+            'write_queries': counter.writes / repeat,
+            'allocated_kb': round((after - before) / 1024, 1),
+            'peak_memory_kb': round((peak - before) / 1024, 1),
+        }
+
+    def report(self, name, result):
+        if result['p50_ms'] is None:
+            self.stdout.write('{0:<22} {1}'.format(name, result['url']))
+            return
+        self.stdout.write(
+            '{name:<22} p50 {p50_ms:8.2f} ms  p95 {p95_ms:8.2f} ms  p99 {p99_ms:8.2f} ms  '
+            '{queries:5.1f} queries ({write_queries:.1f} writes)  peak {peak_memory_kb:9.1f} KiB'.format(
+                name=name, **result))
+
+    def metadata(self, options):
+        try:
+            commit = subprocess.run(['git', 'rev-parse', 'HEAD'], capture_output=True, text=True,
+                                    cwd=settings.BASE_DIR, check=True).stdout.strip()
+        except (OSError, subprocess.CalledProcessError):
+            commit = None
+        return {
+            'commit': commit,
+            'date': datetime.datetime.now(datetime.timezone.utc).isoformat(),
+            'database': connection.vendor,
+            'repeat': options['repeat'],
+            'clear_cache': options['clear_cache'],
+            'counts': {
+                'authors': Author.objects.count(),
+                'books': Book.objects.count(),
+                'copies': BookInstance.objects.count(),
+                'loans': BookInstance.objects.filter(status='o').count(),
+            },
+        }
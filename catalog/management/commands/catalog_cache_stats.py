@@ -0,0 +1,22 @@
+'''
+Prints the hit/miss counters of the book and author detail page caches and of the full-page cache.
+
+Usage: python manage.py catalog_cache_stats
+'''
+
+
+from django.core.management.base import BaseCommand
+
+from catalog.caching import get_cache_stats
+
+
+class Command(BaseCommand):
+    help = 'Reports the hit ratio of the catalog page caches.'
+
+    def handle(self, *args, **options):
+        for name in ('book-detail', 'author-detail', 'page'):
+            stats = get_cache_stats(name)
+            requests = stats['hits'] + stats['misses']
+            ratio = stats['hits'] / requests if requests else 0
+            self.stdout.write('{0}: {1} hits, {2} misses, hit ratio {3:.1%}'.format(
+                name, stats['hits'], stats['misses'], ratio))
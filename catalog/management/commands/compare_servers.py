@@ -0,0 +1,148 @@
+'''
+Load-tests the catalog pages under gunicorn's sync (WSGI) workers and under gunicorn with uvicorn (ASGI) workers,
+running either the async views (see catalog/async_views.py) or the sync ones, with the same number of worker
+processes, and reports the throughput and latency percentiles of each.
+
+The servers are started one after the other on the database of DATABASE_URL, so run it against a database
+filled by the generate_dataset command (and a file-based one: an in-memory database isn't shared with the
+servers). The page cache is disabled in every server, so every request runs its view; the detail content cache
+stays enabled as in production. Requests are made anonymously by concurrent clients, each keeping its
+connection open, for --duration seconds per server.
+
+Usage: python manage.py compare_servers [--workers 2] [--concurrency 16] [--duration 20]
+'''
+
+
+import http.client
+import os
+import subprocess
+import sys
+import threading
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db.models import Count
+from django.urls import reverse
+
+from catalog.management.commands.benchmark_views import percentile
+from catalog.models import Author, Book
+
+
+SERVERS = {
+    'wsgi': (['locallibrary.wsgi'], {}),
+    'asgi': (['locallibrary.asgi:application', '-k', 'uvicorn.workers.UvicornWorker'],
+             {'CATALOG_ASYNC_VIEWS': 'True'}),
+    # ASGI with the sync views, to tell the cost of the server apart from that of the async views
+    'asgi-sync-views': (['locallibrary.asgi:application', '-k', 'uvicorn.workers.UvicornWorker'],
+                        {'CATALOG_ASYNC_VIEWS': 'False'}),
+}
+
+
+class Command(BaseCommand):
+    help = 'Compares the throughput and latency of the catalog pages under WSGI sync workers and ASGI workers.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--workers', type=int, default=os.cpu_count(),
+                            help='Worker processes of each server (default: the number of CPUs).')
+        parser.add_argument('--concurrency', type=int, default=16, help='Concurrent clients.')
+        parser.add_argument('--duration', type=float, default=20, help='Seconds of load per server.')
+        parser.add_argument('--port', type=int, default=8765)
+        parser.add_argument('--servers', nargs='+', choices=list(SERVERS), default=list(SERVERS))
+
+    def handle(self, *args, **options):
+        paths = self.paths()
+        for name in options['servers']:
+            arguments, environment = SERVERS[name]
+            process = self.start(arguments, environment, options)
+            try:
+                result = self.load(paths, options)
+            finally:
+                process.terminate()
+                process.wait(timeout=30)
+            self.report(name, result, options)
+
+    def paths(self):
+        book = (Book.objects.annotate(copies=Count('bookinstance')).order_by('-copies')
+                .values_list('pk', flat=True).first())
+        author = (Author.objects.annotate(books=Count('book')).order_by('-books')
+                  .values_list('pk', flat=True).first())
+        if book is None or author is None:
+            raise CommandError('The database has no books or authors, run generate_dataset first.')
+        return [
+            reverse('index'),
+            reverse('books'), reverse('books') + '?page=2',
+            reverse('authors'), reverse('authors') + '?page=2',
+            reverse('book-detail', args=[book]),
+            reverse('author-detail', args=[author]), reverse('author-detail', args=[author]) + '?page=2',
+        ]
+
+    def start(self, arguments, environment, options):
+        env = dict(os.environ, DJANGO_DEBUG='False', CATALOG_PAGE_CACHE_ALIAS='', **environment)
+        process = subprocess.Popen(
+            [sys.executable, '-m', 'gunicorn', *arguments, '--workers', str(options['workers']),
+             '--bind', '127.0.0.1:{0}'.format(options['port']), '--log-level', 'warning'],
+            cwd=settings.BASE_DIR, env=env)
+        deadline = time.monotonic() + 30
+        while time.monotonic() < deadline:
+            try:
+                connection = http.client.HTTPConnection('127.0.0.1', options['port'], timeout=5)
+                connection.request('GET', reverse('index'))
+                connection.getresponse().read()
+                return process
+            except OSError:
+                time.sleep(0.2)
+        process.terminate()
+        raise CommandError('The server did not start.')
+
+    def load(self, paths, options):
+        timings = []
+        errors = []
+        lock = threading.Lock()
+        stop_at = time.monotonic() + options['duration']
+
+        def client(number):
+            connection = http.client.HTTPConnection('127.0.0.1', options['port'], timeout=30)
+            own_timings = []
+            request = number
+            while time.monotonic() < stop_at:
+                path = paths[request % len(paths)]
+                request += 1
+                started = time.perf_counter()
+                try:
+                    connection.request('GET', path)
+                    response = connection.getresponse()
+                    response.read()
+                    if response.status != 200:
+                        errors.append('{0} returned {1}'.format(path, response.status))
+                except (OSError, http.client.HTTPException) as error:
+                    errors.append('{0}: {1}'.format(path, error))
+                    connection.close()
+                    continue
+                own_timings.append((time.perf_counter() - started) * 1000)
+            connection.close()
+            with lock:
+                timings.extend(own_timings)
+
+        started = time.monotonic()
+        threads = [threading.Thread(target=client, args=(number,)) for number in range(options['concurrency'])]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        elapsed = time.monotonic() - started
+        timings.sort()
+        return {'requests': len(timings), 'elapsed': elapsed, 'timings': timings, 'errors': errors}
+
+    def report(self, name, result, options):
+        timings = result['timings']
+        if not timings:
+            self.stdout.write('{0}: no successful requests ({1} errors)'.format(name, len(result['errors'])))
+            return
+        self.stdout.write(
+            '{0} ({1} workers, {2} clients): {3:7.1f} req/s  p50 {4:7.2f} ms  p95 {5:7.2f} ms  p99 {6:7.2f} ms  '
+            '{7} errors'.format(
+                name, options['workers'], options['concurrency'], result['requests'] / result['elapsed'],
+                percentile(timings, 50), percentile(timings, 95), percentile(timings, 99), len(result['errors'])))
+        for error in sorted(set(result['errors']))[:5]:
+            self.stderr.write('  ' + error)
@@ -0,0 +1,47 @@
+'''
+Exports every book, with its author, language and genre names, as CSV or JSON lines.
+
+The export is streamed (see catalog/export.py), so memory use doesn't grow with the size of the catalog.
+
+Usage: python manage.py export_catalog books.csv.gz [--format csv|jsonl] [--gzip] [--chunk-size 2000]
+'''
+
+
+import sys
+
+from django.core.management.base import BaseCommand, CommandError
+
+from catalog.export import FORMATS, export_catalog
+
+
+class Command(BaseCommand):
+    help = 'Streams the whole catalog to a CSV or JSON lines file, optionally gzip-compressed.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', nargs='?', default='-', help="File to write, or '-' for standard output.")
+        parser.add_argument('--format', choices=FORMATS,
+                            help='Output format. By default it is guessed from the file extension.')
+        parser.add_argument('--gzip', action='store_true',
+                            help='Compress the output. Implied by a path ending in .gz.')
+        parser.add_argument('--chunk-size', type=int, default=2000,
+                            help='Number of books read from the database at a time.')
+
+    def handle(self, *args, **options):
+        path = options['path']
+        name = path[:-3] if path.endswith('.gz') else path
+        output_format = options['format'] or ('jsonl' if name.endswith(('.jsonl', '.json')) else 'csv')
+        compress = options['gzip'] or path.endswith('.gz')
+
+        pieces = export_catalog(output_format, compress=compress, chunk_size=options['chunk_size'])
+        try:
+            if path == '-':
+                for piece in pieces:
+                    sys.stdout.buffer.write(piece)
+                sys.stdout.buffer.flush()
+                return
+            with open(path, 'wb') as stream:
+                for piece in pieces:
+                    stream.write(piece)
+        except OSError as error:
+            raise CommandError(error)
+        self.stdout.write(self.style.SUCCESS('Exported the catalog to {0}.'.format(path)))
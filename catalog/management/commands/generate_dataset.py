@@ -0,0 +1,159 @@
+'''
+Fills the database with a synthetic catalog for benchmarking (see the benchmark_views command).
+
+The distributions are skewed like a real library's: a few authors write many books, a few books have many
+copies and a few borrowers have many loans (Pareto-distributed weights). The generator is seeded, so the same
+options always produce the same dataset on an empty database. Objects are written with bulk_create() in
+batches, after which the caches, counters and search indexes are updated as for any bulk change (see
+catalog_bulk_changed in signals.py).
+
+Usage: python manage.py generate_dataset [--authors 2000] [--books 20000] [--copies 100000] [--borrowers 2000]
+'''
+
+
+import datetime
+import random
+import time
+import uuid
+
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from catalog.models import Author, Book, BookInstance, Genre, Language
+from catalog.signals import catalog_bulk_changed
+
+
+FIRST_NAMES = ('Ada', 'Alan', 'Anna', 'Boris', 'Chen', 'Clara', 'David', 'Elena', 'Emile', 'Fatima', 'George',
+               'Hana', 'Ivan', 'Jane', 'Kofi', 'Leila', 'Maria', 'Nils', 'Olga', 'Pedro', 'Ravi', 'Sofia',
+               'Tomas', 'Ursula', 'Victor', 'Wei', 'Yusuf', 'Zoe')
+LAST_NAMES = ('Adams', 'Bauer', 'Costa', 'Dubois', 'Eriksen', 'Fischer', 'Garcia', 'Hughes', 'Ito', 'Jensen',
+              'Kowalski', 'Larsen', 'Moreau', 'Nakamura', 'Okafor', 'Petrov', 'Quinn', 'Rossi', 'Silva', 'Tanaka',
+              'Usman', 'Varga', 'Weber', 'Xu', 'Young', 'Zhang')
+TITLE_WORDS = ('Shadow', 'River', 'Empire', 'Garden', 'Winter', 'Secret', 'Stone', 'Light', 'Night', 'Island',
+               'Memory', 'Fire', 'Glass', 'Silent', 'Last', 'Lost', 'Golden', 'Iron', 'Hidden', 'Distant', 'City',
+               'Ocean', 'Mountain', 'Storm', 'Crown', 'Letters', 'House', 'Journey', 'Song', 'Machine')
+GENRES = ('Fantasy', 'Science Fiction', 'Mystery', 'Romance', 'History', 'Biography', 'Poetry', 'Horror',
+          'Thriller', 'Philosophy', 'Travel', 'Cooking', 'Science', 'Art', 'Children', 'Drama')
+LANGUAGES = ('English', 'French', 'German', 'Spanish', 'Italian', 'Japanese', 'Chinese', 'Portuguese', 'Russian',
+             'Arabic')
+# Share of the copies in each status; loans are drawn separately with --loan-ratio
+OTHER_STATUS_WEIGHTS = {'a': 80, 'r': 8, 'd': 12}
+
+
+def skewed_weights(rng, count, alpha=1.2):
+    # Cumulative Pareto weights: a few items get most of the draws
+    weights = []
+    total = 0
+    for _ in range(count):
+        total += rng.paretovariate(alpha)
+        weights.append(total)
+    return weights
+
+
+def numbered(names, number):
+    # 'Fantasy', ..., then 'Fantasy 16', ... once the names are used up
+    name = names[number % len(names)]
+    return name if number < len(names) else '{0} {1}'.format(name, number)
+
+
+class Command(BaseCommand):
+    help = 'Generates a large synthetic catalog with skewed distributions, for benchmarks.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--authors', type=int, default=2000)
+        parser.add_argument('--books', type=int, default=20000)
+        parser.add_argument('--genres', type=int, default=len(GENRES))
+        parser.add_argument('--languages', type=int, default=len(LANGUAGES))
+        parser.add_argument('--copies', type=int, default=100000)
+        parser.add_argument('--borrowers', type=int, default=2000)
+        parser.add_argument('--loan-ratio', type=float, default=0.2, help='Share of the copies that are on loan.')
+        parser.add_argument('--batch-size', type=int, default=5000)
+        parser.add_argument('--seed', type=int, default=1)
+
+    def handle(self, *args, **options):
+        rng = random.Random(options['seed'])
+        batch_size = options['batch_size']
+        self.verbosity = options['verbosity']
+        self.started = time.monotonic()
+        # Names are numbered from the current counts so the command can be run again on the same database
+        first_book = Book.objects.count()
+        first_user = User.objects.count()
+
+        with transaction.atomic():
+            genre_ids = self.ensure(Genre, [numbered(GENRES, number) for number in range(options['genres'])])
+            language_ids = self.ensure(Language, [numbered(LANGUAGES, number)
+                                                  for number in range(options['languages'])])
+            authors = Author.objects.bulk_create([
+                Author(first_name=rng.choice(FIRST_NAMES), last_name=rng.choice(LAST_NAMES),
+                       date_of_birth=datetime.date(rng.randint(1800, 1995), rng.randint(1, 12), rng.randint(1, 28)))
+                for _ in range(options['authors'])
+            ], batch_size=batch_size)
+            borrowers = User.objects.bulk_create([
+                User(username='reader{0}'.format(first_user + number), password='!')
+                for number in range(options['borrowers'])
+            ], batch_size=batch_size)
+        author_ids = [author.pk for author in authors]
+        user_ids = [user.pk for user in borrowers]
+        self.progress('{0} authors and {1} borrowers'.format(len(author_ids), len(user_ids)))
+
+        author_weights = skewed_weights(rng, len(author_ids))
+        book_ids = []
+        for start in range(0, options['books'], batch_size):
+            count = min(batch_size, options['books'] - start)
+            with transaction.atomic():
+                books = Book.objects.bulk_create([
+                    Book(title=' '.join(rng.sample(TITLE_WORDS, rng.randint(1, 4))),
+                         summary='A synthetic book.', isbn='S{0:012d}'.format(first_book + start + number),
+                         author_id=rng.choices(author_ids, cum_weights=author_weights)[0] if author_ids else None,
+                         language_id=rng.choice(language_ids) if language_ids else None)
+                    for number in range(count)
+                ])
+                Book.genre.through.objects.bulk_create([
+                    Book.genre.through(book_id=book.pk, genre_id=genre_id)
+                    for book in books for genre_id in rng.sample(genre_ids, min(len(genre_ids), rng.randint(1, 3)))
+                ])
+                ids = [book.pk for book in books]
+                transaction.on_commit(lambda ids=ids: catalog_bulk_changed(ids))
+            book_ids.extend(ids)
+            self.progress('{0} books'.format(len(book_ids)))
+
+        book_weights = skewed_weights(rng, len(book_ids))
+        borrower_weights = skewed_weights(rng, len(user_ids))
+        statuses = list(OTHER_STATUS_WEIGHTS)
+        status_weights = list(OTHER_STATUS_WEIGHTS.values())
+        today = datetime.date.today()
+        created = 0
+        for start in range(0, options['copies'] if book_ids else 0, batch_size):
+            copies = []
+            for _ in range(min(batch_size, options['copies'] - start)):
+                copy = BookInstance(id=uuid.UUID(int=rng.getrandbits(128)),
+                                    book_id=rng.choices(book_ids, cum_weights=book_weights)[0],
+                                    imprint='Synthetic Press, {0}'.format(rng.randint(1950, 2024)))
+                if user_ids and rng.random() < options['loan_ratio']:
+                    copy.status = 'o'
+                    copy.borrower_id = rng.choices(user_ids, cum_weights=borrower_weights)[0]
+                    # Loans are due between a month ago (overdue) and three weeks from now
+                    copy.due_back = today + datetime.timedelta(days=rng.randint(-30, 21))
+                else:
+                    copy.status = rng.choices(statuses, status_weights)[0]
+                copies.append(copy)
+            with transaction.atomic():
+                BookInstance.objects.bulk_create(copies)
+                ids = list({copy.book_id for copy in copies})
+                transaction.on_commit(lambda ids=ids: catalog_bulk_changed(ids, copies_only=True))
+            created += len(copies)
+            self.progress('{0} copies'.format(created))
+
+        self.stdout.write(self.style.SUCCESS('Generated {0} authors, {1} books and {2} copies in {3:.0f} s.'.format(
+            len(author_ids), len(book_ids), created, time.monotonic() - self.started)))
+
+    def ensure(self, model, names):
+        # Returns the ids of the objects with these names, creating the missing ones
+        existing = dict(model.objects.filter(name__in=names).values_list('name', 'pk'))
+        model.objects.bulk_create([model(name=name) for name in names if name not in existing])
+        return list(model.objects.filter(name__in=names).values_list('pk', flat=True))
+
+    def progress(self, message):
+        if self.verbosity > 1:
+            self.stdout.write('{0} ({1:.0f} s)'.format(message, time.monotonic() - self.started))
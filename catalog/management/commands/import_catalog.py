@@ -0,0 +1,172 @@
+'''
+Imports books, authors, genres, languages and copies from a CSV or JSON lines file.
+
+Each record describes one book and its copies; see catalog/importing.py for the columns. The file is read as a
+stream in batches. The records of a batch are validated in a pool of worker processes, books whose ISBN is already
+known are skipped, and everything is written with bulk_create() in one transaction per batch.
+
+Usage: python manage.py import_catalog books.csv [--format csv|jsonl] [--batch-size 2000] [--workers 4]
+'''
+
+
+import csv
+import itertools
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+from functools import partial
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+
+from catalog.importing import parse_record
+from catalog.models import Author, Book, BookInstance, Genre, Language
+from catalog.signals import catalog_bulk_changed
+
+
+class Command(BaseCommand):
+    help = 'Imports a catalog feed (CSV or JSON lines) with bulk inserts.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', help="File to import, or '-' for standard input.")
+        parser.add_argument('--format', choices=('csv', 'jsonl'),
+                            help='Input format. By default it is guessed from the file extension.')
+        parser.add_argument('--batch-size', type=int, default=2000,
+                            help='Number of records validated and written per transaction.')
+        parser.add_argument('--workers', type=int, default=os.cpu_count() or 1,
+                            help='Number of validating processes; 0 validates in this process.')
+
+    def handle(self, *args, **options):
+        path = options['path']
+        input_format = options['format'] or ('jsonl' if path.endswith(('.jsonl', '.json')) else 'csv')
+        self.verbosity = options['verbosity']
+
+        # The validation doesn't import the models, so it is told their limits
+        limits = {name: Book._meta.get_field(name).max_length for name in ('title', 'isbn', 'summary')}
+        limits.update({
+            'author_first_name': Author._meta.get_field('first_name').max_length,
+            'author_last_name': Author._meta.get_field('last_name').max_length,
+            'language': Language._meta.get_field('name').max_length,
+            'genres': Genre._meta.get_field('name').max_length,
+            'imprint': BookInstance._meta.get_field('imprint').max_length,
+        })
+        validate = partial(parse_record, limits=limits, statuses=[key for key, label in BookInstance.LOAN_STATUS])
+
+        self.load_lookups()
+        self.stats = dict.fromkeys(('books', 'copies', 'duplicates', 'errors'), 0)
+        started = time.monotonic()
+
+        stream = sys.stdin if path == '-' else open(path, newline='', encoding='utf-8')
+        executor = ProcessPoolExecutor(options['workers']) if options['workers'] > 0 else None
+        try:
+            records = csv.DictReader(stream) if input_format == 'csv' else (line for line in stream if line.strip())
+            number = 1
+            while True:
+                batch = list(itertools.islice(records, options['batch_size']))
+                if not batch:
+                    break
+                if executor:
+                    chunksize = max(1, len(batch) // (options['workers'] * 4))
+                    results = list(executor.map(validate, batch, chunksize=chunksize))
+                else:
+                    results = [validate(raw) for raw in batch]
+                self.import_batch(results, first_number=number)
+                number += len(batch)
+
+                elapsed = time.monotonic() - started
+                self.stdout.write('{0} books, {1} copies imported ({2:.0f} records/s)'.format(
+                    self.stats['books'], self.stats['copies'], (number - 1) / elapsed if elapsed else 0))
+        except OSError as error:
+            raise CommandError(error)
+        finally:
+            if executor:
+                executor.shutdown()
+            if stream is not sys.stdin:
+                stream.close()
+
+        self.stdout.write(self.style.SUCCESS(
+            'Imported {books} books and {copies} copies; skipped {duplicates} duplicate ISBNs '
+            'and {errors} invalid records.'.format(**self.stats)))
+
+    def load_lookups(self):
+        # Everything records are matched against is loaded once, so resolving a record needs no query
+        self.isbns = set(Book.objects.values_list('isbn', flat=True).iterator())
+        self.authors = {(first, last): pk for pk, first, last in
+                        Author.objects.values_list('pk', 'first_name', 'last_name').iterator()}
+        self.genres = {name: pk for pk, name in Genre.objects.values_list('pk', 'name').iterator()}
+        self.languages = {name: pk for pk, name in Language.objects.values_list('pk', 'name').iterator()}
+
+    def import_batch(self, results, first_number):
+        records = []
+        for number, (record, error) in enumerate(results, start=first_number):
+            if error:
+                self.stats['errors'] += 1
+                if self.verbosity > 1:
+                    self.stderr.write('Record {0}: {1}'.format(number, error))
+            elif record['isbn'] in self.isbns:
+                self.stats['duplicates'] += 1
+            else:
+                self.isbns.add(record['isbn'])
+                records.append(record)
+        if not records:
+            return
+
+        with transaction.atomic():
+            new_authors = self.create_missing(
+                Author, self.authors,
+                {(r['author_first_name'], r['author_last_name']) for r in records
+                 if r['author_first_name'] or r['author_last_name']},
+                ('first_name', 'last_name'))
+            self.create_missing(Genre, self.genres, {genre for r in records for genre in r['genres']}, ('name',))
+            self.create_missing(Language, self.languages, {r['language'] for r in records if r['language']},
+                                ('name',))
+
+            books = Book.objects.bulk_create([
+                Book(title=r['title'], isbn=r['isbn'], summary=r['summary'],
+                     author_id=self.authors.get((r['author_first_name'], r['author_last_name'])),
+                     language_id=self.languages.get(r['language']))
+                for r in records
+            ])
+            if any(book.pk is None for book in books):
+                # Databases that can't return the new primary keys: look them up by the unique ISBN
+                pks = dict(Book.objects.filter(isbn__in=[book.isbn for book in books]).values_list('isbn', 'pk'))
+                for book in books:
+                    book.pk = pks[book.isbn]
+
+            Book.genre.through.objects.bulk_create([
+                Book.genre.through(book_id=book.pk, genre_id=self.genres[genre])
+                for book, r in zip(books, records) for genre in r['genres']
+            ])
+            copies = BookInstance.objects.bulk_create([
+                BookInstance(book_id=book.pk, imprint=r['imprint'], status=r['status'])
+                for book, r in zip(books, records) for copy in range(r['copies'])
+            ], batch_size=5000)
+
+            # bulk_create() sends no signals, so the caches, counters and indexes are updated here
+            book_ids = [book.pk for book in books]
+            transaction.on_commit(partial(catalog_bulk_changed, book_ids, new_authors))
+
+        self.stats['books'] += len(books)
+        self.stats['copies'] += len(copies)
+
+    def create_missing(self, model, lookup, keys, fields):
+        # Creates the objects whose key isn't in lookup yet, adds them to it and returns their ids.
+        # A key is the value of the single field in fields, or a tuple of the values of the fields.
+        missing = sorted(keys - lookup.keys())
+        if not missing:
+            return []
+        values = (lambda key: key) if len(fields) > 1 else (lambda key: (key,))
+        objects = model.objects.bulk_create([model(**dict(zip(fields, values(key)))) for key in missing])
+
+        if any(obj.pk is None for obj in objects):
+            # Databases that can't return the new primary keys: the newest object with each key is the one created
+            wanted = set(missing)
+            rows = model.objects.filter(**{fields[0] + '__in': {values(key)[0] for key in missing}}).order_by('pk')
+            for pk, *row in rows.values_list('pk', *fields):
+                key = tuple(row) if len(fields) > 1 else row[0]
+                if key in wanted:
+                    lookup[key] = pk
+        else:
+            lookup.update(zip(missing, (obj.pk for obj in objects)))
+        return [lookup[key] for key in missing]
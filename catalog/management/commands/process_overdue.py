@@ -0,0 +1,132 @@
+'''
+Finds the loans that became overdue since the last run and emails each borrower a single reminder listing them.
+
+A loan is overdue once its due_back date is before today. The command remembers the date of its last run in a
+JobCheckpoint, so each run only reads the loans that fell due since then (due_back in [last run, today)) instead
+of every overdue loan; --full starts over from the oldest loan. Emails are sent through the configured
+EMAIL_BACKEND, several per connection.
+
+The borrowers are reminded in id order, and the checkpoint records the last one whose reminder the backend
+accepted. A run that stops early (a reminder that can't be sent, or a crash) is resumed after that borrower by the
+next one, which then goes on with the loans that fell due since.
+
+Usage: python manage.py process_overdue [--full] [--dry-run] [--batch-size 100]
+'''
+
+
+import datetime
+import itertools
+
+from django.conf import settings
+from django.core.mail import EmailMessage, get_connection
+from django.core.management.base import BaseCommand, CommandError
+from django.template.loader import render_to_string
+from django.utils import timezone
+
+from catalog.models import BookInstance, JobCheckpoint
+
+
+CHECKPOINT_NAME = 'process_overdue'
+
+
+class Command(BaseCommand):
+    help = 'Sends one reminder per borrower for the loans that became overdue since the previous run.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--full', action='store_true',
+                            help='Ignore the previous run and remind borrowers of every overdue loan.')
+        parser.add_argument('--dry-run', action='store_true',
+                            help='Report what would be sent without sending emails or moving the checkpoint.')
+        parser.add_argument('--batch-size', type=int, default=100,
+                            help='Number of emails sent per connection to the mail server.')
+
+    def handle(self, *args, **options):
+        self.today = today = datetime.date.today()
+        self.verbosity = options['verbosity']
+        self.dry_run = options['dry_run']
+        self.batch_size = options['batch_size']
+        self.stats = dict.fromkeys(('loans', 'borrowers', 'emails', 'skipped'), 0)
+
+        # (since, until, after borrower id) ranges of due_back dates to remind of
+        checkpoint = JobCheckpoint.objects.filter(name=CHECKPOINT_NAME).first()
+        if options['full'] or checkpoint is None:
+            ranges = [(datetime.date.min, today, None)]
+        elif checkpoint.until is not None:
+            # An interrupted run: its range is finished first, after the borrowers already reminded
+            ranges = [(checkpoint.position, checkpoint.until, checkpoint.last_id), (checkpoint.until, today, None)]
+        else:
+            ranges = [(checkpoint.position, today, None)]
+        for since, until, after_id in ranges:
+            if since < until:
+                self.remind(since, until, after_id)
+
+        self.stdout.write(self.style.SUCCESS(
+            '{prefix}{emails} reminders for {loans} overdue loans of {borrowers} borrowers '
+            '({skipped} loans without an email address).'.format(
+                prefix='Would send ' if self.dry_run else 'Sent ', **self.stats)))
+
+    def remind(self, since, until, after_id):
+        loans = BookInstance.objects.filter(status='o', due_back__gte=since, due_back__lt=until)
+        if after_id is not None:
+            loans = loans.filter(borrower_id__gt=after_id)
+        rows = loans.order_by('borrower_id', 'due_back').values_list(
+            'borrower_id', 'borrower__username', 'borrower__first_name', 'borrower__email',
+            'book__title', 'due_back',
+        ).iterator(chunk_size=2000)
+
+        if not self.dry_run:
+            JobCheckpoint.objects.update_or_create(
+                name=CHECKPOINT_NAME, defaults={'position': since, 'until': until, 'last_id': after_id})
+        batch = []
+        for borrower_id, borrower_loans in itertools.groupby(rows, key=lambda row: row[0]):
+            borrower_loans = list(borrower_loans)
+            self.stats['loans'] += len(borrower_loans)
+            self.stats['borrowers'] += 1
+            email = borrower_loans[0][3]
+            if borrower_id is None or not email:
+                # Nobody to remind: a loan without borrower, or a borrower without an email address
+                self.stats['skipped'] += len(borrower_loans)
+                continue
+            batch.append((borrower_id, self.build_message(borrower_loans, self.today)))
+            if len(batch) >= self.batch_size:
+                self.send(batch)
+                batch = []
+        self.send(batch)
+
+        # Every reminder of the range has been handed to the backend
+        if not self.dry_run:
+            JobCheckpoint.objects.update_or_create(
+                name=CHECKPOINT_NAME, defaults={'position': until, 'until': None, 'last_id': None})
+
+    def build_message(self, loans, today):
+        username, first_name, email = loans[0][1:4]
+        body = render_to_string('catalog/overdue_reminder_email.txt', {
+            'name': first_name or username,
+            'loans': [{'title': title, 'due_back': due_back, 'days_overdue': (today - due_back).days}
+                      for _, _, _, _, title, due_back in loans],
+        })
+        subject = 'Overdue library book' if len(loans) == 1 else '{0} overdue library books'.format(len(loans))
+        return EmailMessage(subject, body, settings.DEFAULT_FROM_EMAIL, [email])
+
+    def send(self, batch):
+        # batch holds (borrower id, message) pairs, in borrower order
+        if not batch:
+            return
+        if self.dry_run:
+            if self.verbosity > 1:
+                for _, message in batch:
+                    self.stdout.write('{0}: {1}'.format(message.to[0], message.subject))
+            self.stats['emails'] += len(batch)
+            return
+        # One connection for the whole batch instead of one per email. The messages are handed over one at a time,
+        # so that the checkpoint only moves past the borrowers whose reminder was accepted.
+        with get_connection() as connection:
+            for borrower_id, message in batch:
+                try:
+                    sent = connection.send_messages([message])
+                except Exception as error:
+                    raise CommandError('Could not send the reminder to {0}: {1}'.format(message.to[0], error))
+                if not sent:
+                    raise CommandError('Could not send the reminder to {0}.'.format(message.to[0]))
+                self.stats['emails'] += 1
+                JobCheckpoint.objects.filter(name=CHECKPOINT_NAME).update(last_id=borrower_id, updated=timezone.now())
@@ -0,0 +1,55 @@
+'''
+Recounts the BookAvailability counters from BookInstance and reports the books whose counters had drifted.
+Counters can drift when copies are changed without save()/delete() (queryset.update(), raw SQL, etc.).
+
+Usage: python manage.py rebuild_book_availability [--chunk-size 1000] [--dry-run]
+'''
+
+
+from django.core.management.base import BaseCommand
+
+from catalog.models import Book, BookAvailability
+
+
+class Command(BaseCommand):
+    help = 'Rebuilds the per-book availability counters in chunks and reports drift.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--chunk-size', type=int, default=1000,
+                            help='Number of books recounted per query and transaction.')
+        parser.add_argument('--dry-run', action='store_true',
+                            help='Only report drift, without rewriting the counters.')
+
+    def handle(self, *args, **options):
+        chunk_size = options['chunk_size']
+        empty = dict.fromkeys(BookAvailability.STATUS_COLUMNS.values(), 0)
+        checked = drifted = 0
+        last_pk = 0
+
+        # Walks the books by primary key, so each chunk is an indexed range scan rather than an OFFSET
+        while True:
+            book_ids = list(
+                Book.objects.filter(pk__gt=last_pk).order_by('pk').values_list('pk', flat=True)[:chunk_size]
+            )
+            if not book_ids:
+                break
+            last_pk = book_ids[-1]
+
+            stored = BookAvailability.totals(book_ids)
+            actual = BookAvailability.count_copies(book_ids)
+            for book_id in book_ids:
+                if stored.get(book_id, empty) != actual.get(book_id, empty):
+                    drifted += 1
+                    if options['verbosity'] > 1:
+                        self.stdout.write('Book {0}: stored {1}, actual {2}'.format(
+                            book_id, stored.get(book_id, empty), actual.get(book_id, empty)))
+
+            if not options['dry_run']:
+                BookAvailability.rebuild(book_ids)
+            checked += len(book_ids)
+
+        message = 'Checked {0} books, {1} had drifted.'.format(checked, drifted)
+        if drifted and options['dry_run']:
+            self.stdout.write(self.style.WARNING(message))
+        else:
+            self.stdout.write(self.style.SUCCESS(message))
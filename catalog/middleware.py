@@ -0,0 +1,278 @@
+'''
+This file contains the catalog's middleware, enabled in MIDDLEWARE in locallibrary/settings.py.
+
+ProfilingMiddleware profiles a single request on demand: a staff user sends the X-Profile header (or adds
+?_profile to the URL) and the request is run under cProfile, with the time of every SQL statement and every
+template render recorded. The report is saved as a ProfileReport, viewed in the admin; its id is returned in the
+X-Profile-Report header, or the report itself is returned instead of the page with ?_profile=text.
+
+Requests without the header or parameter only cost the two lookups in __call__: nothing is wrapped or patched
+unless a request is being profiled. Under ASGI, a profiled request runs in a single thread, like under WSGI; the
+queries the async views (see ./async_views.py) run in the thread pool are not part of its report.
+
+PageCacheMiddleware serves the book and author list and detail pages of anonymous visitors from the cache
+named by settings.CATALOG_PAGE_CACHE_ALIAS. Page keys include the version of what the page shows (see
+./caching.py), so saving a book or author only makes its own pages, and the lists, miss.
+'''
+
+
+import asyncio
+import cProfile
+import hashlib
+import io
+import pstats
+import threading
+import time
+
+from asgiref.sync import async_to_sync, sync_to_async
+from django.conf import settings
+from django.core.cache import caches
+from django.db import connections
+from django.http import HttpResponse
+from django.template.base import Template
+from django.utils.cache import get_conditional_response
+from django.utils.deprecation import MiddlewareMixin
+from django.utils.http import parse_http_date_safe
+
+from .caching import get_list_version, get_version, record_cache_access
+from .models import Author, Book, ProfileReport
+
+
+PROFILE_HEADER = 'HTTP_X_PROFILE'
+PROFILE_PARAMETER = '_profile'
+# Number of functions listed in each section of the report
+TOP_FUNCTIONS = 40
+
+
+class _TemplateTimer:
+    '''
+    Times Template._render (which also runs for extended and included templates) while at least one request is
+    being profiled. Only the renders of the threads that are profiling are recorded.
+    '''
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.users = 0
+        self.original = None
+        self.local = threading.local()
+
+    def start(self, records):
+        self.local.records = records
+        self.local.depth = 0
+        with self.lock:
+            if self.users == 0:
+                # Renders already running in other threads keep calling the original through this closure
+                original = self.original = Template._render
+                local = self.local
+
+                def timed_render(template, context):
+                    records = getattr(local, 'records', None)
+                    if records is None:
+                        return original(template, context)
+                    local.depth += 1
+                    started = time.perf_counter()
+                    try:
+                        return original(template, context)
+                    finally:
+                        local.depth -= 1
+                        records.append({
+                            'name': template.origin.template_name or template.origin.name,
+                            'duration_ms': (time.perf_counter() - started) * 1000,
+                            'depth': local.depth,
+                        })
+
+                Template._render = timed_render
+            self.users += 1
+
+    def stop(self):
+        self.local.records = None
+        with self.lock:
+            self.users -= 1
+            if self.users == 0:
+                Template._render = self.original
+                self.original = None
+
+
+_template_timer = _TemplateTimer()
+
+
+class _QueryTimer:
+
+    def __init__(self, alias, records):
+        self.alias = alias
+        self.records = records
+
+    def __call__(self, execute, sql, params, many, context):
+        started = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.records.append({
+                'sql': sql,
+                'params': repr(params)[:500],
+                'duration_ms': (time.perf_counter() - started) * 1000,
+                'alias': self.alias,
+            })
+
+
+def _format_profile(profiler):
+    stream = io.StringIO()
+    stats = pstats.Stats(profiler, stream=stream)
+    stats.strip_dirs()
+    stream.write('Top functions by cumulative time\n')
+    stats.sort_stats('cumulative').print_stats(TOP_FUNCTIONS)
+    stream.write('\nTop functions by own time\n')
+    stats.sort_stats('tottime').print_stats(TOP_FUNCTIONS)
+    stream.write('\nCall tree (callees of the top functions by cumulative time)\n')
+    stats.sort_stats('cumulative').print_callees(TOP_FUNCTIONS // 2)
+    return stream.getvalue()
+
+
+class ProfilingMiddleware:
+    # Must come after AuthenticationMiddleware, which sets request.user. The middleware listed after this one
+    # and the view are profiled.
+
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if asyncio.iscoroutinefunction(get_response):
+            # Tells Django to await the middleware rather than call it in a thread (as MiddlewareMixin does)
+            self._is_coroutine = asyncio.coroutines._is_coroutine
+
+    def __call__(self, request):
+        if asyncio.iscoroutinefunction(self.get_response):
+            return self.__acall__(request)
+        if not self.is_requested(request) or not request.user.is_staff:
+            return self.get_response(request)
+        return self.profile(request, self.get_response)
+
+    async def __acall__(self, request):
+        if not self.is_requested(request) or not await sync_to_async(lambda: request.user.is_staff)():
+            return await self.get_response(request)
+        return await sync_to_async(self.profile)(request, async_to_sync(self.get_response))
+
+    def is_requested(self, request):
+        if PROFILE_HEADER in request.META:
+            return True
+        # The parameter name may only be part of another parameter
+        return PROFILE_PARAMETER in request.META.get('QUERY_STRING', '') and PROFILE_PARAMETER in request.GET
+
+    def profile(self, request, get_response):
+        queries = []
+        templates = []
+        wrappers = [connection.execute_wrapper(_QueryTimer(connection.alias, queries))
+                    for connection in connections.all()]
+        profiler = cProfile.Profile()
+
+        for wrapper in wrappers:
+            wrapper.__enter__()
+        _template_timer.start(templates)
+        started = time.perf_counter()
+        try:
+            profiler.enable()
+            try:
+                response = get_response(request)
+            finally:
+                profiler.disable()
+        finally:
+            duration = (time.perf_counter() - started) * 1000
+            _template_timer.stop()
+            for wrapper in reversed(wrappers):
+                wrapper.__exit__(None, None, None)
+
+        report = ProfileReport.objects.create(
+            user=request.user,
+            method=request.method,
+            path=request.get_full_path()[:2000],
+            status_code=response.status_code,
+            duration_ms=duration,
+            query_count=len(queries),
+            query_time_ms=sum(query['duration_ms'] for query in queries),
+            # Only the outermost renders, nested ones are part of their time
+            template_time_ms=sum(template['duration_ms'] for template in templates if template['depth'] == 0),
+            profile=_format_profile(profiler),
+            queries=queries,
+            templates=templates,
+        )
+
+        if request.GET.get(PROFILE_PARAMETER) == 'text' or request.META.get(PROFILE_HEADER) == 'text':
+            response = HttpResponse(self.as_text(report), content_type='text/plain; charset=utf-8')
+        response['X-Profile-Report'] = str(report.pk)
+        return response
+
+    def as_text(self, report):
+        lines = [
+            '{0} {1} -> {2}'.format(report.method, report.path, report.status_code),
+            'Total {0:.1f} ms; {1} queries in {2:.1f} ms; templates {3:.1f} ms'.format(
+                report.duration_ms, report.query_count, report.query_time_ms, report.template_time_ms),
+            '',
+            'Queries',
+        ]
+        lines.extend('{0:8.2f} ms  {1}'.format(query['duration_ms'], query['sql']) for query in report.queries)
+        lines.extend(['', 'Templates'])
+        lines.extend('{0:8.2f} ms  {1}{2}'.format(template['duration_ms'], '  ' * template['depth'], template['name'])
+                     for template in report.templates)
+        lines.extend(['', report.profile])
+        return '\n'.join(lines)
+
+
+# Cached URL names, mapped to the version their pages depend on: (model, True) for the detail page of the
+# object in the pk URL argument, (model, False) for a list of the model's objects. The index page is not cached,
+# as it counts the visitor's visits.
+CACHED_PAGES = {
+    'books': (Book, False),
+    'book-detail': (Book, True),
+    'authors': (Author, False),
+    'author-detail': (Author, True),
+}
+
+
+class PageCacheMiddleware(MiddlewareMixin):
+    # Must come after AuthenticationMiddleware. Pages are looked up in process_view(), once the URL is resolved,
+    # and stored in process_response() on the way out. MiddlewareMixin makes it usable under both WSGI and ASGI.
+
+    @property
+    def alias(self):
+        return settings.CATALOG_PAGE_CACHE_ALIAS
+
+    def process_response(self, request, response):
+        key = getattr(request, '_page_cache_key', None)
+        if key is not None and self.is_cacheable(response):
+            caches[self.alias].set(key, (response.status_code, list(response.items()), response.content),
+                                   settings.CATALOG_PAGE_CACHE_TIMEOUT)
+        return response
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        if not self.alias or request.method not in ('GET', 'HEAD'):
+            return None
+        match = request.resolver_match
+        page = CACHED_PAGES.get(match.url_name) if match.namespace == '' else None
+        if page is None or request.user.is_authenticated:
+            return None
+
+        model, is_detail = page
+        version = get_version(model, view_kwargs.get('pk')) if is_detail else get_list_version(model)
+        key = 'catalog:page:{0}:{1}:{2}'.format(
+            match.url_name, version, hashlib.md5(request.get_full_path().encode()).hexdigest())
+
+        cached = caches[self.alias].get(key)
+        record_cache_access('page', hit=cached is not None)
+        if cached is None:
+            request._page_cache_key = key
+            return None
+        status, headers, content = cached
+        response = HttpResponse(content, status=status)
+        for header, value in headers:
+            response[header] = value
+        response['X-Page-Cache'] = 'hit'
+        # The stored page carries the ETag and Last-Modified set by the view, so revalidations still get a 304
+        return get_conditional_response(request, etag=response.get('ETag'),
+                                        last_modified=parse_http_date_safe(response.get('Last-Modified')),
+                                        response=response)
+
+    def is_cacheable(self, response):
+        # A response setting cookies (e.g. a session or CSRF cookie) belongs to one visitor
+        return (response.status_code == 200 and not response.streaming and not response.cookies
+                and 'private' not in response.get('Cache-Control', ''))
@@ -0,0 +1,64 @@
+# Generated by Django 4.0.10 on 2026-10-17 04:22
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+# BookAvailability.STATUS_COLUMNS as of this migration: BookInstance.LOAN_STATUS keys to the counter columns
+STATUS_COLUMNS = {
+    'd': 'maintenance',
+    'o': 'on_loan',
+    'a': 'available',
+    'r': 'reserved',
+}
+
+
+# Counts the existing copies, as BookAvailability.rebuild() does, so the counters start out right. The
+# historical models are used, as the current ones may have fields this migration doesn't know about yet.
+def count_existing_copies(apps, schema_editor):
+    BookAvailability = apps.get_model('catalog', 'BookAvailability')
+    BookInstance = apps.get_model('catalog', 'BookInstance')
+    alias = schema_editor.connection.alias
+    columns = STATUS_COLUMNS
+
+    counts = {}
+    rows = (
+        BookInstance.objects.using(alias).filter(book__isnull=False, status__in=columns)
+        .values('book_id', 'status').annotate(copies=models.Count('pk')).order_by()
+    )
+    for row in rows:
+        counts.setdefault(row['book_id'], {})[columns[row['status']]] = row['copies']
+    BookAvailability.objects.using(alias).bulk_create(
+        [BookAvailability(book_id=book_id, shard=0, **book_counts) for book_id, book_counts in counts.items()],
+        batch_size=1000,
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('catalog', '0025_auto_20220222_0623'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='BookAvailability',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('shard', models.PositiveSmallIntegerField(default=0)),
+                ('maintenance', models.IntegerField(default=0)),
+                ('on_loan', models.IntegerField(default=0)),
+                ('available', models.IntegerField(default=0)),
+                ('reserved', models.IntegerField(default=0)),
+                ('book', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='availability', to='catalog.book')),
+            ],
+            options={
+                'verbose_name_plural': 'book availability',
+            },
+        ),
+        migrations.AddConstraint(
+            model_name='bookavailability',
+            constraint=models.UniqueConstraint(fields=('book', 'shard'), name='unique_book_availability_shard'),
+        ),
+        migrations.RunPython(count_existing_copies, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,77 @@
+# Creates the full-text search index of catalog/search.py and indexes the existing books. The SQL is copied from
+# the search backends as of this migration, so that later changes to catalog/search.py don't change it.
+
+from django.db import migrations
+
+
+SEARCH_TABLE = 'catalog_book_search'
+
+CREATE_SQL = {
+    'sqlite': [
+        'CREATE VIRTUAL TABLE IF NOT EXISTS {0} USING fts5('
+        'title, summary, isbn, author, tokenize = "unicode61 remove_diacritics 2")'.format(SEARCH_TABLE),
+    ],
+    'postgresql': [
+        'CREATE TABLE IF NOT EXISTS {0} ('
+        'book_id bigint PRIMARY KEY REFERENCES catalog_book (id) ON DELETE CASCADE, '
+        'document tsvector NOT NULL)'.format(SEARCH_TABLE),
+        'CREATE INDEX IF NOT EXISTS {0}_document ON {0} USING GIN (document)'.format(SEARCH_TABLE),
+    ],
+}
+
+# Inserts a row, whose parameters are given by the function from (book_id, title, summary, isbn, author_name)
+INDEX_SQL = {
+    'sqlite': (
+        'INSERT INTO {0} (rowid, title, summary, isbn, author) VALUES (%s, %s, %s, %s, %s)'.format(SEARCH_TABLE),
+        lambda pk, title, summary, isbn, author: (pk, title, summary, isbn, author),
+    ),
+    'postgresql': (
+        'INSERT INTO {0} (book_id, document) VALUES (%s, '
+        "setweight(to_tsvector('english', %s), 'A') || setweight(to_tsvector('simple', %s), 'A') || "
+        "setweight(to_tsvector('simple', %s), 'B') || setweight(to_tsvector('english', %s), 'C')) "
+        'ON CONFLICT (book_id) DO UPDATE SET document = EXCLUDED.document'.format(SEARCH_TABLE),
+        lambda pk, title, summary, isbn, author: (pk, title, isbn, author, summary),
+    ),
+}
+
+
+def create_search_index(apps, schema_editor):
+    vendor = schema_editor.connection.vendor
+    if vendor not in CREATE_SQL:
+        # Other databases are searched without an index
+        return
+    Book = apps.get_model('catalog', 'Book')
+    books = Book.objects.using(schema_editor.connection.alias).order_by('pk').values_list(
+        'pk', 'title', 'summary', 'isbn', 'author__first_name', 'author__last_name')
+
+    index_sql, params = INDEX_SQL[vendor]
+
+    with schema_editor.connection.cursor() as cursor:
+        for sql in CREATE_SQL[vendor]:
+            cursor.execute(sql)
+        rows = []
+        for pk, title, summary, isbn, first_name, last_name in books.iterator(chunk_size=2000):
+            author = ' '.join(name for name in (first_name, last_name) if name)
+            rows.append(params(pk, title, summary, isbn, author))
+            if len(rows) == 2000:
+                cursor.executemany(index_sql, rows)
+                rows = []
+        if rows:
+            cursor.executemany(index_sql, rows)
+
+
+def drop_search_index(apps, schema_editor):
+    if schema_editor.connection.vendor in CREATE_SQL:
+        with schema_editor.connection.cursor() as cursor:
+            cursor.execute('DROP TABLE IF EXISTS {0}'.format(SEARCH_TABLE))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('catalog', '0026_bookavailability'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_search_index, drop_search_index),
+    ]
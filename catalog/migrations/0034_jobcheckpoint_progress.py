@@ -0,0 +1,23 @@
+# Generated by Django 4.0.10 on 2026-10-17 06:25
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('catalog', '0033_bookinstance_version'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='jobcheckpoint',
+            name='last_id',
+            field=models.BigIntegerField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='jobcheckpoint',
+            name='until',
+            field=models.DateField(blank=True, null=True),
+        ),
+    ]
@@ -6,9 +6,11 @@ Models are database agnostic, and Django automatically handles boilerplate datab
 
 # Generates a Universally Unique Identifier using pseudo randomness.
 # Probability of a duplicate is so low, it is essentially unique.
+import random
 import uuid
 
-from django.db import models
+from django.conf import settings
+from django.db import IntegrityError, models, transaction
 from django.urls import reverse
 from datetime import date
 # User is an automatically created model in Django
@@ -23,6 +25,12 @@ class Genre(models.Model):
         help_text="Enter a book genre (e.g. Science Fiction, French Poetry etc.)"
         )
 
+    class Meta:
+        # Serves the name lookups of the book forms (see ./lookups.py), which page by (name, id)
+        indexes = [
+            models.Index(fields=['name', 'id'], name='genre_name_idx'),
+        ]
+
     # Useful to get string representation once you have a model instance
     def __str__(self):
         return self.name
@@ -32,6 +40,12 @@ class Language(models.Model):
     name = models.CharField(max_length=200,
                             help_text="Enter the book's natural language (e.g. English, French, Japanese etc.)")
 
+    class Meta:
+        # Serves the name lookups of the book forms (see ./lookups.py), which page by (name, id)
+        indexes = [
+            models.Index(fields=['name', 'id'], name='language_name_idx'),
+        ]
+
     def __str__(self):
         return self.name
 
@@ -47,6 +61,9 @@ class Book(models.Model):
     # A Book model can contain many genres (and a genre can be included in many Book models)
     genre = models.ManyToManyField(Genre, help_text="Select a genre for this book")
     language = models.ForeignKey('Language', on_delete=models.SET_NULL, null=True)
+    # Also moved forward when something shown on the book's page changes: its copies, author, genres or language
+    # (see ./signals.py). Used for conditional GET requests in ./views.py.
+    updated_at = models.DateTimeField(auto_now=True, db_index=True)
 
     class Meta:
         # When you query for Book models, the list will be returned sorted by these criteria
@@ -79,6 +96,10 @@ class BookInstance(models.Model):
     due_back = models.DateField(null=True, blank=True)
     # Note that User is a model automatically provided by Django!
     borrower = models.ForeignKey(User, on_delete=models.SET_NULL, null=True, blank=True)
+    updated_at = models.DateTimeField(auto_now=True, db_index=True)
+    # Incremented by every change of the copy. The loan changes in ./loans.py only update the copy if it still has
+    # the version it was read with, so a change made in the meantime is never overwritten.
+    version = models.PositiveIntegerField(default=0, editable=False)
 
     @property
     def is_overdue(self):
@@ -105,10 +126,171 @@ class BookInstance(models.Model):
         # As the user logs in, we can define logic conditioned on these permissions.
         # For example, we can condition what the user sees. This permission is used in ./views.py (renew_book_librarian)
         permissions = (("can_mark_returned", "Set book as returned"),)
+        # Indexes for the loan lists in ./views.py and the overdue scan. The partial indexes only hold the copies
+        # on loan (a small part of the table) in the order the lists are paged in; databases without partial
+        # indexes skip them and use the (status, due_back) index instead, which also serves the status counts.
+        indexes = [
+            models.Index(fields=['borrower', 'due_back', 'id'], condition=models.Q(status='o'),
+                         name='bookinst_borrower_loans_idx'),
+            models.Index(fields=['due_back', 'id'], condition=models.Q(status='o'), name='bookinst_loans_due_idx'),
+            models.Index(fields=['status', 'due_back'], name='bookinst_status_due_idx'),
+        ]
 
     def __str__(self):
         return '{0} ({1})'.format(self.id, self.book.title)
 
+    # Django calls this class method to create instances loaded from the database. The loaded book and status
+    # are remembered so that the receivers in ./signals.py can tell what a later save() or delete() changed.
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        instance._remember_loaded_values()
+        return instance
+
+    def refresh_from_db(self, using=None, fields=None):
+        super().refresh_from_db(using=using, fields=fields)
+        # Loading a deferred field refreshes only that field; the other fields may hold unsaved changes
+        self._remember_loaded_values(fields)
+
+    def save(self, *args, **kwargs):
+        # A plain save() rewrites every column, so it makes every copy read before it stale (see ./loans.py)
+        if not self._state.adding:
+            self.version += 1
+            if kwargs.get('update_fields') is not None:
+                kwargs['update_fields'] = {*kwargs['update_fields'], 'version'}
+        super().save(*args, **kwargs)
+        # Every post_save receiver has seen the previous values by now. Fields left out of update_fields still
+        # hold their stored values in the database, whatever the copy holds.
+        self._remember_loaded_values(kwargs.get('update_fields'))
+
+    # The fields whose loaded values are remembered, by name and attname
+    LOADED_VALUE_FIELDS = (('book', 'book_id'), ('status', 'status'))
+
+    def _remember_loaded_values(self, fields=None):
+        # Records the values of the given fields (all by default), which have just been read from or written to
+        # the database. Deferred fields are missing from __dict__; their stored values are unknown and recorded
+        # as DEFERRED until load_unknown_values() reads them.
+        loaded_values = dict(getattr(self, '_loaded_values', {}))
+        for name, attname in self.LOADED_VALUE_FIELDS:
+            if fields is None or name in fields or attname in fields:
+                loaded_values[attname] = self.__dict__.get(attname, models.DEFERRED)
+        self._loaded_values = loaded_values
+
+    def load_unknown_values(self):
+        # Reads the stored values of the fields that were deferred when the copy was loaded. A copy that has not
+        # been saved yet has no stored values.
+        loaded_values = getattr(self, '_loaded_values', {})
+        unknown = [attname for _, attname in self.LOADED_VALUE_FIELDS
+                   if loaded_values.get(attname, models.DEFERRED) is models.DEFERRED]
+        if unknown and not self._state.adding:
+            stored = BookInstance.objects.filter(pk=self.pk).values(*unknown).first()
+            if stored is not None:
+                self._loaded_values = {**loaded_values, **stored}
+
+    def get_loaded_value(self, attname):
+        # Returns the value attname had in the database, or None for a copy that has not been saved yet or a
+        # deferred field that load_unknown_values() hasn't read
+        value = getattr(self, '_loaded_values', {}).get(attname)
+        return None if value is models.DEFERRED else value
+
+
+class BookAvailability(models.Model):
+    '''
+    Denormalized count of the copies of a book in each loan status, maintained by ./signals.py.
+
+    The counts of a book are split over several shard rows (settings.BOOK_AVAILABILITY_SHARDS). Each change
+    updates one randomly chosen shard, so concurrent status changes of a popular book rarely wait for the same
+    row lock. The real count is the sum over all shards of the book (see totals()).
+    '''
+    # Maps BookInstance.LOAN_STATUS keys to the counter columns below
+    STATUS_COLUMNS = {
+        'd': 'maintenance',
+        'o': 'on_loan',
+        'a': 'available',
+        'r': 'reserved',
+    }
+
+    book = models.ForeignKey('Book', on_delete=models.CASCADE, related_name='availability')
+    shard = models.PositiveSmallIntegerField(default=0)
+    # A single shard may go negative (e.g. a copy counted in one shard and uncounted in another)
+    maintenance = models.IntegerField(default=0)
+    on_loan = models.IntegerField(default=0)
+    available = models.IntegerField(default=0)
+    reserved = models.IntegerField(default=0)
+
+    class Meta:
+        verbose_name_plural = 'book availability'
+        constraints = [
+            models.UniqueConstraint(fields=['book', 'shard'], name='unique_book_availability_shard'),
+        ]
+
+    @classmethod
+    def adjust(cls, book_id, deltas):
+        # deltas maps a loan status to the change of its counter, e.g. {'o': -1, 'a': 1} for a returned copy.
+        # Statuses without a counter (a blank status) are ignored.
+        changes = {}
+        for status, delta in deltas.items():
+            column = cls.STATUS_COLUMNS.get(status)
+            if column and delta:
+                changes[column] = changes.get(column, 0) + delta
+        if book_id is None or not changes:
+            return
+
+        shard = random.randrange(settings.BOOK_AVAILABILITY_SHARDS)
+        # F() expressions make the database do the addition, so concurrent updates are not lost
+        update = {column: models.F(column) + delta for column, delta in changes.items()}
+        if cls.objects.filter(book_id=book_id, shard=shard).update(**update):
+            return
+        try:
+            # The savepoint keeps an outer transaction usable if another process created the row first
+            with transaction.atomic():
+                cls.objects.create(book_id=book_id, shard=shard, **changes)
+        except IntegrityError:
+            cls.objects.filter(book_id=book_id, shard=shard).update(**update)
+
+    @classmethod
+    def totals(cls, book_ids):
+        # Returns {book_id: {'maintenance': n, 'on_loan': n, 'available': n, 'reserved': n}} summed over shards.
+        # Books without any counted copies are missing from the result.
+        columns = cls.STATUS_COLUMNS.values()
+        rows = (
+            cls.objects.filter(book_id__in=book_ids)
+            .values('book_id')
+            .annotate(**{'total_' + column: models.Sum(column) for column in columns})
+            .order_by()
+        )
+        return {row['book_id']: {column: row['total_' + column] for column in columns} for row in rows}
+
+    @classmethod
+    def count_copies(cls, book_ids):
+        # Counts the copies in BookInstance itself, returning the same format as totals()
+        counts = {}
+        rows = (
+            BookInstance.objects.filter(book_id__in=book_ids, status__in=cls.STATUS_COLUMNS)
+            .values('book_id', 'status')
+            .annotate(copies=models.Count('pk'))
+            .order_by()
+        )
+        for row in rows:
+            book_counts = counts.setdefault(row['book_id'], dict.fromkeys(cls.STATUS_COLUMNS.values(), 0))
+            book_counts[cls.STATUS_COLUMNS[row['status']]] = row['copies']
+        return counts
+
+    @classmethod
+    def rebuild(cls, book_ids):
+        # Replaces the shards of the given books by a single row holding the counted values.
+        # Used after bulk changes that bypass the signals and by the rebuild_book_availability command.
+        with transaction.atomic():
+            # The shards are locked before counting, so an adjust() can't commit between the count and the
+            # delete and be lost. Locking in primary key order keeps concurrent rebuilds from deadlocking.
+            list(cls.objects.select_for_update().filter(book_id__in=book_ids).order_by('pk').values_list('pk'))
+            counts = cls.count_copies(book_ids)
+            cls.objects.filter(book_id__in=book_ids).delete()
+            cls.objects.bulk_create(
+                [cls(book_id=book_id, shard=0, **book_counts) for book_id, book_counts in counts.items()]
+            )
+        return counts
+
 
 class Author(models.Model):
     # If verbose name is not provided, one is automatically created: i.e. first_name --> First Name
@@ -116,12 +298,64 @@ class Author(models.Model):
     last_name = models.CharField(max_length=100)
     date_of_birth = models.DateField(null=True, blank=True)
     date_of_death = models.DateField('died', null=True, blank=True)
+    # Also moved forward when one of the author's books changes (see ./signals.py)
+    updated_at = models.DateTimeField(auto_now=True, db_index=True)
 
     class Meta:
         ordering = ['last_name', 'first_name']
+        # Serves the author list in its ordering and the name lookups of the book forms (see ./lookups.py),
+        # which page through the authors by (last_name, first_name, id)
+        indexes = [
+            models.Index(fields=['last_name', 'first_name', 'id'], name='author_name_idx'),
+        ]
 
     def get_absolute_url(self):
         return reverse('author-detail', args=[str(self.id)])
 
     def __str__(self):
         return '{0}, {1}'.format(self.last_name, self.first_name)
+
+
+class JobCheckpoint(models.Model):
+    '''
+    High-water mark of a periodic job, so that a run only processes what appeared since the previous one.
+    For the process_overdue command it is the date up to which overdue loans have already been reminded of.
+    While a run is in progress, until is the end of the range it processes and last_id the last item it has
+    finished (e.g. borrower), so that an interrupted run is resumed after it.
+    '''
+    name = models.CharField(max_length=100, unique=True)
+    position = models.DateField()
+    until = models.DateField(null=True, blank=True)
+    last_id = models.BigIntegerField(null=True, blank=True)
+    updated = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return '{0} ({1})'.format(self.name, self.position)
+
+
+class ProfileReport(models.Model):
+    '''
+    Profile of a single request, recorded by the profiling middleware (see ./middleware.py) when a staff user asks
+    for it. Viewed (read-only) in the admin.
+    '''
+    created = models.DateTimeField(auto_now_add=True, db_index=True)
+    user = models.ForeignKey(User, on_delete=models.SET_NULL, null=True, blank=True)
+    method = models.CharField(max_length=10)
+    path = models.CharField(max_length=2000)
+    status_code = models.PositiveSmallIntegerField(null=True)
+    duration_ms = models.FloatField()
+    query_count = models.PositiveIntegerField(default=0)
+    query_time_ms = models.FloatField(default=0)
+    template_time_ms = models.FloatField(default=0)
+    # pstats output: top functions by cumulative and own time, and the callees of the top functions
+    profile = models.TextField(blank=True)
+    # [{'sql', 'duration_ms', 'alias'}] in execution order
+    queries = models.JSONField(default=list)
+    # [{'name', 'duration_ms', 'depth'}] in the order the renders finished
+    templates = models.JSONField(default=list)
+
+    class Meta:
+        ordering = ['-created']
+
+    def __str__(self):
+        return '{0} {1} ({2:.0f} ms)'.format(self.method, self.path, self.duration_ms)
@@ -0,0 +1,265 @@
+'''
+This file contains the keyset (cursor) pagination used by the list views in ./views.py.
+
+Django's Paginator selects a page with OFFSET, which makes the database walk past every row of the earlier pages,
+and it counts all rows to show the number of pages. Keyset pagination instead remembers the ordering values of the
+last row shown in an opaque cursor and selects the rows after it with a WHERE clause, so every page costs the same
+and no COUNT is needed. It is enabled by setting CATALOG_PAGINATION = 'keyset'.
+
+EstimatedCountPaginator is a Paginator for the admin changelists of large tables, which takes the number of rows
+from the database's statistics instead of counting them all.
+'''
+
+
+import base64
+import json
+
+from django.conf import settings
+from django.core.exceptions import ValidationError
+from django.core.paginator import Paginator
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import DEFAULT_DB_ALIAS, connections
+from django.db.models import F, Q
+from django.http import Http404
+from django.utils.functional import cached_property
+
+
+NEXT = 'n'
+PREVIOUS = 'p'
+
+
+def encode_cursor(direction, values):
+    data = json.dumps([direction, values], cls=DjangoJSONEncoder, separators=(',', ':'))
+    return base64.urlsafe_b64encode(data.encode()).decode().rstrip('=')
+
+
+def decode_cursor(cursor, length):
+    # Returns (direction, values), raising ValueError for anything that isn't a cursor of this ordering
+    try:
+        data = base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4))
+        direction, values = json.loads(data)
+    except (TypeError, ValueError, UnicodeDecodeError):
+        raise ValueError('Invalid cursor')
+    if direction not in (NEXT, PREVIOUS) or not isinstance(values, list) or len(values) != length:
+        raise ValueError('Invalid cursor')
+    return direction, values
+
+
+def to_field_value(field, value, using=DEFAULT_DB_ALIAS):
+    # Converts a value from a URL or cursor to the field's type, raising ValidationError if it isn't one or is an
+    # integer outside the field's column range, which the database would fail to convert instead of matching nothing
+    value = field.to_python(value)
+    if isinstance(value, int) and not isinstance(value, bool):
+        target = field.target_field if field.is_relation else field
+        try:
+            min_value, max_value = connections[using].ops.integer_field_range(target.get_internal_type())
+        except KeyError:
+            min_value = max_value = None
+        # SQLite reports no range, but its driver only converts 64-bit integers
+        min_value = -2 ** 63 if min_value is None else min_value
+        max_value = 2 ** 63 - 1 if max_value is None else max_value
+        if not min_value <= value <= max_value:
+            raise ValidationError('Value out of range')
+    return value
+
+
+class KeysetPage:
+    # Provides the parts of django.core.paginator.Page used by the templates, without any counts
+    is_keyset = True
+
+    def __init__(self, object_list, next_cursor=None, previous_cursor=None):
+        self.object_list = object_list
+        self.next_cursor = next_cursor
+        self.previous_cursor = previous_cursor
+
+    def __len__(self):
+        return len(self.object_list)
+
+    def __iter__(self):
+        return iter(self.object_list)
+
+    def has_next(self):
+        return self.next_cursor is not None
+
+    def has_previous(self):
+        return self.previous_cursor is not None
+
+    def has_other_pages(self):
+        return self.has_next() or self.has_previous()
+
+
+class Keyset:
+    '''
+    The ordering of a keyset paginated queryset, e.g. Keyset(Book, ('title', 'author', 'id')).
+    The last field must be unique so that every row has a distinct position.
+    NULLs are sorted first, whatever the database does by default.
+    '''
+
+    def __init__(self, model, field_names):
+        self.fields = [model._meta.get_field(name) for name in field_names]
+
+    def values(self, obj):
+        # obj is a model instance, or a dictionary from queryset.values() that includes the ordering fields
+        if isinstance(obj, dict):
+            return [obj[field.attname] for field in self.fields]
+        return [getattr(obj, field.attname) for field in self.fields]
+
+    def order_by(self, forward):
+        ordering = []
+        for field in self.fields:
+            if not field.null:
+                # Plain ordering keeps the SQL simple enough for the database to use an index
+                ordering.append(field.attname if forward else '-' + field.attname)
+            elif forward:
+                ordering.append(F(field.attname).asc(nulls_first=True))
+            else:
+                ordering.append(F(field.attname).desc(nulls_last=True))
+        return ordering
+
+    def _beyond(self, field, value, forward):
+        # Condition for the rows after (forward) or before the value in this field's ordering
+        name = field.attname
+        if value is None:
+            return Q(**{name + '__isnull': False}) if forward else Q(pk__in=[])
+        condition = Q(**{name + ('__gt' if forward else '__lt'): value})
+        if field.null and not forward:
+            condition |= Q(**{name + '__isnull': True})
+        return condition
+
+    def filter(self, values, forward):
+        # Lexicographic comparison of the row's ordering values with the cursor's:
+        # (a > x) OR (a = x AND b > y) OR (a = x AND b = y AND c > z)
+        condition = Q(pk__in=[])
+        equal = Q()
+        for field, value in zip(self.fields, values):
+            condition |= equal & self._beyond(field, value, forward)
+            equal &= Q(**{field.attname + '__isnull': True}) if value is None else Q(**{field.attname: value})
+        return condition
+
+    def paginate(self, queryset, page_size, cursor=None):
+        # Fetches one extra row to know whether there is a further page
+        if cursor is None:
+            direction, values = NEXT, None
+        else:
+            direction, values = decode_cursor(cursor, len(self.fields))
+            try:
+                values = [None if value is None else to_field_value(field, value, queryset.db)
+                          for field, value in zip(self.fields, values)]
+            except ValidationError:
+                raise ValueError('Invalid cursor')
+        forward = direction == NEXT
+
+        queryset = queryset.order_by(*self.order_by(forward))
+        if values is not None:
+            queryset = queryset.filter(self.filter(values, forward))
+        rows = list(queryset[:page_size + 1])
+        has_more = len(rows) > page_size
+        rows = rows[:page_size]
+        if not forward:
+            rows.reverse()
+
+        # Coming forward from an earlier page means there is a previous page, and vice versa
+        if forward:
+            has_next, has_previous = has_more, values is not None
+        else:
+            has_next, has_previous = True, has_more
+
+        next_cursor = previous_cursor = None
+        if rows and has_next:
+            next_cursor = encode_cursor(NEXT, self.values(rows[-1]))
+        if rows and has_previous:
+            previous_cursor = encode_cursor(PREVIOUS, self.values(rows[0]))
+        return KeysetPage(rows, next_cursor, previous_cursor)
+
+
+class KeysetPaginationMixin:
+    '''
+    Mixin for ListViews that pages with a cursor (the ?cursor= query parameter) when settings.CATALOG_PAGINATION
+    is 'keyset', and with Django's page numbers otherwise. keyset_ordering lists the fields to page by.
+    '''
+    keyset_ordering = None
+    cursor_kwarg = 'cursor'
+
+    def paginate_queryset(self, queryset, page_size):
+        if settings.CATALOG_PAGINATION != 'keyset' or self.keyset_ordering is None:
+            return super().paginate_queryset(queryset, page_size)
+
+        keyset = Keyset(queryset.model, self.keyset_ordering)
+        try:
+            page = keyset.paginate(queryset, page_size, self.request.GET.get(self.cursor_kwarg))
+        except ValueError:
+            # The same response as Django's paginator gives for an invalid page number
+            raise Http404('Invalid cursor.')
+        # (paginator, page, object_list, is_paginated), as returned by MultipleObjectMixin.paginate_queryset()
+        return None, page, page.object_list, page.has_other_pages()
+
+
+# Estimated number of rows of a table, from the database's statistics, or None if there are none
+
+def _postgres_row_estimate(cursor, table):
+    # Kept up to date by VACUUM and ANALYZE (and autovacuum); -1 (or 0 before PostgreSQL 14) if never analyzed
+    cursor.execute('SELECT reltuples::bigint FROM pg_class WHERE oid = to_regclass(%s)', [table])
+    row = cursor.fetchone()
+    return row[0] if row and row[0] > 0 else None
+
+
+def _sqlite_row_estimate(cursor, table):
+    # The first number of each statistics row of ANALYZE is the number of rows in the table (or in the index,
+    # for a partial one). Without statistics, the largest rowid is read from the end of the table's b-tree, which
+    # overestimates once rows have been deleted.
+    cursor.execute('SELECT name FROM sqlite_master WHERE type = %s AND name = %s', ['table', 'sqlite_stat1'])
+    if cursor.fetchone():
+        cursor.execute('SELECT stat FROM sqlite_stat1 WHERE tbl = %s', [table])
+        counts = [int(stat.split()[0]) for stat, in cursor.fetchall()]
+        if counts:
+            return max(counts)
+    cursor.execute('SELECT max(rowid) FROM {0}'.format(cursor.db.ops.quote_name(table)))
+    row = cursor.fetchone()
+    return row[0] if row else None
+
+
+ROW_ESTIMATORS = {
+    'postgresql': _postgres_row_estimate,
+    'sqlite': _sqlite_row_estimate,
+}
+
+
+def estimated_row_count(model, using='default'):
+    estimator = ROW_ESTIMATORS.get(connections[using].vendor)
+    if estimator is None:
+        return None
+    with connections[using].cursor() as cursor:
+        return estimator(cursor, model._meta.db_table)
+
+
+class BoundedCount(int):
+    '''
+    Number of rows of a list that has at least that many, which is shown as "<count>+". The pages past it
+    aren't reached: the list needs narrowing down first.
+    '''
+
+    def __str__(self):
+        return '{0}+'.format(int(self))
+
+
+class EstimatedCountPaginator(Paginator):
+    '''
+    Paginator that only counts the rows exactly while the table has fewer than
+    settings.CATALOG_ESTIMATED_COUNT_THRESHOLD of them. Above that, an unfiltered list uses the database's estimate
+    of the table's size, and a filtered one counts its rows up to the threshold (a COUNT over a LIMIT subquery):
+    when it has more, its count is the threshold, shown as "<threshold>+" (a BoundedCount), since the table's
+    estimate says nothing about the filtered rows. The estimate may be off by a few percent, so the last pages of
+    an unfiltered list may be short or empty.
+    '''
+
+    @cached_property
+    def count(self):
+        queryset = self.object_list
+        threshold = settings.CATALOG_ESTIMATED_COUNT_THRESHOLD
+        estimate = estimated_row_count(queryset.model, queryset.db)
+        if estimate is None or estimate < threshold:
+            return queryset.count()
+        if not queryset.query.has_filters():
+            return estimate
+        bounded = queryset.order_by()[:threshold + 1].count()
+        return bounded if bounded <= threshold else BoundedCount(threshold)
@@ -0,0 +1,238 @@
+'''
+This file contains the full-text search over books used by the search view in ./views.py.
+
+Each book is indexed as one document made of its title, summary, ISBN and author name, stored in the
+catalog_book_search table created by migration 0027:
+  - SQLite: an FTS5 virtual table whose rowid is the book id, ranked with bm25().
+  - PostgreSQL: a tsvector column with a GIN index, ranked with ts_rank().
+Other databases fall back to (slow) icontains filters on the Book table.
+
+The index is kept in sync by the receivers in ./signals.py.
+'''
+
+
+import re
+
+from django.db import connection
+from django.db.models import Q
+
+from .models import Book
+
+
+SEARCH_TABLE = 'catalog_book_search'
+
+
+def _terms(query):
+    # Only word characters are kept, so nothing in the query can be interpreted as search syntax
+    return re.findall(r'\w+', query.lower())
+
+
+class SqliteSearchBackend:
+    # Column weights for bm25(): title and ISBN matches rank above author, which ranks above summary
+    WEIGHTS = '10.0, 1.0, 10.0, 5.0'
+
+    def create(self, cursor):
+        cursor.execute(
+            'CREATE VIRTUAL TABLE IF NOT EXISTS {0} USING fts5('
+            'title, summary, isbn, author, tokenize = "unicode61 remove_diacritics 2")'.format(SEARCH_TABLE)
+        )
+
+    def drop(self, cursor):
+        cursor.execute('DROP TABLE IF EXISTS {0}'.format(SEARCH_TABLE))
+
+    def index(self, cursor, rows):
+        # rows are (book_id, title, summary, isbn, author_name) tuples
+        self.remove(cursor, [row[0] for row in rows])
+        cursor.executemany(
+            'INSERT INTO {0} (rowid, title, summary, isbn, author) VALUES (%s, %s, %s, %s, %s)'.format(SEARCH_TABLE),
+            rows,
+        )
+
+    def remove(self, cursor, book_ids):
+        cursor.executemany('DELETE FROM {0} WHERE rowid = %s'.format(SEARCH_TABLE), [[pk] for pk in book_ids])
+
+    def _match(self, query):
+        # Every term must match; the last one as a prefix, as it may still be being typed
+        terms = ['"{0}"'.format(term) for term in _terms(query)]
+        if terms:
+            terms[-1] += '*'
+        return ' '.join(terms)
+
+    def count(self, cursor, query):
+        cursor.execute('SELECT COUNT(*) FROM {0} WHERE {0} MATCH %s'.format(SEARCH_TABLE), [self._match(query)])
+        return cursor.fetchone()[0]
+
+    def ids(self, cursor, query, offset, limit):
+        cursor.execute(
+            'SELECT rowid FROM {0} WHERE {0} MATCH %s ORDER BY bm25({0}, {1}) LIMIT %s OFFSET %s'.format(
+                SEARCH_TABLE, self.WEIGHTS),
+            [self._match(query), limit, offset],
+        )
+        return [row[0] for row in cursor.fetchall()]
+
+
+class PostgresSearchBackend:
+    # Title and ISBN get weight A, the author B and the summary C
+    DOCUMENT = (
+        "setweight(to_tsvector('english', %s), 'A') || setweight(to_tsvector('simple', %s), 'A') || "
+        "setweight(to_tsvector('simple', %s), 'B') || setweight(to_tsvector('english', %s), 'C')"
+    )
+
+    def create(self, cursor):
+        # Rows of deleted books are removed by the foreign key's ON DELETE CASCADE
+        cursor.execute(
+            'CREATE TABLE IF NOT EXISTS {0} ('
+            'book_id bigint PRIMARY KEY REFERENCES catalog_book (id) ON DELETE CASCADE, '
+            'document tsvector NOT NULL)'.format(SEARCH_TABLE)
+        )
+        cursor.execute(
+            'CREATE INDEX IF NOT EXISTS {0}_document ON {0} USING GIN (document)'.format(SEARCH_TABLE)
+        )
+
+    def drop(self, cursor):
+        cursor.execute('DROP TABLE IF EXISTS {0}'.format(SEARCH_TABLE))
+
+    def index(self, cursor, rows):
+        cursor.executemany(
+            'INSERT INTO {0} (book_id, document) VALUES (%s, {1}) '
+            'ON CONFLICT (book_id) DO UPDATE SET document = EXCLUDED.document'.format(SEARCH_TABLE, self.DOCUMENT),
+            [(pk, title, isbn, author, summary) for pk, title, summary, isbn, author in rows],
+        )
+
+    def remove(self, cursor, book_ids):
+        cursor.execute('DELETE FROM {0} WHERE book_id = ANY(%s)'.format(SEARCH_TABLE), [list(book_ids)])
+
+    def _tsquery(self, query):
+        # Returns the SQL of the tsquery and its parameters. The title and summary are indexed with the english
+        # config and the ISBN and author with the simple one, so each term has to match either way: stemmed,
+        # "jones" would become 'jone', which the simple vector of the author doesn't hold. Every term must
+        # match; the last one as a prefix.
+        terms = _terms(query)
+        if not terms:
+            return "to_tsquery('simple', '')", []
+        terms[-1] += ':*'
+        sql = ' && '.join("(to_tsquery('english', %s) || to_tsquery('simple', %s))" for term in terms)
+        return sql, [value for term in terms for value in (term, term)]
+
+    def count(self, cursor, query):
+        sql, params = self._tsquery(query)
+        cursor.execute('SELECT COUNT(*) FROM {0} WHERE document @@ ({1})'.format(SEARCH_TABLE, sql), params)
+        return cursor.fetchone()[0]
+
+    def ids(self, cursor, query, offset, limit):
+        sql, params = self._tsquery(query)
+        cursor.execute(
+            'SELECT book_id FROM {0}, (SELECT {1} AS query) search WHERE document @@ search.query '
+            'ORDER BY ts_rank(document, search.query) DESC, book_id LIMIT %s OFFSET %s'.format(SEARCH_TABLE, sql),
+            params + [limit, offset],
+        )
+        return [row[0] for row in cursor.fetchall()]
+
+
+class FallbackSearchBackend:
+    # Used for databases without a supported full-text index: nothing to maintain, and unranked results
+
+    def create(self, cursor):
+        pass
+
+    def drop(self, cursor):
+        pass
+
+    def index(self, cursor, rows):
+        pass
+
+    def remove(self, cursor, book_ids):
+        pass
+
+    def _queryset(self, query):
+        condition = Q()
+        for term in _terms(query):
+            condition &= (Q(title__icontains=term) | Q(summary__icontains=term) | Q(isbn__icontains=term) |
+                          Q(author__first_name__icontains=term) | Q(author__last_name__icontains=term))
+        return Book.objects.filter(condition).order_by('title', 'pk').values_list('pk', flat=True)
+
+    def count(self, cursor, query):
+        return self._queryset(query).count()
+
+    def ids(self, cursor, query, offset, limit):
+        return list(self._queryset(query)[offset:offset + limit])
+
+
+BACKENDS = {
+    'sqlite': SqliteSearchBackend,
+    'postgresql': PostgresSearchBackend,
+}
+
+
+def get_backend(vendor=None):
+    return BACKENDS.get(vendor or connection.vendor, FallbackSearchBackend)()
+
+
+def author_name(first_name, last_name):
+    return ' '.join(name for name in (first_name, last_name) if name)
+
+
+def index_books(book_ids):
+    # (Re)indexes the given books; ids of deleted books are removed from the index
+    book_ids = list(book_ids)
+    rows = [
+        (pk, title, summary, isbn, author_name(first_name, last_name))
+        for pk, title, summary, isbn, first_name, last_name in Book.objects.filter(pk__in=book_ids).values_list(
+            'pk', 'title', 'summary', 'isbn', 'author__first_name', 'author__last_name')
+    ]
+    backend = get_backend()
+    with connection.cursor() as cursor:
+        backend.remove(cursor, set(book_ids) - {row[0] for row in rows})
+        if rows:
+            backend.index(cursor, rows)
+
+
+def remove_books(book_ids):
+    with connection.cursor() as cursor:
+        get_backend().remove(cursor, list(book_ids))
+
+
+class SearchResults:
+    '''
+    The books matching a query, best match first. Supports count() and slicing, so it can be given to
+    django.core.paginator.Paginator: only the ids of the requested page are read from the index, and only
+    those books are loaded.
+    '''
+    model = Book
+
+    def __init__(self, query):
+        self.query = query
+        self.backend = get_backend()
+        self._count = None
+
+    def count(self):
+        if self._count is None:
+            if not _terms(self.query):
+                self._count = 0
+            else:
+                with connection.cursor() as cursor:
+                    self._count = self.backend.count(cursor, self.query)
+        return self._count
+
+    def __len__(self):
+        return self.count()
+
+    def __getitem__(self, key):
+        if not isinstance(key, slice):
+            return self[key:key + 1][0]
+        offset = key.start or 0
+        if key.stop is None:
+            limit = self.count() - offset
+        else:
+            limit = key.stop - offset
+        if limit <= 0:
+            return []
+
+        with connection.cursor() as cursor:
+            book_ids = self.backend.ids(cursor, self.query, offset, limit)
+        books = Book.objects.select_related('author').in_bulk(book_ids)
+        return [books[pk] for pk in book_ids if pk in books]
+
+
+def search_books(query):
+    return SearchResults(query)
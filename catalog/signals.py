@@ -0,0 +1,237 @@
+'''
+This file contains the signal receivers that keep cached and denormalized data in sync with the models.
+The receivers are connected when the module is imported by CatalogConfig.ready() in ./apps.py.
+'''
+
+
+from functools import partial
+
+from django.db import transaction
+from django.db.models.signals import m2m_changed, post_delete, post_save, pre_delete, pre_save
+from django.dispatch import receiver
+from django.utils import timezone
+
+from . import autocomplete
+from .caching import bump_list_versions, bump_versions, invalidate_catalog_counts
+from .models import Author, Book, BookAvailability, BookInstance, Genre, Language
+from .search import index_books, remove_books
+
+
+def after_commit(function, *args):
+    # The cache versions and counts are changed once the change is committed. Changed before, a concurrent
+    # request could read the old rows, cache them under the new version and serve them until they expire.
+    # Outside a transaction the function runs at once.
+    transaction.on_commit(partial(function, *args))
+
+
+# The sender argument restricts each receiver to saves/deletes of one model.
+# Stacking the decorators connects the same function to several signals and senders.
+@receiver(post_save, sender=Book)
+@receiver(post_delete, sender=Book)
+@receiver(post_save, sender=BookInstance)
+@receiver(post_delete, sender=BookInstance)
+@receiver(post_save, sender=Author)
+@receiver(post_delete, sender=Author)
+def catalog_counts_changed(sender, **kwargs):
+    after_commit(invalidate_catalog_counts)
+
+
+def is_written(update_fields, name, attname):
+    # Whether a save() with the given update_fields writes the field, which may be listed by name or attname
+    return update_fields is None or name in update_fields or attname in update_fields
+
+
+# BookInstance remembers the book and status the copy had when it was loaded. Those that were deferred are read
+# from the database before the copy is saved or deleted, as the counters are moved by the stored values.
+@receiver(pre_save, sender=BookInstance)
+def bookinstance_availability_before_save(sender, instance, update_fields, **kwargs):
+    if is_written(update_fields, 'book', 'book_id') or is_written(update_fields, 'status', 'status'):
+        instance.load_unknown_values()
+
+
+@receiver(pre_delete, sender=BookInstance)
+def bookinstance_availability_before_delete(sender, instance, **kwargs):
+    instance.load_unknown_values()
+
+
+# A new copy is only counted in its book and status; a changed copy is moved from its stored values to its new ones
+@receiver(post_save, sender=BookInstance)
+def bookinstance_availability_saved(sender, instance, created, update_fields, **kwargs):
+    if created:
+        old_book_id, old_status = None, None
+    else:
+        old_book_id, old_status = instance.get_loaded_value('book_id'), instance.get_loaded_value('status')
+    # Fields left out of update_fields keep their stored values, whatever the instance holds
+    new_book_id = instance.book_id if is_written(update_fields, 'book', 'book_id') else old_book_id
+    new_status = instance.status if is_written(update_fields, 'status', 'status') else old_status
+
+    if (old_book_id, old_status) != (new_book_id, new_status):
+        with transaction.atomic():
+            if old_book_id == new_book_id:
+                # Both counters of the book are moved by a single UPDATE
+                BookAvailability.adjust(new_book_id, {old_status: -1, new_status: 1})
+            else:
+                BookAvailability.adjust(old_book_id, {old_status: -1})
+                BookAvailability.adjust(new_book_id, {new_status: 1})
+
+
+@receiver(post_delete, sender=BookInstance)
+def bookinstance_availability_deleted(sender, instance, **kwargs):
+    # The counters are moved by the values stored in the database, which may differ from unsaved changes
+    BookAvailability.adjust(instance.get_loaded_value('book_id'), {instance.get_loaded_value('status'): -1})
+
+
+def touch(model, pks):
+    # Moves updated_at forward for objects whose page shows something that changed elsewhere.
+    # queryset.update() sends no signals, so this doesn't trigger the receivers again.
+    pks = {pk for pk in pks if pk is not None}
+    if pks:
+        model.objects.filter(pk__in=pks).update(updated_at=timezone.now())
+
+
+def books_changed(book_ids, author_ids=()):
+    # Bumps the cache versions and timestamps of the given books and of the authors listing them (see
+    # ./caching.py). The authors of the books are looked up here; author_ids adds authors the books no longer
+    # belong to.
+    book_ids = {pk for pk in book_ids if pk is not None}
+    author_ids = set(author_ids)
+    if book_ids:
+        author_ids.update(
+            Book.objects.filter(pk__in=book_ids).exclude(author=None).values_list('author_id', flat=True)
+        )
+    after_commit(bump_versions, Book, book_ids)
+    after_commit(bump_versions, Author, author_ids)
+    touch(Book, book_ids)
+    touch(Author, author_ids)
+
+
+# Remembers the author a book had before it is saved, as the old author's page lists the book too
+@receiver(pre_save, sender=Book)
+def book_author_before_save(sender, instance, **kwargs):
+    instance._previous_author_id = None
+    if instance.pk is not None:
+        instance._previous_author_id = (
+            Book.objects.filter(pk=instance.pk).values_list('author_id', flat=True).first()
+        )
+
+
+@receiver(post_save, sender=Book)
+@receiver(post_delete, sender=Book)
+def book_versions_changed(sender, instance, **kwargs):
+    after_commit(bump_versions, Book, [instance.pk])
+    after_commit(bump_list_versions, Book)
+    author_ids = [instance.author_id, getattr(instance, '_previous_author_id', None)]
+    after_commit(bump_versions, Author, author_ids)
+    touch(Author, author_ids)
+
+
+# Book pages show the author's name
+@receiver(post_save, sender=Author)
+@receiver(pre_delete, sender=Author)
+def author_versions_changed(sender, instance, **kwargs):
+    after_commit(bump_versions, Author, [instance.pk])
+    # The book list shows the author names too
+    after_commit(bump_list_versions, Author, Book)
+    book_ids = list(Book.objects.filter(author=instance).values_list('pk', flat=True))
+    after_commit(bump_versions, Book, book_ids)
+    touch(Book, book_ids)
+
+
+# Book pages show the names of their genres and language. pre_delete is used because the
+# links to the books are gone by the time post_delete is sent.
+@receiver(post_save, sender=Genre)
+@receiver(pre_delete, sender=Genre)
+def genre_versions_changed(sender, instance, **kwargs):
+    books_changed(Book.objects.filter(genre=instance).values_list('pk', flat=True))
+
+
+@receiver(post_save, sender=Language)
+@receiver(pre_delete, sender=Language)
+def language_versions_changed(sender, instance, **kwargs):
+    books_changed(Book.objects.filter(language=instance).values_list('pk', flat=True))
+
+
+@receiver(m2m_changed, sender=Book.genre.through)
+def book_genres_changed(sender, instance, action, reverse, pk_set, **kwargs):
+    if not action.startswith('post_'):
+        return
+    if reverse:
+        # genre.book_set.add(...): instance is the Genre and pk_set holds the books.
+        # pk_set is None after a clear(), so every book still linked has been unlinked already.
+        books_changed(pk_set or ())
+    else:
+        books_changed([instance.pk])
+
+
+# Book pages list the copies and author pages count them
+@receiver(post_save, sender=BookInstance)
+def bookinstance_versions_changed(sender, instance, **kwargs):
+    books_changed({instance.book_id, instance.get_loaded_value('book_id')})
+
+
+@receiver(post_delete, sender=BookInstance)
+def bookinstance_versions_deleted(sender, instance, **kwargs):
+    # The row is gone, so a deferred book can't be loaded any more; the stored one was read before the delete
+    books_changed({instance.get_loaded_value('book_id')})
+
+
+# Keeps the full-text search index of ./search.py in sync with the books and their authors' names
+@receiver(post_save, sender=Book)
+def book_search_saved(sender, instance, **kwargs):
+    index_books([instance.pk])
+
+
+@receiver(post_delete, sender=Book)
+def book_search_deleted(sender, instance, **kwargs):
+    remove_books([instance.pk])
+
+
+@receiver(post_save, sender=Author)
+def author_search_saved(sender, instance, created, **kwargs):
+    if not created:
+        index_books(Book.objects.filter(author=instance).values_list('pk', flat=True))
+
+
+# The author's books are looked up before the delete sets their author to NULL,
+# and reindexed without the author's name afterwards
+@receiver(pre_delete, sender=Author)
+def author_search_before_delete(sender, instance, **kwargs):
+    instance._search_book_ids = list(Book.objects.filter(author=instance).values_list('pk', flat=True))
+
+
+@receiver(post_delete, sender=Author)
+def author_search_deleted(sender, instance, **kwargs):
+    index_books(getattr(instance, '_search_book_ids', []))
+
+
+# Lets every worker's autocomplete index (see ./autocomplete.py) pick up changed titles and names
+@receiver(post_save, sender=Book)
+@receiver(post_delete, sender=Book)
+def book_autocomplete_changed(sender, instance, **kwargs):
+    # After the commit, or another worker could replay the change before it is visible and keep the old title
+    after_commit(autocomplete.record_change, autocomplete.BOOK, [instance.pk])
+
+
+@receiver(post_save, sender=Author)
+@receiver(post_delete, sender=Author)
+def author_autocomplete_changed(sender, instance, **kwargs):
+    after_commit(autocomplete.record_change, autocomplete.AUTHOR, [instance.pk])
+
+
+def catalog_bulk_changed(book_ids=(), author_ids=(), copies_only=False):
+    # Does the work of the receivers above for changes that bypass the signals, i.e. bulk_create() and
+    # queryset.update(). book_ids are the books that were created/changed or whose copies were; author_ids the
+    # authors that were created/changed. copies_only skips what only depends on book and author fields.
+    book_ids = list(book_ids)
+    author_ids = list(author_ids)
+
+    invalidate_catalog_counts()
+    BookAvailability.rebuild(book_ids)
+    books_changed(book_ids, author_ids)
+    if not copies_only:
+        bump_list_versions(Author, Book)
+        index_books(book_ids)
+        if author_ids:
+            index_books(Book.objects.filter(author__in=author_ids).values_list('pk', flat=True))
+        after_commit(autocomplete.record_change, autocomplete.BOOK, book_ids)
+        after_commit(autocomplete.record_change, autocomplete.AUTHOR, author_ids)
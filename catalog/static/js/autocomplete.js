@@ -0,0 +1,27 @@
+// Fills the sidebar search box's <datalist> with suggestions from the catalog autocomplete endpoint
+document.querySelectorAll('input[data-autocomplete-url]').forEach(function (input) {
+  var datalist = document.getElementById(input.getAttribute('list'));
+  var timer = null;
+
+  input.addEventListener('input', function () {
+    clearTimeout(timer);
+    // Wait for a pause in typing instead of sending a request per keystroke
+    timer = setTimeout(function () {
+      var query = input.value.trim();
+      if (!query) {
+        datalist.innerHTML = '';
+        return;
+      }
+      fetch(input.dataset.autocompleteUrl + '?q=' + encodeURIComponent(query))
+        .then(function (response) { return response.json(); })
+        .then(function (data) {
+          datalist.innerHTML = '';
+          data.results.forEach(function (result) {
+            var option = document.createElement('option');
+            option.value = result.label;
+            datalist.appendChild(option);
+          });
+        });
+    }, 150);
+  });
+});
@@ -0,0 +1,63 @@
+// Adds a search box to the <select data-lookup-url> elements of the book forms (see LookupWidgetMixin in
+// catalog/forms.py). Only the selected options are in the page: the others are requested from the lookup endpoint
+// as the user types, a page at a time, with a "More" button for the next page.
+document.addEventListener('DOMContentLoaded', function () {
+  document.querySelectorAll('select[data-lookup-url]').forEach(function (select) {
+    var search = document.createElement('input');
+    search.type = 'search';
+    search.placeholder = 'Type to search';
+    search.setAttribute('aria-label', 'Search ' + (select.name || 'choices'));
+    var more = document.createElement('button');
+    more.type = 'button';
+    more.textContent = 'More';
+    more.hidden = true;
+    select.parentNode.insertBefore(search, select);
+    select.parentNode.insertBefore(more, select.nextSibling);
+
+    var timer = null;
+    var next = null;
+    var request = 0;
+
+    function load(cursor) {
+      var number = ++request;
+      var url = select.dataset.lookupUrl + '?q=' + encodeURIComponent(search.value.trim());
+      if (cursor) {
+        url += '&cursor=' + encodeURIComponent(cursor);
+      }
+      fetch(url)
+        .then(function (response) { return response.json(); })
+        .then(function (data) {
+          if (number !== request) {
+            return;  // A later search has been sent since
+          }
+          if (!cursor) {
+            // The selected options stay, so that the form still submits them
+            Array.prototype.slice.call(select.options).forEach(function (option) {
+              if (!option.selected && option.value !== '') {
+                select.removeChild(option);
+              }
+            });
+          }
+          data.results.forEach(function (result) {
+            if (!select.querySelector('option[value="' + result.id + '"]')) {
+              select.appendChild(new Option(result.text, result.id));
+            }
+          });
+          next = data.next;
+          more.hidden = !next;
+        });
+    }
+
+    search.addEventListener('input', function () {
+      clearTimeout(timer);
+      // Wait for a pause in typing instead of sending a request per keystroke
+      timer = setTimeout(function () { load(null); }, 150);
+    });
+    search.addEventListener('focus', function () {
+      if (next === null && select.options.length <= 1) {
+        load(null);
+      }
+    }, {once: true});
+    more.addEventListener('click', function () { load(next); });
+  });
+});
@@ -0,0 +1,206 @@
+'''
+Test-time SQL instrumentation for the catalog views.
+
+QueryBudgetTestCase gives its tests a client that records every statement run while it handles a request
+(through connection.execute_wrapper) and fails the test if the request:
+- runs more queries than the budget declared for its URL name in QUERY_BUDGETS, or
+- runs the same query shape (the SQL with its parameters left out) MAX_REPEATED_QUERIES times or more, the
+  signature of an N+1 pattern such as a query per row in a template loop.
+The failure message lists the statements and, for each one, the template line that triggered it (if it ran
+while a template was rendering) and the application frames of the call stack.
+'''
+
+
+import re
+import sys
+import time
+import traceback
+from collections import Counter
+from contextlib import contextmanager
+
+from django.conf import settings
+from django.core.cache import caches
+from django.db import connection
+from django.template.base import Node
+from django.test import Client, TestCase
+from django.urls import Resolver404, resolve
+
+
+# Queries allowed per request for each URL name, including the session and user lookups of a logged in client.
+# A view whose count grows with the number of rows it shows has an N+1 problem, not a budget problem.
+QUERY_BUDGETS = {
+    'index': 3,
+    'books': 5,
+    # The detail pages read the copy counts from BookAvailability
+    'book-detail': 6,
+    'authors': 5,
+    'author-detail': 5,
+    'search': 3,
+    'autocomplete': 2,
+    'lookup': 1,
+    'my-borrowed': 4,
+    'all-borrowed': 6,
+    # Including the SAVEPOINT and RELEASE around the UPDATE, and for a return one counter UPDATE per book
+    'bulk-renew-return': 9,
+    'renew-book-librarian': 9,
+    'author-create': 6,
+    'author-update': 6,
+    'author-delete': 6,
+    'book-create': 6,
+    'book-update': 6,
+    'book-delete': 6,
+    # The rows of a streaming response are read after the request returns and are not counted
+    'export': 2,
+    'api-list': 5,
+    'api-detail': 3,
+}
+
+# Number of times a query shape may run in one request before it is reported as an N+1 pattern
+MAX_REPEATED_QUERIES = 3
+
+# Transaction statements are repeated by design
+IGNORED_SHAPES = re.compile(r'^(SAVEPOINT|RELEASE SAVEPOINT|ROLLBACK TO SAVEPOINT|BEGIN|COMMIT)\b', re.I)
+
+
+def query_shape(sql):
+    # IN lists of any length have the same shape: "IN (%s, %s, %s)" -> "IN (...)"
+    sql = re.sub(r'IN \((?:%s(?:, )?)+\)', 'IN (...)', sql)
+    return ' '.join(sql.split())
+
+
+class RecordedQuery:
+
+    def __init__(self, sql, params, duration, template, stack):
+        self.sql = sql
+        self.params = params
+        self.duration = duration
+        # (template name, line number) of the innermost template node being rendered, or None
+        self.template = template
+        # Application frames of the call stack, innermost last
+        self.stack = stack
+
+    @property
+    def shape(self):
+        return query_shape(self.sql)
+
+    def describe(self):
+        lines = [self.sql]
+        if self.template:
+            lines.append('  in template {0}, line {1}'.format(*self.template))
+        lines.extend('  {0}:{1} in {2}'.format(frame.filename, frame.lineno, frame.name) for frame in self.stack)
+        return '\n'.join(lines)
+
+
+def _template_line(frame):
+    # Walks outwards from the frame that ran the query to the innermost template node being rendered
+    while frame is not None:
+        node = frame.f_locals.get('self') if frame.f_code.co_name == 'render_annotated' else None
+        if isinstance(node, Node) and node.token is not None and node.origin is not None:
+            return node.origin.template_name or node.origin.name, node.token.lineno
+        frame = frame.f_back
+    return None
+
+
+def _application_stack(frame, limit=8):
+    # Only the frames of the project's own code and tests (not Django, libraries or this file) are kept
+    base_dir = str(settings.BASE_DIR)
+    frames = [
+        entry for entry in traceback.extract_stack(frame)
+        if entry.filename.startswith(base_dir) and entry.filename != __file__
+        and 'site-packages' not in entry.filename
+    ]
+    return frames[-limit:]
+
+
+class QueryRecorder:
+    '''
+    Records the statements run on the default connection while it is used as a context manager.
+    '''
+
+    def __init__(self):
+        self.queries = []
+
+    def __call__(self, execute, sql, params, many, context):
+        frame = sys._getframe(1)
+        started = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.queries.append(RecordedQuery(sql, params, time.perf_counter() - started,
+                                              _template_line(frame), _application_stack(frame)))
+
+    def __enter__(self):
+        self._wrapper = connection.execute_wrapper(self)
+        self._wrapper.__enter__()
+        return self
+
+    def __exit__(self, *exc_info):
+        self._wrapper.__exit__(*exc_info)
+
+    def repeated_shapes(self, threshold=MAX_REPEATED_QUERIES):
+        # Returns [(shape, count)] for the shapes run at least threshold times, most repeated first
+        counts = Counter(query.shape for query in self.queries if not IGNORED_SHAPES.match(query.sql))
+        return [(shape, count) for shape, count in counts.most_common() if count >= threshold]
+
+    def report(self):
+        return '\n'.join('{0}. {1}'.format(number, query.describe())
+                         for number, query in enumerate(self.queries, start=1))
+
+
+@contextmanager
+def record_queries():
+    with QueryRecorder() as recorder:
+        yield recorder
+
+
+class QueryBudgetClient(Client):
+    '''
+    Test client that checks the queries of every request against QUERY_BUDGETS and MAX_REPEATED_QUERIES.
+    The recorder of the last request is kept in last_queries.
+    '''
+
+    def __init__(self, budgets, max_repeated, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.budgets = budgets
+        self.max_repeated = max_repeated
+        self.last_queries = None
+
+    def request(self, **request):
+        with record_queries() as recorder:
+            response = super().request(**request)
+        self.last_queries = recorder
+        self.check(request['REQUEST_METHOD'], request['PATH_INFO'], recorder)
+        return response
+
+    def check(self, method, path, recorder):
+        try:
+            url_name = resolve(path).url_name
+        except Resolver404:
+            return
+        problems = []
+        budget = self.budgets.get(url_name)
+        if budget is not None and len(recorder.queries) > budget:
+            problems.append('{0} queries, the budget of {1!r} is {2}.'.format(len(recorder.queries), url_name, budget))
+        for shape, count in recorder.repeated_shapes(self.max_repeated):
+            first = next(query for query in recorder.queries if query.shape == shape)
+            problems.append('The same query ran {0} times with different parameters (N+1?):\n{1}'.format(
+                count, first.describe()))
+        if problems:
+            raise AssertionError('{0} {1}: {2}\n\nQueries:\n{3}'.format(
+                method, path, '\n'.join(problems), recorder.report()))
+
+
+class QueryBudgetTestCase(TestCase):
+    '''
+    TestCase whose client enforces the query budgets. A test class can adjust them with query_budgets (merged
+    into QUERY_BUDGETS) or max_repeated_queries.
+    '''
+    query_budgets = {}
+    max_repeated_queries = MAX_REPEATED_QUERIES
+
+    def _pre_setup(self):
+        super()._pre_setup()
+        # Pages cached by an earlier test show the objects of that test's database
+        if settings.CATALOG_PAGE_CACHE_ALIAS:
+            caches[settings.CATALOG_PAGE_CACHE_ALIAS].clear()
+        self.client = QueryBudgetClient({**QUERY_BUDGETS, **self.query_budgets}, self.max_repeated_queries)
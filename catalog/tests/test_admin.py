@@ -0,0 +1,171 @@
+from django.test import TestCase
+
+# Create your tests here.
+
+import datetime
+
+from django.contrib.auth.models import User
+from django.db import connection
+from django.test import override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+
+from catalog.models import Author, Book, BookInstance, Genre, Language
+from catalog.pagination import EstimatedCountPaginator, estimated_row_count
+
+
+class CatalogAdminChangelistTest(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        User.objects.create_superuser(username='admin', password='2HJ1vRV0Z&3iD')
+        cls.genres = [Genre.objects.create(name='Genre {0}'.format(number)) for number in range(3)]
+        cls.borrower = User.objects.create_user(username='borrower', password='1X<ISRUkw+tuK')
+
+    def setUp(self):
+        self.client.login(username='admin', password='2HJ1vRV0Z&3iD')
+
+    def add_books(self, count):
+        for number in range(count):
+            author = Author.objects.create(first_name='First', last_name='Last {0}'.format(number))
+            book = Book.objects.create(title='Book {0}'.format(number), summary='Summary',
+                                       isbn='{0}-{1}'.format(Book.objects.count(), number), author=author)
+            book.genre.set(self.genres)
+            BookInstance.objects.create(book=book, imprint='Imprint', status='o', borrower=self.borrower,
+                                        due_back=datetime.date.today())
+
+    def count_queries(self, url):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        return len(queries)
+
+    def test_changelist_queries_do_not_grow_with_rows(self):
+        for name in ('admin:catalog_book_changelist', 'admin:catalog_bookinstance_changelist',
+                     'admin:catalog_author_changelist'):
+            self.add_books(2)
+            few = self.count_queries(reverse(name))
+            self.add_books(20)
+            self.assertEqual(self.count_queries(reverse(name)), few, name)
+
+    def test_book_changelist_shows_genres(self):
+        self.add_books(1)
+        response = self.client.get(reverse('admin:catalog_book_changelist'))
+        self.assertContains(response, 'Genre 0, Genre 1, Genre 2')
+
+    @override_settings(CATALOG_ESTIMATED_COUNT_THRESHOLD=5)
+    def test_search_with_more_results_than_the_threshold_shows_a_bounded_count(self):
+        self.add_books(8)
+        response = self.client.get(reverse('admin:catalog_author_changelist'), {'q': 'Last'})
+        self.assertContains(response, '5+ authors')
+        self.assertContains(response, '5+ results')
+
+
+class EstimatedCountPaginatorTest(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        Genre.objects.bulk_create([Genre(name='Genre {0}'.format(number)) for number in range(30)])
+
+    def test_small_tables_are_counted(self):
+        self.assertEqual(EstimatedCountPaginator(Genre.objects.order_by('name'), 10).count, 30)
+
+    @override_settings(CATALOG_ESTIMATED_COUNT_THRESHOLD=10)
+    def test_large_tables_are_estimated(self):
+        Genre.objects.filter(name='Genre 0').delete()
+        estimate = estimated_row_count(Genre)
+        self.assertGreaterEqual(estimate, 29)
+        with CaptureQueriesContext(connection) as queries:
+            self.assertEqual(EstimatedCountPaginator(Genre.objects.order_by('name'), 10).count, estimate)
+        self.assertFalse([query for query in queries if 'COUNT(' in query['sql'].upper()])
+
+    @override_settings(CATALOG_ESTIMATED_COUNT_THRESHOLD=10)
+    def test_filtered_lists_are_counted_up_to_the_threshold(self):
+        few = Genre.objects.filter(name__in=['Genre 1', 'Genre 2']).order_by('name')
+        self.assertEqual(EstimatedCountPaginator(few, 10).count, 2)
+        many = Genre.objects.filter(name__startswith='Genre 1').order_by('name')
+        count = EstimatedCountPaginator(many, 10).count
+        self.assertEqual((count, str(count)), (10, '10+'))
+        exact = Genre.objects.filter(name__startswith='Genre 2').exclude(name='Genre 2').order_by('name')
+        self.assertEqual(str(EstimatedCountPaginator(exact, 10).count), '10')
+
+
+class CatalogAdminChangePageTest(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        User.objects.create_superuser(username='admin', password='2HJ1vRV0Z&3iD')
+        User.objects.bulk_create([User(username='reader{0}'.format(number)) for number in range(30)])
+        cls.author = Author.objects.create(first_name='John', last_name='Smith')
+        cls.genre = Genre.objects.create(name='Fantasy')
+        cls.language = Language.objects.create(name='English')
+        cls.book = Book.objects.create(title='Popular', summary='Summary', isbn='ISBN0', author=cls.author)
+        BookInstance.objects.bulk_create([
+            BookInstance(book=cls.book, imprint='Imprint {0:02d}'.format(number), status='a',
+                         due_back=datetime.date(2020, 1, 1) + datetime.timedelta(days=number))
+            for number in range(45)
+        ])
+        Book.objects.bulk_create([
+            Book(title='Book {0:02d}'.format(number), summary='Summary', isbn='ISBN{0}'.format(number + 1),
+                 author=cls.author)
+            for number in range(30)
+        ])
+
+    def setUp(self):
+        self.client.login(username='admin', password='2HJ1vRV0Z&3iD')
+
+    def test_book_change_page_shows_a_page_of_copies(self):
+        url = reverse('admin:catalog_book_change', args=[self.book.pk])
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.content.decode().count('Imprint '), 20)
+        self.assertContains(response, 'Page 1 of 3 (45 book instances)')
+        # The borrowers are searched, not listed
+        self.assertNotContains(response, 'reader29')
+
+        response = self.client.get(url + '?bookinstance_set-page=3')
+        self.assertEqual(response.content.decode().count('Imprint '), 5)
+        self.assertContains(response, 'Page 3 of 3')
+
+    def add_loans(self, count):
+        BookInstance.objects.bulk_create([
+            BookInstance(book=self.book, imprint='Loan', status='o', borrower=User.objects.get(username='reader1'),
+                         due_back=datetime.date(2019, 1, 1))
+            for _ in range(count)
+        ])
+
+    def test_change_page_queries_do_not_grow_with_related_rows(self):
+        # The selected borrower of each row shown is looked up by its widget, so the page is filled with loans
+        # before counting
+        url = reverse('admin:catalog_book_change', args=[self.book.pk])
+        self.add_loans(20)
+        with CaptureQueriesContext(connection) as before:
+            self.client.get(url)
+        self.add_loans(100)
+        with CaptureQueriesContext(connection) as after:
+            self.client.get(url)
+        self.assertEqual(len(after), len(before))
+
+    def test_author_change_page_shows_a_page_of_books(self):
+        response = self.client.get(reverse('admin:catalog_author_change', args=[self.author.pk]))
+        self.assertContains(response, 'Page 1 of 2 (31 books)')
+
+    def test_saving_a_page_of_copies(self):
+        url = reverse('admin:catalog_book_change', args=[self.book.pk]) + '?bookinstance_set-page=2'
+        formset = self.client.get(url).context['inline_admin_formsets'][0].formset
+        data = {
+            'title': 'Popular', 'author': self.author.pk, 'summary': 'Summary', 'isbn': 'ISBN0',
+            'genre': [self.genre.pk], 'language': self.language.pk,
+            'bookinstance_set-TOTAL_FORMS': 20, 'bookinstance_set-INITIAL_FORMS': 20,
+            'bookinstance_set-MIN_NUM_FORMS': 0, 'bookinstance_set-MAX_NUM_FORMS': 1000,
+        }
+        for number, form in enumerate(formset.forms[:20]):
+            prefix = 'bookinstance_set-{0}-'.format(number)
+            copy = form.instance
+            data.update({prefix + 'id': copy.pk, prefix + 'book': self.book.pk, prefix + 'imprint': copy.imprint,
+                         prefix + 'status': copy.status,
+                         prefix + 'due_back': copy.due_back})
+        data['bookinstance_set-0-status'] = 'd'
+        response = self.client.post(url, data)
+        self.assertEqual(response.status_code, 302)
+        self.assertEqual(BookInstance.objects.get(pk=formset.forms[0].instance.pk).status, 'd')
@@ -0,0 +1,110 @@
+from django.test import TransactionTestCase
+
+# Create your tests here.
+
+import datetime
+
+from asgiref.sync import async_to_sync
+from django.conf import settings
+from django.contrib.auth.models import AnonymousUser
+from django.core.cache import cache, caches
+from django.http import Http404
+from django.test import RequestFactory, override_settings
+from django.urls import reverse
+
+from catalog import async_views, views
+from catalog.models import Author, Book, BookInstance, Genre
+
+
+# The async views run their queries in other threads, which only see committed data, hence TransactionTestCase
+@override_settings(CATALOG_PAGE_CACHE_ALIAS=None)
+class AsyncViewsTest(TransactionTestCase):
+
+    def setUp(self):
+        cache.clear()
+        self.factory = RequestFactory()
+        self.author = Author.objects.create(first_name='John', last_name='Smith')
+        genre = Genre.objects.create(name='Fantasy')
+        for number in range(13):
+            book = Book.objects.create(title='Book {0:02d}'.format(number), summary='Summary', isbn=str(number),
+                                       author=self.author)
+            book.genre.add(genre)
+        self.book = Book.objects.get(title='Book 00')
+        BookInstance.objects.create(book=self.book, imprint='Imprint', status='o',
+                                    due_back=datetime.date.today())
+
+    def request(self, path, **extra):
+        request = self.factory.get(path, **extra)
+        request.user = AnonymousUser()
+        return request
+
+    def assertSamePage(self, sync_view, async_view, path, **kwargs):
+        sync_response = sync_view(self.request(path), **kwargs)
+        if hasattr(sync_response, 'render'):
+            sync_response.render()
+        async_response = async_to_sync(async_view)(self.request(path), **kwargs)
+        self.assertEqual(async_response.status_code, sync_response.status_code)
+        self.assertEqual(async_response.content, sync_response.content)
+        self.assertEqual(async_response.get('ETag'), sync_response.get('ETag'))
+        self.assertEqual(async_response.get('Last-Modified'), sync_response.get('Last-Modified'))
+        return async_response
+
+    def test_index_matches_sync_view(self):
+        response = self.assertSamePage(views.index, async_views.index, reverse('index'))
+        self.assertIn('num_visits', response.cookies)
+
+    def test_book_list_matches_sync_view(self):
+        for query in ('', '?page=2', '?page=last'):
+            self.assertSamePage(views.BookListView.as_view(), async_views.book_list, reverse('books') + query)
+
+    @override_settings(CATALOG_PAGINATION='keyset')
+    def test_book_list_matches_sync_view_with_keyset_pagination(self):
+        self.assertSamePage(views.BookListView.as_view(), async_views.book_list, reverse('books'))
+
+    def test_author_list_matches_sync_view(self):
+        self.assertSamePage(views.AuthorListView.as_view(), async_views.author_list, reverse('authors'))
+
+    def test_book_list_invalid_page_is_404(self):
+        for page in ('3', '0', 'x'):
+            with self.assertRaises(Http404):
+                async_to_sync(async_views.book_list)(self.request(reverse('books') + '?page=' + page))
+
+    def test_book_detail_matches_sync_view(self):
+        response = self.assertSamePage(views.BookDetailView.as_view(), async_views.book_detail,
+                                       reverse('book-detail', args=[self.book.pk]), pk=self.book.pk)
+        self.assertContains(response, 'Fantasy')
+        self.assertContains(response, 'Imprint')
+
+    def test_author_detail_matches_sync_view(self):
+        url = reverse('author-detail', args=[self.author.pk])
+        for query in ('', '?page=2', '?page=99', '?page=x'):
+            cache.clear()
+            self.assertSamePage(views.AuthorDetailView.as_view(), async_views.author_detail, url + query,
+                                pk=self.author.pk)
+
+    def test_missing_objects_are_404(self):
+        with self.assertRaises(Http404):
+            async_to_sync(async_views.book_detail)(self.request('/'), pk=0)
+        with self.assertRaises(Http404):
+            async_to_sync(async_views.author_detail)(self.request('/'), pk=0)
+
+    def test_conditional_request_is_not_modified(self):
+        url = reverse('book-detail', args=[self.book.pk])
+        response = async_to_sync(async_views.book_detail)(self.request(url), pk=self.book.pk)
+        response = async_to_sync(async_views.book_detail)(
+            self.request(url, HTTP_IF_NONE_MATCH=response['ETag']), pk=self.book.pk)
+        self.assertEqual(response.status_code, 304)
+
+
+class AsyncMiddlewareTest(TransactionTestCase):
+
+    def setUp(self):
+        caches[settings.CATALOG_PAGE_CACHE_ALIAS].clear()
+        Book.objects.create(title='Book', summary='Summary', isbn='ISBN1')
+
+    async def test_pages_are_served_under_asgi(self):
+        response = await self.async_client.get(reverse('books'))
+        self.assertEqual(response.status_code, 200)
+        self.assertContains(response, 'Book')
+        response = await self.async_client.get(reverse('books'))
+        self.assertEqual(response.get('X-Page-Cache'), 'hit')
@@ -0,0 +1,257 @@
+from django.test import TestCase
+
+# Create your tests here.
+
+import os
+import tempfile
+from io import StringIO
+
+from django.core.management import call_command
+
+from catalog.models import Book, BookAvailability, BookInstance
+
+
+class RebuildBookAvailabilityCommandTest(TestCase):
+
+    def setUp(self):
+        for number in range(3):
+            book = Book.objects.create(title='Book {0}'.format(number), summary='Summary',
+                                       isbn='ISBN{0}'.format(number))
+            BookInstance.objects.create(book=book, imprint='Imprint', status='a')
+
+    def test_reports_drift_without_changes_in_dry_run(self):
+        BookInstance.objects.filter(book__title='Book 1').update(status='o')
+
+        out = StringIO()
+        call_command('rebuild_book_availability', '--dry-run', '--chunk-size=2', stdout=out)
+        self.assertIn('Checked 3 books, 1 had drifted.', out.getvalue())
+
+        book = Book.objects.get(title='Book 1')
+        self.assertEqual(BookAvailability.totals([book.pk])[book.pk]['available'], 1)
+
+    def test_rebuild_fixes_drift(self):
+        BookInstance.objects.filter(book__title='Book 1').update(status='o')
+        call_command('rebuild_book_availability', '--chunk-size=2', stdout=StringIO())
+
+        out = StringIO()
+        call_command('rebuild_book_availability', '--dry-run', stdout=out)
+        self.assertIn('Checked 3 books, 0 had drifted.', out.getvalue())
+
+
+from django.core.cache import cache
+
+from catalog.models import Author, Genre, Language
+from catalog.search import search_books
+
+
+class ImportCatalogCommandTest(TestCase):
+
+    CSV = (
+        'title,isbn,summary,author_first_name,author_last_name,language,genres,copies,imprint,status\n'
+        'Dune,978-0441013593,Desert planet,Frank,Herbert,English,Science Fiction;Classic,3,Ace,a\n'
+        'Dune Messiah,9780593098233,Sequel,Frank,Herbert,English,Science Fiction,1,Ace,o\n'
+        'Duplicate,9780441013593,Same ISBN,,,,,0,,\n'
+        ',9780000000000,No title,,,,,0,,\n'
+    )
+
+    def setUp(self):
+        cache.clear()
+        Genre.objects.create(name='Classic')
+
+    def import_file(self, content, suffix='.csv', workers=0, batch_size=100):
+        handle, path = tempfile.mkstemp(suffix=suffix)
+        with os.fdopen(handle, 'w') as stream:
+            stream.write(content)
+        self.addCleanup(os.remove, path)
+
+        out = StringIO()
+        # bulk_create() sends no signals: the caches and indexes are updated once the transaction commits
+        with self.captureOnCommitCallbacks(execute=True):
+            call_command('import_catalog', path, workers=workers, batch_size=batch_size, stdout=out)
+        return out.getvalue()
+
+    def test_imports_books_and_related_objects(self):
+        out = self.import_file(self.CSV)
+        self.assertIn('Imported 2 books and 4 copies; skipped 1 duplicate ISBNs and 1 invalid records.', out)
+
+        dune = Book.objects.get(isbn='9780441013593')
+        self.assertEqual(str(dune.author), 'Herbert, Frank')
+        self.assertEqual(dune.language.name, 'English')
+        self.assertEqual(sorted(genre.name for genre in dune.genre.all()), ['Classic', 'Science Fiction'])
+        self.assertEqual(Author.objects.count(), 1)
+        self.assertEqual(Genre.objects.count(), 2)
+        self.assertEqual(Language.objects.count(), 1)
+        self.assertEqual(BookInstance.objects.filter(book=dune, status='a').count(), 3)
+
+    def test_skips_books_already_in_the_catalog(self):
+        self.import_file(self.CSV)
+        out = self.import_file(self.CSV)
+        self.assertIn('Imported 0 books and 0 copies; skipped 3 duplicate ISBNs', out)
+
+    def test_updates_counters_and_search_index(self):
+        self.import_file(self.CSV)
+        dune = Book.objects.get(isbn='9780441013593')
+        self.assertEqual(BookAvailability.totals([dune.pk])[dune.pk]['available'], 3)
+        self.assertEqual(list(search_books('herbert')[0:10]), list(Book.objects.order_by('pk')))
+
+    def test_imports_json_lines_with_a_process_pool(self):
+        content = (
+            '{"title": "Dune", "isbn": "9780441013593", "author_last_name": "Herbert", "genres": ["Classic"],'
+            ' "copies": 2}\n'
+            '\n'
+            '{"title": "Broken", "isbn": "1", "copies": "many"}\n'
+            'not json\n'
+        )
+        out = self.import_file(content, suffix='.jsonl', workers=2, batch_size=2)
+        self.assertIn('Imported 1 books and 2 copies; skipped 0 duplicate ISBNs and 2 invalid records.', out)
+        self.assertEqual(Book.objects.get().genre.get().name, 'Classic')
+
+
+import gzip
+import json
+
+
+class ExportCatalogCommandTest(TestCase):
+
+    def test_writes_gzipped_jsonl_file(self):
+        book = Book.objects.create(title='Book', summary='Summary', isbn='ISBN1')
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'catalog.jsonl.gz')
+            call_command('export_catalog', path, stdout=StringIO())
+            with gzip.open(path, 'rt') as stream:
+                books = [json.loads(line) for line in stream]
+        self.assertEqual(books, [{
+            'id': book.pk, 'title': 'Book', 'isbn': 'ISBN1', 'summary': 'Summary', 'author_first_name': None,
+            'author_last_name': None, 'language': None, 'genres': [],
+        }])
+
+
+import datetime
+
+from django.contrib.auth.models import User
+from django.core import mail
+from django.core.mail.backends.locmem import EmailBackend
+from django.core.management.base import CommandError
+from django.test import override_settings
+
+from catalog.models import JobCheckpoint
+
+
+class FailingEmailBackend(EmailBackend):
+    # Refuses the messages to the addresses in failing_addresses
+    failing_addresses = set()
+
+    def send_messages(self, messages):
+        if any(address in self.failing_addresses for message in messages for address in message.to):
+            raise OSError('Connection reset')
+        return super().send_messages(messages)
+
+
+class ProcessOverdueCommandTest(TestCase):
+
+    def setUp(self):
+        self.today = datetime.date.today()
+        self.book = Book.objects.create(title='Overdue Book', summary='Summary', isbn='ISBN1')
+        self.alice = User.objects.create_user(username='alice', email='alice@example.com', password='1X<ISRUkw+tuK')
+        self.bob = User.objects.create_user(username='bob', email='bob@example.com', password='2HJ1vRV0Z&3iD')
+
+    def lend(self, borrower, days_overdue, status='o'):
+        return BookInstance.objects.create(book=self.book, imprint='Imprint', status=status, borrower=borrower,
+                                           due_back=self.today - datetime.timedelta(days=days_overdue))
+
+    def test_sends_one_email_per_borrower(self):
+        self.lend(self.alice, 3)
+        self.lend(self.alice, 1)
+        self.lend(self.bob, 2)
+        self.lend(self.bob, 0)
+        self.lend(self.bob, 5, status='a')
+
+        out = StringIO()
+        call_command('process_overdue', stdout=out)
+        self.assertEqual(sorted(message.to[0] for message in mail.outbox), ['alice@example.com', 'bob@example.com'])
+        alice_email = next(message for message in mail.outbox if message.to == ['alice@example.com'])
+        self.assertEqual(alice_email.subject, '2 overdue library books')
+        self.assertIn('Sent 2 reminders for 3 overdue loans of 2 borrowers', out.getvalue())
+        self.assertEqual(JobCheckpoint.objects.get(name='process_overdue').position, self.today)
+
+    def test_later_runs_only_remind_of_newly_overdue_loans(self):
+        self.lend(self.alice, 3)
+        JobCheckpoint.objects.create(name='process_overdue', position=self.today - datetime.timedelta(days=1))
+        self.lend(self.bob, 1)
+
+        call_command('process_overdue', stdout=StringIO())
+        self.assertEqual([message.to for message in mail.outbox], [['bob@example.com']])
+
+        mail.outbox = []
+        call_command('process_overdue', '--full', stdout=StringIO())
+        self.assertEqual(len(mail.outbox), 2)
+
+    # alice is created first, so she is reminded before bob
+    @override_settings(EMAIL_BACKEND='catalog.tests.test_commands.FailingEmailBackend')
+    def test_failed_reminders_are_retried_by_the_next_run(self):
+        self.lend(self.alice, 3)
+        self.lend(self.bob, 2)
+
+        FailingEmailBackend.failing_addresses = {'bob@example.com'}
+        try:
+            with self.assertRaises(CommandError):
+                call_command('process_overdue', stdout=StringIO())
+        finally:
+            FailingEmailBackend.failing_addresses = set()
+        self.assertEqual([message.to for message in mail.outbox], [['alice@example.com']])
+        # The checkpoint has only moved past the borrower whose reminder was sent
+        checkpoint = JobCheckpoint.objects.get(name='process_overdue')
+        self.assertEqual((checkpoint.until, checkpoint.last_id), (self.today, self.alice.pk))
+
+        mail.outbox = []
+        call_command('process_overdue', stdout=StringIO())
+        self.assertEqual([message.to for message in mail.outbox], [['bob@example.com']])
+        checkpoint = JobCheckpoint.objects.get(name='process_overdue')
+        self.assertEqual((checkpoint.position, checkpoint.until, checkpoint.last_id), (self.today, None, None))
+
+    def test_interrupted_run_is_resumed_before_the_newly_overdue_loans(self):
+        self.lend(self.alice, 3)
+        self.lend(self.bob, 3)
+        self.lend(self.bob, 1)
+        # A run that stopped two days ago after reminding alice
+        two_days_ago = self.today - datetime.timedelta(days=2)
+        JobCheckpoint.objects.create(name='process_overdue', position=two_days_ago - datetime.timedelta(days=7),
+                                     until=two_days_ago, last_id=self.alice.pk)
+
+        call_command('process_overdue', stdout=StringIO())
+        # One reminder for the rest of the interrupted run, one for the loans that fell due since
+        self.assertEqual([message.to for message in mail.outbox], [['bob@example.com'], ['bob@example.com']])
+        self.assertIn('3 days ago', mail.outbox[0].body)
+        self.assertIn('1 day ago', mail.outbox[1].body)
+        self.assertEqual(JobCheckpoint.objects.get(name='process_overdue').position, self.today)
+
+    def test_dry_run_sends_nothing(self):
+        self.lend(self.alice, 3)
+        out = StringIO()
+        call_command('process_overdue', '--dry-run', stdout=out)
+        self.assertEqual(mail.outbox, [])
+        self.assertIn('Would send 1 reminders', out.getvalue())
+        self.assertFalse(JobCheckpoint.objects.exists())
+
+
+class GenerateDatasetAndBenchmarkViewsCommandTest(TestCase):
+
+    def test_generates_dataset_and_benchmarks_every_url(self):
+        call_command('generate_dataset', '--authors=5', '--books=20', '--copies=60', '--borrowers=4',
+                     '--batch-size=8', stdout=StringIO())
+        self.assertEqual(Author.objects.count(), 5)
+        self.assertEqual(Book.objects.count(), 20)
+        self.assertEqual(BookInstance.objects.count(), 60)
+        self.assertTrue(BookInstance.objects.filter(status='o', borrower__isnull=False).exists())
+
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'results.json')
+            call_command('benchmark_views', '--repeat=2', '--warmup=0', '--output', path,
+                         stdout=StringIO(), stderr=StringIO())
+            with open(path) as stream:
+                results = json.load(stream)
+        self.assertEqual(results['metadata']['counts']['books'], 20)
+        self.assertIn('book-detail', results['results'])
+        self.assertNotIn('export', results['results'])
+        self.assertEqual(results['results']['my-borrowed']['user'], 'borrower')
+        self.assertGreater(results['results']['books']['p50_ms'], 0)
@@ -45,3 +45,87 @@ class RenewBookFormTest(TestCase):
         self.assertEqual(
             form.fields['renewal_date'].help_text,
             'Enter a date between now and 4 weeks (default 3).')
+
+
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+
+from catalog.forms import BookForm
+from catalog.models import Author, Book, Genre, Language
+
+
+class BookFormTest(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        Author.objects.bulk_create([Author(first_name='First', last_name='Author {0:03d}'.format(number))
+                                    for number in range(50)])
+        Genre.objects.bulk_create([Genre(name='Genre {0}'.format(number)) for number in range(20)])
+        cls.author = Author.objects.get(last_name='Author 007')
+        cls.genre = Genre.objects.get(name='Genre 3')
+        cls.language = Language.objects.create(name='English')
+
+    def data(self, **values):
+        data = {'title': 'Title', 'summary': 'Summary', 'isbn': '1234567890123', 'author': self.author.pk,
+                'genre': [self.genre.pk], 'language': self.language.pk}
+        data.update(values)
+        return data
+
+    def test_unbound_form_renders_no_choices(self):
+        html = BookForm().as_table()
+        self.assertNotIn('Author 000', html)
+        self.assertNotIn('Genre 0', html)
+        self.assertIn('data-lookup-url="/catalog/lookup/authors/"', html)
+        self.assertIn('js/lookup', str(BookForm().media))
+
+    def test_only_selected_choices_are_rendered(self):
+        book = Book.objects.create(title='Title', summary='Summary', isbn='ISBN', author=self.author,
+                                   language=self.language)
+        book.genre.add(self.genre)
+        form = BookForm(instance=book)
+        with self.assertNumQueries(3):
+            html = form.as_table()
+        self.assertIn('Author 007, First', html)
+        self.assertIn('Genre 3', html)
+        self.assertNotIn('Author 008', html)
+        self.assertNotIn('Genre 4', html)
+
+    def test_validation_only_looks_up_submitted_ids(self):
+        form = BookForm(data=self.data())
+        with CaptureQueriesContext(connection) as queries:
+            self.assertTrue(form.is_valid())
+        # The fields and the model's foreign key validation look up the submitted ids, the ISBN is checked for
+        # uniqueness: no query reads the whole table
+        for query in queries:
+            self.assertIn(' WHERE ', query['sql'])
+        self.assertEqual(form.cleaned_data['author'], self.author)
+
+    def test_invalid_ids_are_rejected(self):
+        form = BookForm(data=self.data(author=0, genre=['x']))
+        self.assertFalse(form.is_valid())
+        self.assertIn('author', form.errors)
+        self.assertIn('genre', form.errors)
+        # The invalid values are not rendered as options
+        self.assertNotIn('value="x"', form.as_table())
+
+
+import uuid
+
+from catalog.forms import MAX_BULK_COPIES, BulkLoanForm
+
+
+class BulkLoanFormTest(TestCase):
+
+    def test_return_needs_no_date(self):
+        form = BulkLoanForm(data={'action': 'return', 'copies': [str(uuid.uuid4())]})
+        self.assertTrue(form.is_valid())
+
+    def test_renewal_needs_a_date(self):
+        form = BulkLoanForm(data={'action': 'renew', 'copies': [str(uuid.uuid4())]})
+        self.assertIn('renewal_date', form.errors)
+
+    def test_copies_are_checked(self):
+        self.assertIn('copies', BulkLoanForm(data={'action': 'return', 'copies': ['x']}).errors)
+        self.assertIn('copies', BulkLoanForm(data={'action': 'return'}).errors)
+        copies = [str(uuid.uuid4()) for _ in range(MAX_BULK_COPIES + 1)]
+        self.assertIn('copies', BulkLoanForm(data={'action': 'return', 'copies': copies}).errors)
@@ -0,0 +1,180 @@
+from django.test import TestCase, TransactionTestCase
+
+# Create your tests here.
+
+import datetime
+import threading
+
+from django.contrib.auth.models import User
+from django.db import OperationalError, connection
+from django.test.utils import CaptureQueriesContext
+
+from catalog.loans import LoanConflict, bulk_return, checkout, renew, return_copy
+from catalog.models import Author, Book, BookAvailability, BookInstance
+
+
+def create_copies(count, status='a'):
+    author = Author.objects.create(first_name='John', last_name='Smith')
+    book = Book.objects.create(title='Book Title', summary='Summary', isbn='ABCDEFG', author=author)
+    return book, [BookInstance.objects.create(book=book, imprint='Imprint', status=status) for _ in range(count)]
+
+
+class LoanChangeTest(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.borrower = User.objects.create_user(username='borrower', password='1X<ISRUkw+tuK')
+        cls.book, (cls.copy,) = create_copies(1)
+        cls.due_back = datetime.date.today() + datetime.timedelta(weeks=3)
+
+    def availability(self):
+        return BookAvailability.totals([self.book.pk])[self.book.pk]
+
+    def test_checkout_return_and_renew(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            checkout(self.copy, self.borrower, self.due_back)
+        copy = BookInstance.objects.get(pk=self.copy.pk)
+        self.assertEqual((copy.status, copy.borrower, copy.due_back, copy.version),
+                         ('o', self.borrower, self.due_back, 1))
+        self.assertEqual(self.copy.version, 1)
+        self.assertEqual(self.availability()['on_loan'], 1)
+        self.assertEqual(self.availability()['available'], 0)
+
+        renew(self.copy, self.due_back + datetime.timedelta(days=7))
+        self.assertEqual(BookInstance.objects.get(pk=self.copy.pk).due_back, self.due_back + datetime.timedelta(days=7))
+
+        return_copy(self.copy)
+        copy = BookInstance.objects.get(pk=self.copy.pk)
+        self.assertEqual((copy.status, copy.borrower, copy.due_back, copy.version), ('a', None, None, 3))
+        self.assertEqual(self.availability()['on_loan'], 0)
+        self.assertEqual(self.availability()['available'], 1)
+
+    def test_only_changed_columns_are_written(self):
+        with CaptureQueriesContext(connection) as queries:
+            checkout(self.copy, self.borrower, self.due_back)
+        update = next(query['sql'] for query in queries if query['sql'].startswith('UPDATE "catalog_bookinstance"'))
+        self.assertNotIn('"imprint"', update)
+        self.assertNotIn('"book_id" =', update.split('WHERE')[0])
+        self.assertIn('"version"', update.split('WHERE')[1])
+
+    def test_stale_copy_is_not_changed(self):
+        stale = BookInstance.objects.get(pk=self.copy.pk)
+        checkout(self.copy, self.borrower, self.due_back)
+        with self.assertRaises(LoanConflict):
+            checkout(stale, self.borrower, self.due_back + datetime.timedelta(days=1))
+        self.assertEqual(BookInstance.objects.get(pk=self.copy.pk).due_back, self.due_back)
+        self.assertEqual(self.availability()['on_loan'], 1)
+
+    def test_wrong_status_is_a_conflict(self):
+        with self.assertRaises(LoanConflict):
+            return_copy(self.copy)
+        with self.assertRaises(LoanConflict):
+            renew(self.copy, self.due_back)
+        self.assertEqual(BookInstance.objects.get(pk=self.copy.pk).version, 0)
+
+    def test_save_and_bulk_changes_make_read_copies_stale(self):
+        stale = BookInstance.objects.get(pk=self.copy.pk)
+        copy = BookInstance.objects.get(pk=self.copy.pk)
+        copy.imprint = 'New imprint'
+        copy.save()
+        self.assertEqual(copy.version, 1)
+        with self.assertRaises(LoanConflict):
+            checkout(stale, self.borrower, self.due_back)
+
+        checkout(copy, self.borrower, self.due_back)
+        bulk_return([copy.pk])
+        with self.assertRaises(LoanConflict):
+            renew(copy, self.due_back)
+        self.assertEqual(BookInstance.objects.get(pk=self.copy.pk).version, 3)
+
+
+# Each thread uses its own database connection, and only sees committed data, hence TransactionTestCase
+class LoanConcurrencyTest(TransactionTestCase):
+
+    THREADS = 8
+
+    def run_threads(self, target, count):
+        barrier = threading.Barrier(count)
+        errors = []
+
+        def run(number):
+            try:
+                barrier.wait()
+                target(number)
+            except Exception as error:  # Reported by the test thread
+                errors.append(error)
+            finally:
+                connection.close()
+
+        threads = [threading.Thread(target=run, args=(number,)) for number in range(count)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(errors, [])
+
+    def attempt(self, function, *args, **kwargs):
+        # The in-memory test database locks whole tables and doesn't wait for them, so a query that finds a table
+        # locked (which changes nothing) is tried again. Other databases simply wait for the locks. When it is
+        # one of the queries run after the commit, the change is made and the copy holds its new version, so the
+        # retry is a conflict; the callers tell a change made by its version.
+        while True:
+            try:
+                return function(*args, **kwargs)
+            except OperationalError as error:
+                if 'locked' not in str(error):
+                    raise
+
+    def test_only_one_checkout_of_a_copy_succeeds(self):
+        borrowers = [User.objects.create_user(username='borrower{0}'.format(number))
+                     for number in range(self.THREADS)]
+        book, (copy,) = create_copies(1)
+        # Every desk read the copy as available before any of them checks it out
+        reads = [BookInstance.objects.get(pk=copy.pk) for _ in range(self.THREADS)]
+        winners = []
+        conflicts = []
+
+        def borrow(number):
+            try:
+                self.attempt(checkout, reads[number], borrowers[number], datetime.date.today())
+            except LoanConflict:
+                pass
+            (winners if reads[number].version else conflicts).append(number)
+
+        self.run_threads(borrow, self.THREADS)
+        self.assertEqual(len(winners), 1)
+        self.assertEqual(len(conflicts), self.THREADS - 1)
+        copy.refresh_from_db()
+        self.assertEqual((copy.status, copy.borrower, copy.version), ('o', borrowers[winners[0]], 1))
+        self.assertEqual(BookAvailability.totals([book.pk])[book.pk]['on_loan'], 1)
+
+    def test_desk_traffic_keeps_copies_and_counters_consistent(self):
+        borrower = User.objects.create_user(username='borrower')
+        book, copies = create_copies(3)
+        done = []
+
+        def desk(number):
+            # Each desk checks out and returns the copies in turn, working from what it last read
+            for round in range(10):
+                copy = self.attempt(BookInstance.objects.get, pk=copies[(number + round) % len(copies)].pk)
+                change = (checkout, copy, borrower, datetime.date.today()) if copy.status == 'a' \
+                    else (return_copy, copy)
+                read_version = copy.version
+                try:
+                    self.attempt(*change)
+                except LoanConflict:
+                    pass
+                if copy.version != read_version:
+                    done.append((copy.pk, copy.version, copy.status))
+
+        self.run_threads(desk, self.THREADS)
+        self.assertTrue(done)
+
+        for copy in copies:
+            copy.refresh_from_db()
+            # Every successful change moved the copy to the next version and to the other status: none was lost
+            changes = sorted((version, status) for pk, version, status in done if pk == copy.pk)
+            self.assertEqual([version for version, status in changes], list(range(1, copy.version + 1)))
+            self.assertEqual([status for version, status in changes],
+                             ['o' if version % 2 else 'a' for version in range(1, copy.version + 1)])
+        self.assertEqual(BookAvailability.totals([book.pk]), BookAvailability.count_copies([book.pk]))
@@ -0,0 +1,148 @@
+from django.test import TestCase
+
+# Create your tests here.
+
+from django.contrib.auth.models import User
+from django.template.base import Template
+from django.urls import reverse
+
+from catalog.models import Book, ProfileReport
+
+
+class ProfilingMiddlewareTest(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        Book.objects.create(title='Book', summary='Summary', isbn='ISBN1')
+        User.objects.create_user(username='visitor', password='1X<ISRUkw+tuK')
+        User.objects.create_superuser(username='staff', password='2HJ1vRV0Z&3iD')
+
+    def test_requests_are_not_profiled_without_header(self):
+        self.client.login(username='staff', password='2HJ1vRV0Z&3iD')
+        response = self.client.get(reverse('books'))
+        self.assertNotIn('X-Profile-Report', response)
+        self.assertFalse(ProfileReport.objects.exists())
+
+    def test_non_staff_users_cannot_profile(self):
+        self.client.login(username='visitor', password='1X<ISRUkw+tuK')
+        response = self.client.get(reverse('books'), HTTP_X_PROFILE='1')
+        self.assertNotIn('X-Profile-Report', response)
+        self.assertFalse(ProfileReport.objects.exists())
+
+    def test_profiles_staff_request(self):
+        self.client.login(username='staff', password='2HJ1vRV0Z&3iD')
+        original_render = Template._render
+        response = self.client.get(reverse('books'), HTTP_X_PROFILE='1')
+
+        self.assertEqual(response.status_code, 200)
+        report = ProfileReport.objects.get(pk=response['X-Profile-Report'])
+        self.assertEqual(report.path, reverse('books'))
+        self.assertEqual(report.query_count, len(report.queries))
+        self.assertTrue(any('catalog_book' in query['sql'] for query in report.queries))
+        self.assertIn(('base_generic.html', 1),
+                      [(template['name'], template['depth']) for template in report.templates])
+        self.assertIn('Top functions by cumulative time', report.profile)
+        # The template timing is removed once the request is done
+        self.assertIs(Template._render, original_render)
+
+    def test_text_report(self):
+        self.client.login(username='staff', password='2HJ1vRV0Z&3iD')
+        response = self.client.get(reverse('books'), {'_profile': 'text'})
+        self.assertEqual(response['Content-Type'], 'text/plain; charset=utf-8')
+        self.assertContains(response, 'GET /catalog/books/?_profile=text -> 200')
+
+        report = ProfileReport.objects.get()
+        response = self.client.get(reverse('admin:catalog_profilereport_change', args=[report.pk]))
+        self.assertEqual(response.status_code, 200)
+        self.assertContains(response, 'catalog_book')
+
+
+from django.core.cache import cache, caches
+from django.conf import settings
+
+from catalog.models import Author
+
+
+class PageCacheMiddlewareTest(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.author = Author.objects.create(first_name='John', last_name='Smith')
+        cls.book = Book.objects.create(title='First Book', summary='Summary', isbn='ISBN1', author=cls.author)
+        cls.other_book = Book.objects.create(title='Other Book', summary='Summary', isbn='ISBN2')
+        User.objects.create_user(username='visitor', password='1X<ISRUkw+tuK')
+
+    def setUp(self):
+        cache.clear()
+        caches[settings.CATALOG_PAGE_CACHE_ALIAS].clear()
+
+    def test_anonymous_pages_are_served_from_cache(self):
+        url = reverse('book-detail', args=[self.book.pk])
+        response = self.client.get(url)
+        self.assertNotIn('X-Page-Cache', response)
+
+        with self.assertNumQueries(0):
+            response = self.client.get(url)
+        self.assertEqual(response['X-Page-Cache'], 'hit')
+        self.assertContains(response, 'First Book')
+
+    def test_saving_a_book_only_invalidates_its_pages(self):
+        book_url = reverse('book-detail', args=[self.book.pk])
+        other_url = reverse('book-detail', args=[self.other_book.pk])
+        for url in (book_url, other_url, reverse('books'), reverse('authors')):
+            self.client.get(url)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.book.title = 'Renamed Book'
+            self.book.save()
+
+        self.assertContains(self.client.get(book_url), 'Renamed Book')
+        self.assertContains(self.client.get(reverse('books')), 'Renamed Book')
+        self.assertEqual(self.client.get(other_url)['X-Page-Cache'], 'hit')
+        self.assertEqual(self.client.get(reverse('authors'))['X-Page-Cache'], 'hit')
+
+    def test_renaming_an_author_invalidates_the_lists(self):
+        self.client.get(reverse('books'))
+        with self.captureOnCommitCallbacks(execute=True):
+            self.author.last_name = 'Jones'
+            self.author.save()
+        self.assertContains(self.client.get(reverse('books')), 'Jones')
+
+    def test_logged_in_users_bypass_the_cache(self):
+        url = reverse('books')
+        self.client.get(url)
+        self.client.login(username='visitor', password='1X<ISRUkw+tuK')
+        response = self.client.get(url)
+        self.assertNotIn('X-Page-Cache', response)
+        self.assertContains(response, 'visitor')
+
+
+from django.test import override_settings
+
+from catalog.checks import check_process_local_default_cache, check_shared_default_cache
+
+
+class SharedCacheCheckTest(TestCase):
+    LOCAL = {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}
+    SHARED = {'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache', 'LOCATION': '/tmp/catalog-pages'}
+
+    def test_shared_page_cache_needs_shared_default_cache(self):
+        with override_settings(CACHES={'default': self.LOCAL, 'pages': self.SHARED}):
+            self.assertEqual([error.id for error in check_shared_default_cache(None)], ['catalog.E001'])
+        with override_settings(CACHES={'default': self.SHARED, 'pages': self.SHARED}):
+            self.assertEqual(check_shared_default_cache(None), [])
+
+    def test_local_or_disabled_page_cache_passes(self):
+        with override_settings(CACHES={'default': self.LOCAL, 'pages': self.LOCAL}):
+            self.assertEqual(check_shared_default_cache(None), [])
+        with override_settings(CACHES={'default': self.LOCAL, 'pages': self.SHARED}, CATALOG_PAGE_CACHE_ALIAS=None):
+            self.assertEqual(check_shared_default_cache(None), [])
+
+    def test_process_local_default_cache_warns_while_pages_are_cached(self):
+        with override_settings(CACHES={'default': self.LOCAL, 'pages': self.LOCAL}):
+            self.assertEqual([warning.id for warning in check_process_local_default_cache(None)], ['catalog.W001'])
+        with override_settings(CACHES={'default': self.LOCAL, 'pages': self.LOCAL}, CATALOG_PAGE_CACHE_ALIAS=None,
+                               CATALOG_DETAIL_CACHE_TIMEOUT=0):
+            self.assertEqual(check_process_local_default_cache(None), [])
+        with override_settings(CACHES={'default': self.SHARED, 'pages': self.LOCAL}):
+            self.assertEqual(check_process_local_default_cache(None), [])
@@ -52,3 +52,134 @@ class AuthorModelTest(TestCase):
         author = Author.objects.get(id=1)
         # This will also fail if the urlconf is not defined.
         self.assertEqual(author.get_absolute_url(), '/catalog/author/1')
+
+
+from catalog.models import Book, BookAvailability, BookInstance
+
+
+class BookAvailabilityModelTest(TestCase):
+
+    def setUp(self):
+        self.book = Book.objects.create(title='Book Title', summary='My book summary', isbn='ABCDEFG')
+        self.other_book = Book.objects.create(title='Other Title', summary='My book summary', isbn='HIJKLMN')
+
+    def totals(self, book):
+        return BookAvailability.totals([book.pk]).get(book.pk)
+
+    def test_counters_follow_created_copies(self):
+        for status in ('a', 'a', 'o', 'r', 'd'):
+            BookInstance.objects.create(book=self.book, imprint='Imprint', status=status)
+        self.assertEqual(self.totals(self.book),
+                         {'maintenance': 1, 'on_loan': 1, 'available': 2, 'reserved': 1})
+
+    def test_counters_follow_status_change(self):
+        copy = BookInstance.objects.create(book=self.book, imprint='Imprint', status='a')
+
+        # Reload the copy, as views and admin do, before changing its status
+        copy = BookInstance.objects.get(pk=copy.pk)
+        copy.status = 'o'
+        copy.save()
+        copy.save()
+        self.assertEqual(self.totals(self.book),
+                         {'maintenance': 0, 'on_loan': 1, 'available': 0, 'reserved': 0})
+
+    def test_counters_follow_copy_moved_to_other_book(self):
+        copy = BookInstance.objects.create(book=self.book, imprint='Imprint', status='a')
+        copy.book = self.other_book
+        copy.save()
+        self.assertEqual(self.totals(self.book)['available'], 0)
+        self.assertEqual(self.totals(self.other_book)['available'], 1)
+
+    def test_counters_follow_deleted_copy(self):
+        copy = BookInstance.objects.create(book=self.book, imprint='Imprint', status='r')
+        BookInstance.objects.get(pk=copy.pk).delete()
+        self.assertEqual(self.totals(self.book)['reserved'], 0)
+
+    def test_rebuild_replaces_drifted_counters(self):
+        BookInstance.objects.create(book=self.book, imprint='Imprint', status='a')
+        # queryset.update() bypasses the signals, so the counters drift
+        BookInstance.objects.update(status='o')
+
+        BookAvailability.rebuild([self.book.pk])
+        self.assertEqual(self.totals(self.book),
+                         {'maintenance': 0, 'on_loan': 1, 'available': 0, 'reserved': 0})
+        self.assertEqual(BookAvailability.objects.filter(book=self.book).count(), 1)
+
+    def test_rebuild_counts_inside_its_transaction(self):
+        from django.db import connection
+        from django.test.utils import CaptureQueriesContext
+
+        BookInstance.objects.create(book=self.book, imprint='Imprint', status='a')
+        with CaptureQueriesContext(connection) as queries:
+            BookAvailability.rebuild([self.book.pk])
+        statements = [query['sql'] for query in queries]
+        transaction_start = next(number for number, sql in enumerate(statements) if sql.startswith('SAVEPOINT'))
+        count = next(number for number, sql in enumerate(statements) if 'COUNT(' in sql)
+        self.assertLess(transaction_start, count)
+
+    def test_migration_counts_existing_copies(self):
+        import importlib
+        from types import SimpleNamespace
+        from django.apps import apps
+        from django.db import connection
+
+        migration = importlib.import_module('catalog.migrations.0026_bookavailability')
+        # Copies created before the counters existed
+        BookInstance.objects.bulk_create([BookInstance(book=self.book, imprint='Imprint', status=status)
+                                          for status in ('a', 'a', 'o')])
+        BookAvailability.objects.all().delete()
+
+        # The migration only reads the connection of the schema editor
+        migration.count_existing_copies(apps, SimpleNamespace(connection=connection))
+        self.assertEqual(self.totals(self.book),
+                         {'maintenance': 0, 'on_loan': 1, 'available': 2, 'reserved': 0})
+        self.assertIsNone(self.totals(self.other_book))
+
+    def test_loading_a_deferred_field_keeps_unsaved_status_change(self):
+        copy = BookInstance.objects.create(book=self.book, imprint='Imprint', status='a')
+
+        copy = BookInstance.objects.defer('version').get(pk=copy.pk)
+        copy.status = 'o'
+        # save() reads the deferred version, which must not take the unsaved status for the stored one
+        copy.save()
+        self.assertEqual(self.totals(self.book),
+                         {'maintenance': 0, 'on_loan': 1, 'available': 0, 'reserved': 0})
+
+    def test_refresh_records_the_stored_values(self):
+        copy = BookInstance.objects.create(book=self.book, imprint='Imprint', status='a')
+        BookInstance.objects.filter(pk=copy.pk).update(status='r')
+        copy.refresh_from_db(fields=['status'])
+        self.assertEqual(copy.get_loaded_value('status'), 'r')
+
+    def test_save_of_copy_loaded_without_status_keeps_counters(self):
+        copy = BookInstance.objects.create(book=self.book, imprint='Imprint', status='a')
+
+        # The status is deferred, so the stored one is read before the save moves the counters
+        copy = BookInstance.objects.only('id', 'book').get(pk=copy.pk)
+        copy.save()
+        self.assertEqual(self.totals(self.book),
+                         {'maintenance': 0, 'on_loan': 0, 'available': 1, 'reserved': 0})
+
+        copy = BookInstance.objects.only('id', 'book').get(pk=copy.pk)
+        copy.status = 'o'
+        copy.save()
+        self.assertEqual(self.totals(self.book),
+                         {'maintenance': 0, 'on_loan': 1, 'available': 0, 'reserved': 0})
+
+    def test_delete_of_copy_loaded_without_status(self):
+        copy = BookInstance.objects.create(book=self.book, imprint='Imprint', status='r')
+        BookInstance.objects.only('id', 'book').get(pk=copy.pk).delete()
+        self.assertEqual(self.totals(self.book)['reserved'], 0)
+
+    def test_save_ignores_fields_left_out_of_update_fields(self):
+        copy = BookInstance.objects.create(book=self.book, imprint='Imprint', status='o')
+
+        copy.status = 'a'
+        copy.save(update_fields=['due_back'])
+        self.assertEqual(self.totals(self.book),
+                         {'maintenance': 0, 'on_loan': 1, 'available': 0, 'reserved': 0})
+
+        # The status written now is counted against the stored one
+        copy.save(update_fields=['status'])
+        self.assertEqual(self.totals(self.book),
+                         {'maintenance': 0, 'on_loan': 0, 'available': 1, 'reserved': 0})
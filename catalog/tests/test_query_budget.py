@@ -0,0 +1,45 @@
+# Tests of the query recorder, the N+1 detection and the per-URL query budgets in ./query_budget.py
+
+from django.template import engines
+from django.test import TestCase, override_settings
+from django.urls import reverse
+
+from catalog.models import Author, Book
+from catalog.tests.query_budget import QueryBudgetClient, query_shape, record_queries
+
+
+# The queries of anonymous requests are counted without the full-page cache
+@override_settings(CATALOG_PAGE_CACHE_ALIAS=None)
+class QueryRecorderTest(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        for number in range(4):
+            author = Author.objects.create(first_name='First', last_name='Last {0}'.format(number))
+            Book.objects.create(title='Book {0}'.format(number), summary='Summary', isbn='ISBN{0}'.format(number),
+                                author=author)
+
+    def test_in_lists_have_the_same_shape(self):
+        self.assertEqual(query_shape('SELECT * FROM book WHERE id IN (%s, %s)'),
+                         query_shape('SELECT  *  FROM book WHERE id IN (%s)'))
+
+    def test_reports_repeated_queries_and_template_line(self):
+        template = engines['django'].from_string('{% for book in books %}\n{{ book.author }}\n{% endfor %}')
+        with record_queries() as recorder:
+            template.render({'books': Book.objects.all()})
+
+        self.assertEqual(len(recorder.queries), 5)
+        [(shape, count)] = recorder.repeated_shapes()
+        self.assertEqual(count, 4)
+        self.assertIn('catalog_author', shape)
+        self.assertEqual(recorder.queries[1].template[1], 2)
+
+    def test_client_fails_requests_over_budget(self):
+        client = QueryBudgetClient({'authors': 1}, max_repeated=3)
+        with self.assertRaisesRegex(AssertionError, "3 queries, the budget of 'authors' is 1"):
+            client.get(reverse('authors'))
+
+        client = QueryBudgetClient({'authors': 3}, max_repeated=3)
+        response = client.get(reverse('authors'))
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(client.last_queries.queries), 3)
@@ -1,4 +1,4 @@
-from django.test import TestCase
+from catalog.tests.query_budget import QueryBudgetTestCase, record_queries
 
 # Create your tests here.
 
@@ -7,7 +7,7 @@ from catalog.models import Author
 from django.urls import reverse
 
 
-class AuthorListViewTest(TestCase):
+class AuthorListViewTest(QueryBudgetTestCase):
 
     @classmethod
     def setUpTestData(cls):
@@ -53,7 +53,7 @@ from catalog.models import BookInstance, Book, Genre, Language
 from django.contrib.auth.models import User  # Required to assign User as a borrower
 
 
-class LoanedBookInstancesByUserListViewTest(TestCase):
+class LoanedBookInstancesByUserListViewTest(QueryBudgetTestCase):
 
     def setUp(self):
         # Create two users
@@ -190,7 +190,7 @@ class LoanedBookInstancesByUserListViewTest(TestCase):
 from django.contrib.auth.models import Permission  # Required to grant the permission needed to set a book as returned.
 
 
-class RenewBookInstancesViewTest(TestCase):
+class RenewBookInstancesViewTest(QueryBudgetTestCase):
 
     def setUp(self):
         # Create a user
@@ -292,6 +292,59 @@ class RenewBookInstancesViewTest(TestCase):
                                     {'renewal_date': valid_date_in_future})
         self.assertRedirects(response, reverse('all-borrowed'))
 
+    def test_form_carries_the_version_of_the_copy(self):
+        login = self.client.login(username='testuser2', password='2HJ1vRV0Z&3iD')
+        response = self.client.get(reverse('renew-book-librarian', kwargs={'pk': self.test_bookinstance1.pk}))
+        self.assertEqual(response.context['form'].initial['version'], self.test_bookinstance1.version)
+        self.assertContains(response, 'name="version"')
+
+    def test_renewal_of_a_copy_changed_meanwhile_is_refused(self):
+        login = self.client.login(username='testuser2', password='2HJ1vRV0Z&3iD')
+        version = self.test_bookinstance1.version
+        # Another librarian renews the copy after the form was shown
+        self.test_bookinstance1.due_back = datetime.date.today() + datetime.timedelta(weeks=1)
+        self.test_bookinstance1.save()
+
+        valid_date_in_future = datetime.date.today() + datetime.timedelta(weeks=2)
+        response = self.client.post(reverse('renew-book-librarian', kwargs={'pk': self.test_bookinstance1.pk}),
+                                    {'renewal_date': valid_date_in_future, 'version': version})
+        self.assertEqual(response.status_code, 200)
+        self.assertFormError(response, 'form', None, 'This copy was changed by someone else in the meantime. '
+                                                     'Check it and submit again.')
+        self.assertEqual(response.context['form']['version'].value(), version + 1)
+        self.assertEqual(BookInstance.objects.get(pk=self.test_bookinstance1.pk).due_back,
+                         datetime.date.today() + datetime.timedelta(weeks=1))
+
+        # Submitting again renews the copy as it is now
+        response = self.client.post(reverse('renew-book-librarian', kwargs={'pk': self.test_bookinstance1.pk}),
+                                    {'renewal_date': valid_date_in_future, 'version': version + 1})
+        self.assertRedirects(response, reverse('all-borrowed'))
+        self.assertEqual(BookInstance.objects.get(pk=self.test_bookinstance1.pk).due_back, valid_date_in_future)
+
+    def test_copy_not_on_loan_is_a_validation_error(self):
+        login = self.client.login(username='testuser2', password='2HJ1vRV0Z&3iD')
+        self.test_bookinstance1.status = 'a'
+        self.test_bookinstance1.save()
+        valid_date_in_future = datetime.date.today() + datetime.timedelta(weeks=2)
+        response = self.client.post(reverse('renew-book-librarian', kwargs={'pk': self.test_bookinstance1.pk}),
+                                    {'renewal_date': valid_date_in_future, 'version': self.test_bookinstance1.version})
+        self.assertEqual(response.status_code, 200)
+        self.assertFormError(response, 'form', None, 'This copy is not on loan, so it cannot be renewed.')
+
+    def test_copy_returned_meanwhile_is_a_validation_error(self):
+        login = self.client.login(username='testuser2', password='2HJ1vRV0Z&3iD')
+        version = self.test_bookinstance1.version
+        response = self.client.get(reverse('renew-book-librarian', kwargs={'pk': self.test_bookinstance1.pk}))
+        # Another librarian returns the copy after the form was shown
+        self.test_bookinstance1.status = 'a'
+        self.test_bookinstance1.save()
+
+        valid_date_in_future = datetime.date.today() + datetime.timedelta(weeks=2)
+        response = self.client.post(reverse('renew-book-librarian', kwargs={'pk': self.test_bookinstance1.pk}),
+                                    {'renewal_date': valid_date_in_future, 'version': version})
+        self.assertEqual(response.status_code, 200)
+        self.assertFormError(response, 'form', None, 'This copy is not on loan, so it cannot be renewed.')
+
     def test_HTTP404_for_invalid_book_if_logged_in(self):
         import uuid
         test_uid = uuid.uuid4()  # unlikely UID to match our bookinstance!
@@ -300,7 +353,7 @@ class RenewBookInstancesViewTest(TestCase):
         self.assertEqual(response.status_code, 404)
 
 
-class AuthorCreateViewTest(TestCase):
+class AuthorCreateViewTest(QueryBudgetTestCase):
     """Test case for the AuthorCreate view (Created as Challenge)."""
 
     def setUp(self):
@@ -355,3 +408,828 @@ class AuthorCreateViewTest(TestCase):
         # Manually check redirect because we don't know what author was created
         self.assertEqual(response.status_code, 302)
         self.assertTrue(response.url.startswith('/catalog/author/'))
+
+
+from django.conf import settings
+from django.core.cache import cache
+from django.test import override_settings
+
+
+class IndexViewTest(QueryBudgetTestCase):
+
+    def setUp(self):
+        # The counts are cached, so start every test from an empty cache
+        cache.clear()
+
+        test_author = Author.objects.create(first_name='John', last_name='Smith')
+        test_book = Book.objects.create(title='Book Title', summary='My book summary',
+                                        isbn='ABCDEFG', author=test_author)
+        for status in ('a', 'a', 'o'):
+            BookInstance.objects.create(book=test_book, imprint='Unlikely Imprint, 2016', status=status)
+
+    def test_view_shows_record_counts(self):
+        response = self.client.get(reverse('index'))
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.context['num_books'], 1)
+        self.assertEqual(response.context['num_instances'], 3)
+        self.assertEqual(response.context['num_instances_available'], 2)
+        self.assertEqual(response.context['num_authors'], 1)
+
+    def test_copies_without_a_status_are_counted(self):
+        BookInstance.objects.create(book=Book.objects.get(), imprint='Unlikely Imprint, 2016', status='')
+        response = self.client.get(reverse('index'))
+        self.assertEqual(response.context['num_instances'], 4)
+        self.assertEqual(response.context['num_instances_available'], 2)
+
+    def test_counts_are_computed_by_one_query_and_then_cached(self):
+        from catalog.caching import get_catalog_counts
+
+        with self.assertNumQueries(1):
+            get_catalog_counts()
+        with self.assertNumQueries(0):
+            get_catalog_counts()
+
+    def test_counts_are_invalidated_on_save_and_delete(self):
+        self.client.get(reverse('index'))
+
+        # The counts are invalidated when the change commits
+        copy = BookInstance.objects.filter(status='o').first()
+        with self.captureOnCommitCallbacks(execute=True):
+            copy.status = 'a'
+            copy.save()
+        response = self.client.get(reverse('index'))
+        self.assertEqual(response.context['num_instances_available'], 3)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            Author.objects.create(first_name='Jane', last_name='Doe')
+        response = self.client.get(reverse('index'))
+        self.assertEqual(response.context['num_authors'], 2)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            copy.delete()
+        response = self.client.get(reverse('index'))
+        self.assertEqual(response.context['num_instances'], 2)
+
+    def test_visits_are_counted_without_database_writes(self):
+        self.client.get(reverse('index'))
+
+        # The counts are cached, so nothing at all is queried, let alone written
+        with self.assertNumQueries(0):
+            response = self.client.get(reverse('index'))
+        self.assertEqual(response.context['num_visits'], 2)
+        self.assertNotIn(settings.SESSION_COOKIE_NAME, response.cookies)
+
+        # A tampered cookie is ignored
+        self.client.cookies['num_visits'] = '99'
+        response = self.client.get(reverse('index'))
+        self.assertEqual(response.context['num_visits'], 1)
+
+
+class BookDetailViewTest(QueryBudgetTestCase):
+
+    def setUp(self):
+        cache.clear()
+        self.author = Author.objects.create(first_name='John', last_name='Smith')
+        self.book = Book.objects.create(title='Book Title', summary='My book summary',
+                                        isbn='ABCDEFG', author=self.author)
+        self.copy = BookInstance.objects.create(book=self.book, imprint='Unlikely Imprint, 2016', status='a')
+
+    def test_view_uses_correct_template(self):
+        response = self.client.get(reverse('book-detail', args=[self.book.pk]))
+        self.assertEqual(response.status_code, 200)
+        self.assertTemplateUsed(response, 'catalog/book_detail.html')
+        self.assertTemplateUsed(response, 'catalog/book_detail_content.html')
+        self.assertContains(response, 'Book Title')
+
+    def test_HTTP404_for_missing_book(self):
+        response = self.client.get(reverse('book-detail', args=[self.book.pk + 1]))
+        self.assertEqual(response.status_code, 404)
+
+    def test_cached_page_is_served_without_queries(self):
+        url = reverse('book-detail', args=[self.book.pk])
+        self.client.get(url)
+        with self.assertNumQueries(0):
+            response = self.client.get(url)
+        self.assertContains(response, 'Book Title')
+
+    def test_page_is_rerendered_after_changes(self):
+        url = reverse('book-detail', args=[self.book.pk])
+        self.client.get(url)
+
+        # The cache versions are bumped when the change commits
+        with self.captureOnCommitCallbacks(execute=True):
+            self.copy.status = 'o'
+            self.copy.save()
+        response = self.client.get(url)
+        self.assertContains(response, 'On loan')
+        self.assertContains(response, '1 in total: 0 available, 1 on loan, 0 reserved, 0 in maintenance')
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.author.last_name = 'Jones'
+            self.author.save()
+        self.assertContains(self.client.get(url), 'Jones')
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.book.genre.add(Genre.objects.create(name='Fantasy'))
+        self.assertContains(self.client.get(url), 'Fantasy')
+
+    def test_page_is_rerendered_after_deleting_a_copy_loaded_without_its_book(self):
+        url = reverse('book-detail', args=[self.book.pk])
+        self.client.get(url)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            BookInstance.objects.only('id', 'status').get(pk=self.copy.pk).delete()
+        self.assertNotContains(self.client.get(url), 'Unlikely Imprint, 2016')
+
+    def test_page_is_not_rerendered_before_the_change_commits(self):
+        url = reverse('book-detail', args=[self.book.pk])
+        self.client.get(url)
+
+        with self.captureOnCommitCallbacks(execute=False) as callbacks:
+            self.book.title = 'New Title'
+            self.book.save()
+            # Until the commit, requests may still read the old row, so the old version stays in use
+            self.assertNotContains(self.client.get(url), 'New Title')
+        for callback in callbacks:
+            callback()
+        self.assertContains(self.client.get(url), 'New Title')
+
+    # Anonymous requests would otherwise be answered by the full-page cache
+    @override_settings(CATALOG_PAGE_CACHE_ALIAS=None)
+    def test_hits_and_misses_are_counted(self):
+        from catalog.caching import get_cache_stats
+
+        url = reverse('book-detail', args=[self.book.pk])
+        self.client.get(url)
+        self.client.get(url)
+        self.assertEqual(get_cache_stats('book-detail'), {'hits': 1, 'misses': 1})
+
+
+class AuthorDetailViewTest(QueryBudgetTestCase):
+
+    def setUp(self):
+        cache.clear()
+        self.author = Author.objects.create(first_name='John', last_name='Smith')
+        self.book = Book.objects.create(title='Book Title', summary='My book summary',
+                                        isbn='ABCDEFG', author=self.author)
+
+    def test_view_uses_correct_template(self):
+        response = self.client.get(reverse('author-detail', args=[self.author.pk]))
+        self.assertEqual(response.status_code, 200)
+        self.assertTemplateUsed(response, 'catalog/author_detail.html')
+        self.assertContains(response, 'Book Title')
+
+    def test_page_is_rerendered_after_book_changes(self):
+        url = reverse('author-detail', args=[self.author.pk])
+        self.client.get(url)
+
+        # The cache versions are bumped when the change commits
+        with self.captureOnCommitCallbacks(execute=True):
+            self.book.title = 'New Title'
+            self.book.save()
+        self.assertContains(self.client.get(url), 'New Title')
+
+        with self.captureOnCommitCallbacks(execute=True):
+            BookInstance.objects.create(book=self.book, imprint='Unlikely Imprint, 2016', status='a')
+        self.assertContains(self.client.get(url), '(1: 1 available, 0 on loan, 0 reserved, 0 in maintenance)')
+
+        # Moving the book to another author removes it from this author's page
+        with self.captureOnCommitCallbacks(execute=True):
+            self.book.author = Author.objects.create(first_name='Jane', last_name='Doe')
+            self.book.save()
+        self.assertNotContains(self.client.get(url), 'New Title')
+
+    def test_books_and_copy_counts_are_loaded_by_two_queries(self):
+        for number in range(5):
+            book = Book.objects.create(title='Book {0}'.format(number), summary='Summary',
+                                       isbn='ISBN{0}'.format(number), author=self.author)
+            for status in ('a', 'o'):
+                BookInstance.objects.create(book=book, imprint='Unlikely Imprint, 2016', status=status)
+
+        response = self.client.get(reverse('author-detail', args=[self.author.pk]))
+        book = response.context['book_list'][1]
+        self.assertEqual((book.num_copies, book.num_available, book.num_on_loan), (2, 1, 1))
+
+        # updated_at, author, paginator count, books and their counters: the number of books doesn't matter
+        cache.clear()
+        with self.assertNumQueries(5):
+            self.client.get(reverse('author-detail', args=[self.author.pk]))
+
+    def test_book_list_is_paginated(self):
+        for number in range(25):
+            Book.objects.create(title='Book {0:02}'.format(number), summary='Summary',
+                                isbn='ISBN{0}'.format(number), author=self.author)
+
+        response = self.client.get(reverse('author-detail', args=[self.author.pk]))
+        self.assertTrue(response.context['is_paginated'])
+        self.assertEqual(len(response.context['book_list']), 20)
+
+        response = self.client.get(reverse('author-detail', args=[self.author.pk]) + '?page=2')
+        self.assertEqual(len(response.context['book_list']), 6)
+        self.assertContains(response, 'Page 2 of 2.')
+
+    # Anonymous requests would otherwise be answered by the full-page cache
+    @override_settings(CATALOG_PAGE_CACHE_ALIAS=None)
+    def test_content_is_cached_once_per_rendered_page(self):
+        from catalog.caching import detail_cache_key
+
+        url = reverse('author-detail', args=[self.author.pk])
+        for page in ('1', '2', '-1', '99999', 'x'):
+            self.assertContains(self.client.get(url, {'page': page}), 'Book Title')
+        # Every number shows the only page, which is cached under its own number
+        self.assertIsNotNone(cache.get(detail_cache_key(Author, self.author.pk, 1)))
+        for page in (2, -1, 99999):
+            self.assertIsNone(cache.get(detail_cache_key(Author, self.author.pk, page)))
+
+
+class LoanedBooksAllListViewTest(QueryBudgetTestCase):
+
+    def setUp(self):
+        self.librarian = User.objects.create_user(username='librarian', password='2HJ1vRV0Z&3iD')
+        self.librarian.user_permissions.add(Permission.objects.get(name='Set book as returned'))
+        self.borrower = User.objects.create_user(username='borrower', password='1X<ISRUkw+tuK')
+
+        test_author = Author.objects.create(first_name='John', last_name='Smith')
+        self.test_book = Book.objects.create(title='Book Title', summary='My book summary',
+                                             isbn='ABCDEFG', author=test_author)
+
+    def create_loans(self, number):
+        for day in range(number):
+            BookInstance.objects.create(book=self.test_book, imprint='Unlikely Imprint, 2016', status='o',
+                                        borrower=self.borrower,
+                                        due_back=datetime.date.today() + datetime.timedelta(days=day))
+
+    def test_forbidden_without_permission(self):
+        self.client.login(username='borrower', password='1X<ISRUkw+tuK')
+        response = self.client.get(reverse('all-borrowed'))
+        self.assertEqual(response.status_code, 403)
+
+    def test_lists_books_and_borrowers(self):
+        self.create_loans(2)
+        self.client.login(username='librarian', password='2HJ1vRV0Z&3iD')
+        response = self.client.get(reverse('all-borrowed'))
+        self.assertEqual(response.status_code, 200)
+        self.assertContains(response, 'Book Title', count=2)
+
+    def test_query_count_does_not_depend_on_page_size(self):
+        self.client.login(username='librarian', password='2HJ1vRV0Z&3iD')
+        # Session, user, user and group permissions, paginator count and the copies with their book and borrower
+        self.create_loans(1)
+        with self.assertNumQueries(6):
+            self.client.get(reverse('all-borrowed'))
+
+        self.create_loans(9)
+        with self.assertNumQueries(6):
+            response = self.client.get(reverse('all-borrowed'))
+        self.assertEqual(len(response.context['bookinstance_list']), 10)
+
+    def test_my_borrowed_query_count_does_not_depend_on_page_size(self):
+        self.client.login(username='borrower', password='1X<ISRUkw+tuK')
+        # Session, user, paginator count and the copies with their book
+        self.create_loans(1)
+        with self.assertNumQueries(4):
+            self.client.get(reverse('my-borrowed'))
+
+        self.create_loans(9)
+        with self.assertNumQueries(4):
+            response = self.client.get(reverse('my-borrowed'))
+        self.assertEqual(len(response.context['bookinstance_list']), 10)
+
+
+@override_settings(CATALOG_PAGINATION='keyset')
+class KeysetPaginationTest(QueryBudgetTestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        # Two authors share a last name, so the pages are also ordered by first name and id
+        for author_id in range(13):
+            Author.objects.create(first_name='Christian {0}'.format(author_id % 2),
+                                  last_name='Surname {0:02}'.format(author_id // 2))
+
+    def test_pages_follow_each_other_without_counting(self):
+        # The latest updated_at (for conditional requests) and the page; no COUNT
+        with self.assertNumQueries(2):
+            response = self.client.get(reverse('authors'))
+        first_page = list(response.context['author_list'])
+        self.assertEqual(len(first_page), 10)
+        self.assertTrue(response.context['is_paginated'])
+        self.assertFalse(response.context['page_obj'].has_previous())
+        self.assertNotContains(response, 'Page 1 of')
+
+        next_cursor = response.context['page_obj'].next_cursor
+        response = self.client.get(reverse('authors'), {'cursor': next_cursor})
+        second_page = list(response.context['author_list'])
+        self.assertEqual(len(second_page), 3)
+        self.assertFalse(response.context['page_obj'].has_next())
+        self.assertEqual(sorted(first_page + second_page, key=lambda a: (a.last_name, a.first_name, a.id)),
+                         list(Author.objects.order_by('last_name', 'first_name', 'id')))
+
+        previous_cursor = response.context['page_obj'].previous_cursor
+        response = self.client.get(reverse('authors'), {'cursor': previous_cursor})
+        self.assertEqual(list(response.context['author_list']), first_page)
+        self.assertTrue(response.context['page_obj'].has_next())
+
+    def test_invalid_cursor_is_not_found(self):
+        response = self.client.get(reverse('authors'), {'cursor': 'not-a-cursor'})
+        self.assertEqual(response.status_code, 404)
+
+    def test_nullable_ordering_fields(self):
+        from catalog.pagination import Keyset
+
+        test_book = Book.objects.create(title='Book Title', summary='My book summary', isbn='ABCDEFG')
+        for day in (None, None, 1, 1, 2):
+            due_back = None if day is None else datetime.date.today() + datetime.timedelta(days=day)
+            BookInstance.objects.create(book=test_book, imprint='Unlikely Imprint, 2016', due_back=due_back)
+
+        keyset = Keyset(BookInstance, ('due_back', 'id'))
+        seen = []
+        page = keyset.paginate(BookInstance.objects.all(), 2)
+        seen += page.object_list
+        while page.has_next():
+            page = keyset.paginate(BookInstance.objects.all(), 2, page.next_cursor)
+            seen += page.object_list
+        self.assertEqual(len(seen), 5)
+        self.assertEqual(len(set(copy.pk for copy in seen)), 5)
+        self.assertEqual([copy.due_back is None for copy in seen], [True, True, False, False, False])
+
+        # Walking back from the last page returns the same rows in the same order
+        seen_backwards = list(page.object_list)
+        while page.has_previous():
+            page = keyset.paginate(BookInstance.objects.all(), 2, page.previous_cursor)
+            seen_backwards = list(page.object_list) + seen_backwards
+        self.assertEqual(seen_backwards, seen)
+
+
+class BookSearchViewTest(QueryBudgetTestCase):
+
+    def setUp(self):
+        self.author = Author.objects.create(first_name='Frank', last_name='Herbert')
+        self.dune = Book.objects.create(title='Dune', summary='A desert planet.', isbn='9780441013593',
+                                        author=self.author)
+        self.other = Book.objects.create(title='Desert Stories', summary='Set somewhere near Dune.',
+                                         isbn='9780000000001')
+
+    def search(self, query):
+        response = self.client.get(reverse('search'), {'q': query})
+        self.assertEqual(response.status_code, 200)
+        return list(response.context['book_list'])
+
+    def test_view_uses_correct_template(self):
+        response = self.client.get(reverse('search'))
+        self.assertEqual(response.status_code, 200)
+        self.assertTemplateUsed(response, 'catalog/book_search.html')
+
+    def test_finds_books_by_title_summary_isbn_and_author(self):
+        self.assertEqual(self.search('planet'), [self.dune])
+        self.assertEqual(self.search('9780441013593'), [self.dune])
+        self.assertEqual(self.search('frank herbert'), [self.dune])
+        self.assertEqual(self.search('desert'), [self.other, self.dune])
+        self.assertEqual(self.search('nothing like this'), [])
+
+    def test_title_matches_rank_first(self):
+        self.assertEqual(self.search('dune'), [self.dune, self.other])
+
+    def test_finds_books_by_several_author_terms(self):
+        jones = Book.objects.create(title='Fiction', summary='A novel.', isbn='9780000000002',
+                                    author=Author.objects.create(first_name='Tom', last_name='Jones'))
+        self.assertEqual(self.search('jones tom'), [jones])
+        self.assertEqual(self.search('tom jones fiction'), [jones])
+
+    def test_postgres_terms_match_stemmed_or_unstemmed(self):
+        from catalog.search import PostgresSearchBackend
+
+        # The author is indexed unstemmed, so "jones" must not only be looked for as 'jone'
+        sql, params = PostgresSearchBackend()._tsquery('Jones tom')
+        self.assertEqual(sql.count("to_tsquery('english', %s)"), 2)
+        self.assertEqual(sql.count("to_tsquery('simple', %s)"), 2)
+        self.assertEqual(params, ['jones', 'jones', 'tom:*', 'tom:*'])
+
+    def test_last_term_matches_as_prefix(self):
+        self.assertEqual(self.search('herb'), [self.dune])
+
+    def test_search_syntax_is_ignored(self):
+        self.assertEqual(self.search('"dune" OR NOT*'), [])
+        self.assertEqual(self.search('()'), [])
+
+    def test_index_follows_changes(self):
+        self.dune.title = 'Children of Dune'
+        self.dune.save()
+        self.assertEqual(self.search('children'), [self.dune])
+
+        self.author.last_name = 'Smith'
+        self.author.save()
+        self.assertEqual(self.search('smith'), [self.dune])
+
+        self.other.delete()
+        self.assertEqual(self.search('desert'), [self.dune])
+
+        self.author.delete()
+        self.assertEqual(self.search('frank'), [])
+        self.assertEqual(self.search('children'), [self.dune])
+
+    def test_results_are_paginated(self):
+        for number in range(12):
+            Book.objects.create(title='Sandworm {0}'.format(number), summary='Summary',
+                                isbn='ISBN{0}'.format(number))
+
+        response = self.client.get(reverse('search'), {'q': 'sandworm'})
+        self.assertEqual(len(response.context['book_list']), 10)
+        self.assertEqual(response.context['paginator'].count, 12)
+
+        response = self.client.get(reverse('search'), {'q': 'sandworm', 'page': 2})
+        self.assertEqual(len(response.context['book_list']), 2)
+
+
+class AutocompleteViewTest(QueryBudgetTestCase):
+
+    def setUp(self):
+        from catalog import autocomplete
+
+        # The index lives in the worker's memory and the change log in the cache, so both start empty
+        cache.clear()
+        autocomplete.reset_index()
+        self.author = Author.objects.create(first_name='Émile', last_name='Zola')
+        self.book = Book.objects.create(title='Germinal', summary='Summary', isbn='ABCDEFG', author=self.author)
+
+    def labels(self, query):
+        response = self.client.get(reverse('autocomplete'), {'q': query})
+        self.assertEqual(response.status_code, 200)
+        return [result['label'] for result in response.json()['results']]
+
+    def test_matches_titles_and_both_author_names(self):
+        self.assertEqual(self.labels('germ'), ['Germinal'])
+        self.assertEqual(self.labels('emile'), ['Zola, Émile'])
+        self.assertEqual(self.labels('ZOLA e'), ['Zola, Émile'])
+        self.assertEqual(self.labels('x'), [])
+        self.assertEqual(self.labels(''), [])
+
+    def test_results_link_to_detail_pages(self):
+        response = self.client.get(reverse('autocomplete'), {'q': 'g'})
+        self.assertEqual(response.json()['results'][0]['url'], self.book.get_absolute_url())
+
+    def test_index_is_not_queried_from_the_database_again(self):
+        self.labels('germ')
+        with self.assertNumQueries(0):
+            self.labels('zola')
+
+    def test_index_follows_changes(self):
+        self.labels('germ')
+
+        # The changes are logged for the index when they commit
+        with self.captureOnCommitCallbacks(execute=False) as callbacks:
+            self.book.title = 'Nana'
+            self.book.save()
+            Book.objects.create(title='Germ Theory', summary='Summary', isbn='HIJKLMN')
+            self.assertEqual(self.labels('nana'), [])
+        for callback in callbacks:
+            callback()
+        self.assertEqual(self.labels('germ'), ['Germ Theory'])
+        self.assertEqual(self.labels('nana'), ['Nana'])
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.author.delete()
+        self.assertEqual(self.labels('zola'), [])
+
+    def test_index_is_bounded(self):
+        from catalog import autocomplete
+
+        with self.settings(CATALOG_AUTOCOMPLETE_MAX_ENTRIES=2):
+            autocomplete.reset_index()
+            self.labels('g')
+            index = autocomplete.get_index()
+            self.assertEqual(len(index), 2)
+            self.assertTrue(index.truncated)
+
+
+class ApiTest(QueryBudgetTestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.author = Author.objects.create(first_name='Frank', last_name='Herbert')
+        cls.language = Language.objects.create(name='English')
+        cls.genres = [Genre.objects.create(name='Science Fiction'), Genre.objects.create(name='Classic')]
+        cls.books = []
+        for number in range(5):
+            book = Book.objects.create(title='Dune {0}'.format(number), summary='Summary',
+                                       isbn='ISBN{0}'.format(number), author=cls.author, language=cls.language)
+            book.genre.set(cls.genres)
+            cls.books.append(book)
+        cls.borrower = User.objects.create_user(username='borrower', password='1X<ISRUkw+tuK')
+        cls.copy = BookInstance.objects.create(book=cls.books[0], imprint='Imprint', status='o',
+                                               borrower=cls.borrower, due_back=datetime.date(2030, 1, 1))
+
+    def get(self, url, **params):
+        response = self.client.get(url, params)
+        self.assertEqual(response.status_code, 200)
+        return response.json()
+
+    def test_list_returns_default_fields(self):
+        data = self.get(reverse('api-list', args=['books']))
+        self.assertEqual(len(data['results']), 5)
+        self.assertEqual(data['results'][0], {
+            'id': self.books[0].pk, 'title': 'Dune 0', 'summary': 'Summary', 'isbn': 'ISBN0',
+            'author': self.author.pk, 'language': self.language.pk,
+            'genre': sorted(genre.pk for genre in self.genres),
+        })
+        self.assertIsNone(data['next'])
+
+    def test_sparse_fields(self):
+        data = self.get(reverse('api-list', args=['books']), fields='title')
+        self.assertEqual(data['results'][0], {'id': self.books[0].pk, 'title': 'Dune 0'})
+
+        response = self.client.get(reverse('api-list', args=['books']), {'fields': 'title,secret'})
+        self.assertEqual(response.status_code, 400)
+
+    def test_borrower_is_not_exposed(self):
+        data = self.get(reverse('api-detail', args=['copies', self.copy.pk]))
+        self.assertEqual(data, {'id': str(self.copy.pk), 'book': self.books[0].pk, 'imprint': 'Imprint',
+                                'status': 'o', 'due_back': '2030-01-01'})
+
+    def test_embedded_objects_take_a_fixed_number_of_queries(self):
+        # Books, their genres, and the embedded authors, languages and genres
+        with self.assertNumQueries(5):
+            data = self.get(reverse('api-list', args=['books']), embed='author,language,genre')
+        book = data['results'][0]
+        self.assertEqual(book['author']['last_name'], 'Herbert')
+        self.assertEqual(book['language'], {'id': self.language.pk, 'name': 'English'})
+        self.assertEqual(sorted(genre['name'] for genre in book['genre']), ['Classic', 'Science Fiction'])
+
+    def test_cursor_pagination(self):
+        data = self.get(reverse('api-list', args=['books']), limit=2, fields='title')
+        titles = [book['title'] for book in data['results']]
+        while data['next']:
+            data = self.get(data['next'])
+            titles += [book['title'] for book in data['results']]
+        self.assertEqual(titles, ['Dune {0}'.format(number) for number in range(5)])
+
+    def test_detail_and_missing_objects(self):
+        data = self.get(reverse('api-detail', args=['authors', self.author.pk]))
+        self.assertEqual(data['first_name'], 'Frank')
+        self.assertEqual(self.client.get(reverse('api-detail', args=['authors', 0])).status_code, 404)
+        self.assertEqual(self.client.get(reverse('api-detail', args=['authors', 'x'])).status_code, 404)
+        response = self.client.get(reverse('api-list', args=['users']))
+        self.assertEqual(response.status_code, 404)
+        self.assertEqual(response.json(), {'error': 'Unknown resource.'})
+
+    def test_out_of_range_ids_are_client_errors(self):
+        from catalog.pagination import NEXT, encode_cursor
+
+        # Too large for the database to convert
+        response = self.client.get(reverse('api-detail', args=['books', '99999999999999999999999']))
+        self.assertEqual(response.status_code, 404)
+        self.assertEqual(response.json(), {'error': 'Invalid id.'})
+
+        cursor = encode_cursor(NEXT, ['Dune 0', self.author.pk, 10 ** 22])
+        response = self.client.get(reverse('api-list', args=['books']), {'cursor': cursor})
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.json(), {'error': 'Invalid cursor.'})
+
+    def test_etag_revalidation(self):
+        url = reverse('api-list', args=['genres'])
+        response = self.client.get(url)
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=response['ETag'])
+        self.assertEqual(response.status_code, 304)
+
+        Genre.objects.create(name='Poetry')
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=response['ETag'])
+        self.assertEqual(response.status_code, 200)
+
+
+import gzip
+import json
+
+
+class ExportViewTest(QueryBudgetTestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        author = Author.objects.create(first_name='John', last_name='Smith')
+        language = Language.objects.create(name='English')
+        fantasy = Genre.objects.create(name='Fantasy')
+        poetry = Genre.objects.create(name='Poetry')
+        for number in range(5):
+            book = Book.objects.create(title='Book {0}'.format(number), summary='Summary, "quoted"',
+                                       isbn='ISBN{0}'.format(number), author=author, language=language)
+            book.genre.set([poetry, fantasy] if number % 2 else [])
+        User.objects.create_user(username='visitor', password='1X<ISRUkw+tuK')
+        User.objects.create_user(username='staff', password='2HJ1vRV0Z&3iD', is_staff=True)
+
+    def test_redirects_non_staff_users(self):
+        self.client.login(username='visitor', password='1X<ISRUkw+tuK')
+        response = self.client.get(reverse('export'))
+        self.assertEqual(response.status_code, 302)
+
+    def test_streams_csv(self):
+        self.client.login(username='staff', password='2HJ1vRV0Z&3iD')
+        response = self.client.get(reverse('export'))
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.streaming)
+        lines = b''.join(response.streaming_content).decode().splitlines()
+        self.assertEqual(lines[0], 'id,title,isbn,summary,author_first_name,author_last_name,language,genres')
+        self.assertEqual(len(lines), 6)
+        self.assertIn('"Summary, ""quoted""",John,Smith,English,Fantasy;Poetry', lines[2])
+
+    def test_streams_gzipped_jsonl(self):
+        self.client.login(username='staff', password='2HJ1vRV0Z&3iD')
+        response = self.client.get(reverse('export'), {'format': 'jsonl'}, HTTP_ACCEPT_ENCODING='gzip')
+        self.assertEqual(response['Content-Encoding'], 'gzip')
+        lines = gzip.decompress(b''.join(response.streaming_content)).decode().splitlines()
+        books = [json.loads(line) for line in lines]
+        self.assertEqual([book['title'] for book in books], ['Book {0}'.format(n) for n in range(5)])
+        self.assertEqual(books[1]['genres'], ['Fantasy', 'Poetry'])
+        self.assertEqual(books[0]['genres'], [])
+
+    def test_genres_are_read_once_per_chunk(self):
+        from catalog.export import iter_books
+        # One query for the books and one for the genres of each chunk of two
+        with self.assertNumQueries(4):
+            books = list(iter_books(chunk_size=2))
+        self.assertEqual(len(books), 5)
+
+    def test_rejects_unknown_format(self):
+        self.client.login(username='staff', password='2HJ1vRV0Z&3iD')
+        response = self.client.get(reverse('export'), {'format': 'xml'})
+        self.assertEqual(response.status_code, 400)
+
+
+class BookListViewTest(QueryBudgetTestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        for number in range(12):
+            author = Author.objects.create(first_name='First', last_name='Last {0}'.format(number))
+            Book.objects.create(title='Book {0}'.format(number), summary='Summary', isbn='ISBN{0}'.format(number),
+                                author=author)
+
+    def test_authors_are_not_loaded_per_book(self):
+        response = self.client.get(reverse('books'))
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(response.context['book_list']), 10)
+        self.assertContains(response, 'Last 0, First')
+
+
+class ConditionalGetTest(QueryBudgetTestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.author = Author.objects.create(first_name='John', last_name='Smith')
+        cls.book = Book.objects.create(title='Book', summary='Summary', isbn='ISBN1', author=cls.author)
+        cls.copy = BookInstance.objects.create(book=cls.book, imprint='Imprint', status='a')
+        User.objects.create_user(username='reader', password='1X<ISRUkw+tuK')
+
+    def setUp(self):
+        cache.clear()
+
+    def revalidate(self, url, response):
+        return self.client.get(url, HTTP_IF_NONE_MATCH=response['ETag'])
+
+    def test_unchanged_detail_page_is_not_modified(self):
+        url = reverse('book-detail', args=[self.book.pk])
+        response = self.client.get(url)
+        self.assertIn('Last-Modified', response)
+
+        self.client.login(username='reader', password='1X<ISRUkw+tuK')
+        response = self.client.get(url)
+        # Session, user and the updated_at lookup; nothing is rendered
+        with self.assertNumQueries(3):
+            self.assertEqual(self.revalidate(url, response).status_code, 304)
+
+    def test_copy_change_moves_book_and_author_timestamps(self):
+        book_url = reverse('book-detail', args=[self.book.pk])
+        author_url = reverse('author-detail', args=[self.author.pk])
+        book_response = self.client.get(book_url)
+        author_response = self.client.get(author_url)
+        author_updated = Author.objects.get(pk=self.author.pk).updated_at
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.copy.status = 'o'
+            self.copy.save()
+
+        self.assertGreater(Author.objects.get(pk=self.author.pk).updated_at, author_updated)
+        self.assertEqual(self.revalidate(book_url, book_response).status_code, 200)
+        self.assertEqual(self.revalidate(author_url, author_response).status_code, 200)
+
+    def test_list_is_modified_by_deletes(self):
+        url = reverse('books')
+        response = self.client.get(url)
+        self.assertEqual(self.revalidate(url, response).status_code, 304)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            Book.objects.create(title='Other Book', summary='Summary', isbn='ISBN2').delete()
+        self.assertEqual(self.revalidate(url, response).status_code, 200)
+
+    def test_etag_depends_on_user(self):
+        url = reverse('authors')
+        response = self.client.get(url)
+        self.client.login(username='reader', password='1X<ISRUkw+tuK')
+        self.assertEqual(self.revalidate(url, response).status_code, 200)
+
+
+class LookupViewTest(QueryBudgetTestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        Author.objects.bulk_create([Author(first_name='First', last_name='Smith {0:02d}'.format(number))
+                                    for number in range(30)])
+        Author.objects.create(first_name='Other', last_name='Jones')
+        Genre.objects.create(name='Fantasy')
+
+    def test_results_are_paged_by_name(self):
+        response = self.client.get(reverse('lookup', args=['authors']), {'q': 'smi'})
+        data = response.json()
+        self.assertEqual([result['text'] for result in data['results']],
+                         ['Smith {0:02d}, First'.format(number) for number in range(20)])
+        response = self.client.get(reverse('lookup', args=['authors']), {'q': 'smi', 'cursor': data['next']})
+        data = response.json()
+        self.assertEqual(len(data['results']), 10)
+        self.assertIsNone(data['next'])
+
+    def test_without_term_every_object_is_listed(self):
+        response = self.client.get(reverse('lookup', args=['genres']))
+        self.assertEqual(response.json()['results'], [{'id': Genre.objects.get().pk, 'text': 'Fantasy'}])
+
+    def test_unknown_lookup_and_invalid_cursor(self):
+        self.assertEqual(self.client.get(reverse('lookup', args=['users'])).status_code, 404)
+        response = self.client.get(reverse('lookup', args=['authors']), {'cursor': 'invalid'})
+        self.assertEqual(response.status_code, 400)
+
+
+class BulkRenewReturnViewTest(QueryBudgetTestCase):
+
+    def setUp(self):
+        self.librarian = User.objects.create_user(username='librarian', password='2HJ1vRV0Z&3iD')
+        self.librarian.user_permissions.add(Permission.objects.get(name='Set book as returned'))
+        self.borrower = User.objects.create_user(username='borrower', password='1X<ISRUkw+tuK')
+        self.book = Book.objects.create(title='Book Title', summary='My book summary', isbn='ABCDEFG')
+        self.loans = [
+            BookInstance.objects.create(book=self.book, imprint='Imprint', status='o', borrower=self.borrower,
+                                        due_back=datetime.date.today() + datetime.timedelta(days=day))
+            for day in range(30)
+        ]
+        self.available = BookInstance.objects.create(book=self.book, imprint='Imprint', status='a')
+        self.client.login(username='librarian', password='2HJ1vRV0Z&3iD')
+
+    def post(self, action, copies, **data):
+        data.update({'action': action, 'copies': [copy.pk for copy in copies]})
+        with self.captureOnCommitCallbacks(execute=True):
+            return self.client.post(reverse('bulk-renew-return'), data, follow=True)
+
+    def test_forbidden_without_permission(self):
+        self.client.login(username='borrower', password='1X<ISRUkw+tuK')
+        response = self.client.post(reverse('bulk-renew-return'), {'action': 'return', 'copies': [self.loans[0].pk]})
+        self.assertEqual(response.status_code, 403)
+
+    def test_get_is_not_allowed(self):
+        self.assertEqual(self.client.get(reverse('bulk-renew-return')).status_code, 405)
+
+    def test_renews_selected_loans(self):
+        date = datetime.date.today() + datetime.timedelta(weeks=4)
+        response = self.post('renew', self.loans[:20], renewal_date=date)
+        self.assertRedirects(response, reverse('all-borrowed'))
+        self.assertContains(response, 'Renewed 20 loans until {0}.'.format(date))
+        self.assertEqual(BookInstance.objects.filter(pk__in=[copy.pk for copy in self.loans[:20]],
+                                                     due_back=date).count(), 20)
+
+    def test_renewal_date_is_validated(self):
+        for date in ('', datetime.date.today() - datetime.timedelta(days=1),
+                     datetime.date.today() + datetime.timedelta(weeks=5)):
+            response = self.post('renew', self.loans[:2], renewal_date=date)
+            self.assertEqual(len(response.context['messages']), 1)
+        self.assertFalse(BookInstance.objects.filter(due_back__gt=datetime.date.today() + datetime.timedelta(days=29)))
+
+    def test_returns_selected_loans_and_reports_the_others(self):
+        response = self.post('return', self.loans[:5] + [self.available])
+        self.assertContains(response, 'Marked 5 loans returned.')
+        self.assertContains(response, '1 selected copy was no longer on loan.')
+        self.assertEqual(BookInstance.objects.filter(status='a', borrower__isnull=True).count(), 6)
+        self.assertEqual(len(response.context['bookinstance_list']), 10)
+        self.assertEqual(BookInstance.objects.filter(status='o').count(), 25)
+
+    def test_loans_are_changed_with_one_update(self):
+        with self.captureOnCommitCallbacks(execute=False), record_queries() as recorder:
+            self.client.post(reverse('bulk-renew-return'),
+                             {'action': 'return', 'copies': [copy.pk for copy in self.loans]})
+        updates = [query.sql for query in recorder.queries if query.sql.startswith('UPDATE "catalog_bookinstance"')]
+        self.assertEqual(len(updates), 1)
+        self.assertIn('"status" = ', updates[0].split('WHERE')[1])
+
+    def test_returns_move_the_counters_and_renewals_leave_them(self):
+        from catalog.models import BookAvailability
+
+        with record_queries() as recorder:
+            self.post('renew', self.loans[:5], renewal_date=datetime.date.today() + datetime.timedelta(weeks=2))
+        self.assertFalse([query for query in recorder.queries if 'catalog_bookavailability' in query.sql])
+
+        with record_queries() as recorder:
+            self.post('return', self.loans[:5])
+        # The counters are moved by the number of copies returned, not rebuilt
+        self.assertFalse([query.sql for query in recorder.queries
+                          if query.sql.startswith('DELETE FROM "catalog_bookavailability"')])
+        totals = BookAvailability.totals([self.book.pk])[self.book.pk]
+        self.assertEqual((totals['on_loan'], totals['available']), (25, 6))
+
+    def test_list_page_size_can_be_chosen(self):
+        response = self.client.get(reverse('all-borrowed'), {'per_page': 50})
+        self.assertEqual(len(response.context['bookinstance_list']), 30)
+        response = self.client.get(reverse('all-borrowed'), {'per_page': 20})
+        self.assertContains(response, '?page=2&amp;per_page=20')
@@ -3,26 +3,53 @@ This file maps urls to view functions/classes and a name.
 '''
 
 
+from django.conf import settings
 from django.urls import path
-from . import views
+from . import api, async_views, views
+
+
+# Under ASGI, the read-only catalog pages can be served by the async views of ./async_views.py instead
+if settings.CATALOG_ASYNC_VIEWS:
+    catalog_views = {
+        'index': async_views.index,
+        'books': async_views.book_list,
+        'book-detail': async_views.book_detail,
+        'authors': async_views.author_list,
+        'author-detail': async_views.author_detail,
+    }
+else:
+    catalog_views = {
+        'index': views.index,
+        'books': views.BookListView.as_view(),
+        'book-detail': views.BookDetailView.as_view(),
+        'authors': views.AuthorListView.as_view(),
+        'author-detail': views.AuthorDetailView.as_view(),
+    }
 
 
 urlpatterns = [
     # This path is using our custom function views.index to render the landing page
-    path('', views.index, name='index'),
+    path('', catalog_views['index'], name='index'),
     # This path is using the generic view we defined in ./views.py
-    path('books/', views.BookListView.as_view(), name='books'),
+    path('books/', catalog_views['books'], name='books'),
     # <int:pk> matches an int and captures it into a keyword argument named pk
     # In the view class, you can then do self.kwargs['pk']
-    path('book/<int:pk>', views.BookDetailView.as_view(), name='book-detail'),
-    path('authors/', views.AuthorListView.as_view(), name='authors'),
-    path('author/<int:pk>', views.AuthorDetailView.as_view(), name='author-detail'),
+    path('book/<int:pk>', catalog_views['book-detail'], name='book-detail'),
+    path('authors/', catalog_views['authors'], name='authors'),
+    path('author/<int:pk>', catalog_views['author-detail'], name='author-detail'),
+    # The search terms are passed in the query string: search/?q=terms
+    path('search/', views.BookSearchView.as_view(), name='search'),
+    path('export/', views.export, name='export'),
+    path('autocomplete/', views.autocomplete, name='autocomplete'),
+    # The name is one of the lookups of ./lookups.py: authors, genres or languages
+    path('lookup/<str:name>/', views.lookup, name='lookup'),
 ]
 
 
 urlpatterns += [
     path('mybooks/', views.LoanedBooksByUserListView.as_view(), name='my-borrowed'),
     path(r'borrowed/', views.LoanedBooksAllListView.as_view(), name='all-borrowed'),
+    path('borrowed/bulk/', views.bulk_renew_return, name='bulk-renew-return'),
 ]
 
 
@@ -43,3 +70,10 @@ urlpatterns += [
     path('book/<int:pk>/update/', views.BookUpdate.as_view(), name='book-update'),
     path('book/<int:pk>/delete/', views.BookDelete.as_view(), name='book-delete'),
 ]
+
+
+# Read-only JSON API (see ./api.py). The resource name is one of books, authors, copies, genres or languages.
+urlpatterns += [
+    path('api/v1/<str:resource_name>/', api.api_list, name='api-list'),
+    path('api/v1/<str:resource_name>/<str:pk>/', api.api_detail, name='api-detail'),
+]
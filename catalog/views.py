@@ -3,94 +3,418 @@ The views defined here are responsible for handling http request by querying mod
 '''
 
 import datetime
+import hashlib
 
 from django.contrib.auth.mixins import LoginRequiredMixin
 from django.shortcuts import render
 from django.views import generic
-from .models import Book, Author, BookInstance, Genre
+from .models import Book, Author, BookAvailability, BookInstance, Genre
+from django.core.paginator import Paginator
+from django.db.models import Max
 from django.contrib.auth.mixins import PermissionRequiredMixin
 from django.shortcuts import get_object_or_404
 from django.http import HttpResponseRedirect
 from django.urls import reverse
 from django.contrib.auth.decorators import login_required, permission_required
-from catalog.forms import RenewBookForm
+from catalog.forms import BookForm, BulkLoanForm, RenewLoanForm
+from catalog.loans import LoanConflict, bulk_renew, bulk_return, renew
+from django.contrib import messages
+from django.utils.http import url_has_allowed_host_and_scheme
+from django.utils.translation import ngettext
+from catalog.pagination import KeysetPaginationMixin
+from catalog.search import search_books
+from catalog.autocomplete import autocomplete as autocomplete_prefix
+from catalog.lookups import lookup as lookup_objects
+from django.http import Http404, HttpResponseBadRequest, JsonResponse, StreamingHttpResponse
+from django.contrib.admin.views.decorators import staff_member_required
+from django.utils.cache import patch_vary_headers
+from catalog.export import CONTENT_TYPES as EXPORT_CONTENT_TYPES, FORMATS as EXPORT_FORMATS, export_catalog
+from catalog.caching import detail_cache_key, get_catalog_counts, get_list_version, record_cache_access
+from django.views.decorators.http import condition, require_POST
+from django.conf import settings
+from django.core.cache import cache
+from django.template.loader import render_to_string
 from django.views.generic.edit import CreateView, UpdateView, DeleteView
 from django.urls import reverse_lazy
 from .models import Author
 
 
-def index(request):
-    # Gathering data from models for index page
-    num_books = Book.objects.all().count()
-    num_instances = BookInstance.objects.all().count()
-    num_instances_available = BookInstance.objects.filter(status__exact='a').count()
-    num_authors = Author.objects.count()  # The 'all()' is implied by default.
+VISITS_COOKIE = 'num_visits'
+VISITS_COOKIE_MAX_AGE = 60 * 60 * 24 * 365
+
+
+# The visits are counted in a signed cookie rather than the session, so a visit doesn't write to the
+# session store (a database write with the default backend). The signature stops visitors from editing it.
+def get_num_visits(request):
+    try:
+        return int(request.get_signed_cookie(VISITS_COOKIE, default=1, salt=VISITS_COOKIE))
+    except ValueError:
+        return 1
+
+
+def set_num_visits(response, num_visits):
+    response.set_signed_cookie(VISITS_COOKIE, num_visits, salt=VISITS_COOKIE, max_age=VISITS_COOKIE_MAX_AGE,
+                               httponly=True, samesite='Lax')
+
+
+def index_context(counts, num_visits):
+    return {'num_books': counts['num_books'],
+            'num_instances': counts['num_instances'],
+            'num_instances_available': counts['num_instances_available'],
+            'num_authors': counts['num_authors'],
+            'num_visits': num_visits}
 
-    # Capturing session data stored in request object
-    num_visits = request.session.get('num_visits', 1)
-    request.session['num_visits'] = num_visits+1
+
+def index(request):
+    # Gathering data from models for index page.
+    # The counts come from the cache and are recomputed with a single query after a change (see ./caching.py)
+    counts = get_catalog_counts()
+    num_visits = get_num_visits(request)
 
     # Render the HTML template index.html with the data in the context variable.
     # The context key-value arguments are unwrapped and passed to the template
-    return render(
-        request,
-        'index.html',
-        context={'num_books': num_books,
-                 'num_instances': num_instances,
-                 'num_instances_available': num_instances_available,
-                 'num_authors': num_authors,
-                 'num_visits': num_visits},
-    )
+    response = render(request, 'index.html', context=index_context(counts, num_visits))
+    set_num_visits(response, num_visits + 1)
+    return response
+
+
+# Conditional GET requests (If-None-Match / If-Modified-Since) are answered with a 304 before a view does any
+# work. The timestamp comes from the updated_at field of the model (see ./models.py), read by a single indexed
+# query; the ETag also covers the user, whose name is shown in the sidebar, and the query string.
+
+def detail_last_modified(model, pk):
+    return model.objects.filter(pk=pk).values_list('updated_at', flat=True).first()
+
+
+def list_last_modified(model):
+    return model.objects.aggregate(last_modified=Max('updated_at'))['last_modified']
+
+
+def page_etag(model, last_modified, user_pk, query_string, *parts):
+    if last_modified is None:
+        return None
+    parts = [model._meta.label, last_modified.isoformat(), str(user_pk), query_string] + [str(part) for part in parts]
+    return hashlib.md5('|'.join(parts).encode()).hexdigest()
+
+
+class ConditionalGetMixin:
+
+    # Returns the time the page's content last changed, or None to skip the check (e.g. a missing object)
+    def get_last_modified(self):
+        raise NotImplementedError
+
+    # Other values the page depends on, included in the ETag
+    def get_etag_parts(self):
+        return ()
+
+    def get(self, request, *args, **kwargs):
+        last_modified = self.get_last_modified()
+
+        def get_etag(request, *args, **kwargs):
+            return page_etag(self.model, last_modified, request.user.pk, request.META.get('QUERY_STRING', ''),
+                             *self.get_etag_parts())
+
+        view = condition(etag_func=get_etag, last_modified_func=lambda request, *args, **kwargs: last_modified)
+        return view(super().get)(request, *args, **kwargs)
+
+
+class ConditionalDetailMixin(ConditionalGetMixin):
+
+    def get_last_modified(self):
+        return detail_last_modified(self.model, self.kwargs[self.pk_url_kwarg])
+
+
+class ConditionalListMixin(ConditionalGetMixin):
+    # A deleted object doesn't move the latest updated_at back, so the list version (bumped by ./signals.py on
+    # deletes too) is part of the ETag
+
+    def get_last_modified(self):
+        return list_last_modified(self.model)
+
+    def get_etag_parts(self):
+        return (get_list_version(self.model), settings.CATALOG_PAGINATION)
 
 
 # This class name does not matter.
 # By default, the template used is ./templates/catalog/<model>_list.html.
 # By default, the retrieved objects will be named <model>_list when passed to the template.
-class BookListView(generic.ListView):
+class BookListView(ConditionalListMixin, KeysetPaginationMixin, generic.ListView):
     model = Book
     # Show 10 models before starting pagination
     paginate_by = 10
+    # The fields pages are selected by in keyset pagination mode (see ./pagination.py)
+    keyset_ordering = ('title', 'author', 'id')
+
+    def get_queryset(self):
+        # The author shown next to each title is joined instead of being loaded once per book
+        return Book.objects.select_related('author')
+
+
+# Ranked full-text search over the books' titles, summaries, ISBNs and author names (see ./search.py)
+class BookSearchView(generic.ListView):
+    template_name = 'catalog/book_search.html'
+    context_object_name = 'book_list'
+    paginate_by = 10
+
+    def get_queryset(self):
+        return search_books(self.request.GET.get('q', ''))
+
+    def get_context_data(self, **kwargs):
+        context = super().get_context_data(**kwargs)
+        context['query'] = self.request.GET.get('q', '')
+        return context
+
+
+# Returns the book titles and author names starting with ?q= as JSON, for the sidebar's typeahead.
+# The lookup is answered from the worker's in-memory index (see ./autocomplete.py), not the database.
+def autocomplete(request):
+    try:
+        limit = min(int(request.GET.get('limit', 10)), 20)
+    except ValueError:
+        limit = 10
+    results = autocomplete_prefix(request.GET.get('q', ''), limit)
+    for result in results:
+        view_name = 'book-detail' if result['type'] == 'book' else 'author-detail'
+        result['url'] = reverse(view_name, args=[result['id']])
+    return JsonResponse({'results': results})
+
+
+# Returns a page of the authors, genres or languages whose name starts with ?q= as JSON, for the choice widgets
+# of the book forms (see ./lookups.py and ./forms.py). The next page is requested with ?cursor=.
+def lookup(request, name):
+    try:
+        page = lookup_objects(name, request.GET.get('q', ''), request.GET.get('cursor'))
+    except KeyError:
+        raise Http404('Unknown lookup.')
+    except ValueError:
+        return HttpResponseBadRequest('Invalid cursor.')
+    return JsonResponse({
+        'results': [{'id': obj.pk, 'text': str(obj)} for obj in page.object_list],
+        'next': page.next_cursor,
+    })
+
+
+# Streams the whole catalog as CSV (or JSON lines with ?format=jsonl), gzip-compressed if the client accepts it.
+# Staff only: the export is large and meant for the discovery layer, not for browsing.
+@staff_member_required
+def export(request):
+    output_format = request.GET.get('format', 'csv')
+    if output_format not in EXPORT_FORMATS:
+        return HttpResponseBadRequest('Unknown format.')
+    compress = 'gzip' in request.headers.get('Accept-Encoding', '')
+
+    response = StreamingHttpResponse(export_catalog(output_format, compress=compress),
+                                     content_type=EXPORT_CONTENT_TYPES[output_format])
+    response['Content-Disposition'] = 'attachment; filename="catalog.{0}"'.format(output_format)
+    if compress:
+        response['Content-Encoding'] = 'gzip'
+    patch_vary_headers(response, ('Accept-Encoding',))
+    return response
+
+
+# Mixin for detail views whose content rarely changes.
+# The content block is rendered from content_template_name and cached under the object's version key
+# (see ./caching.py and ./signals.py), so a cache hit is served without loading the object.
+class CachedContentMixin:
+    content_template_name = None
+
+    # Extra values the content depends on besides the object (e.g. a page number) to include in the cache key.
+    # The content is looked up by the request (context is None) and cached by what was rendered (its context).
+    def get_content_cache_variant(self, context=None):
+        return ()
+
+    def get(self, request, *args, **kwargs):
+        key = detail_cache_key(self.model, self.kwargs[self.pk_url_kwarg], *self.get_content_cache_variant())
+        content = cache.get(key)
+        record_cache_access('{0}-detail'.format(self.model._meta.model_name), hit=content is not None)
+
+        if content is None:
+            # get_object() raises Http404 for a missing object, so nothing is cached for it
+            self.object = self.get_object()
+            context = self.get_context_data(object=self.object)
+            content = render_to_string(self.content_template_name, context, request)
+            key = detail_cache_key(self.model, self.object.pk, *self.get_content_cache_variant(context))
+            cache.set(key, content, settings.CATALOG_DETAIL_CACHE_TIMEOUT)
+
+        return self.render_to_response({'content': content})
+
+
+def book_availability(book_id):
+    # The number of copies of the book in each loan status, from the BookAvailability counters
+    empty = dict.fromkeys(BookAvailability.STATUS_COLUMNS.values(), 0)
+    counts = BookAvailability.totals([book_id]).get(book_id, empty)
+    return dict(counts, total=sum(counts.values()))
 
 
 # By default, the template used is ./templates/catalog/<model>_detail.html.
-class BookDetailView(generic.DetailView):
+class BookDetailView(ConditionalDetailMixin, CachedContentMixin, generic.DetailView):
     model = Book
+    # Set explicitly because the default template name is derived from the object, which a cache hit doesn't load
+    template_name = 'catalog/book_detail.html'
+    content_template_name = 'catalog/book_detail_content.html'
+
+    def get_context_data(self, **kwargs):
+        context = super().get_context_data(**kwargs)
+        context['availability'] = book_availability(self.object.pk)
+        return context
 
 
-class AuthorListView(generic.ListView):
+class AuthorListView(ConditionalListMixin, KeysetPaginationMixin, generic.ListView):
     model = Author
     paginate_by = 10
+    keyset_ordering = ('last_name', 'first_name', 'id')
+
+
+def author_books(author_id):
+    return (
+        Book.objects.filter(author_id=author_id).only('title', 'summary', 'author')
+        # The default Book ordering joins Author to sort by it, which is pointless for a single author
+        .order_by('title', 'pk')
+    )
 
 
-class AuthorDetailView(generic.DetailView):
+def add_availability(books):
+    # Sets num_copies and the num_<status> counts of each book from the BookAvailability counters (see
+    # ./models.py), which is a few rows per book instead of a scan of its copies. Copies with a blank status
+    # aren't counted. Returns the books as a list.
+    books = list(books)
+    totals = BookAvailability.totals([book.pk for book in books])
+    for book in books:
+        counts = totals.get(book.pk, dict.fromkeys(BookAvailability.STATUS_COLUMNS.values(), 0))
+        book.num_copies = sum(counts.values())
+        for column, count in counts.items():
+            setattr(book, 'num_' + column, count)
+    return books
+
+
+class AuthorDetailView(ConditionalDetailMixin, CachedContentMixin, generic.DetailView):
     model = Author
+    template_name = 'catalog/author_detail.html'
+    content_template_name = 'catalog/author_detail_content.html'
+    # Number of books listed per page, so the page stays small for prolific authors
+    paginate_books_by = 20
+    # Whether each book's copies are also counted per loan status
+    show_status_breakdown = True
+
+    def get_page_number(self):
+        # Anything but a number is shown as the first page
+        try:
+            return int(self.request.GET.get('page', 1))
+        except ValueError:
+            return 1
+
+    def get_content_cache_variant(self, context=None):
+        # A number past the last page (or below 1) shows the last page, so the content is cached under the number
+        # of the page rendered: whatever numbers are requested, there is one entry per page
+        if context is not None:
+            return (context['page_obj'].number,)
+        return (self.get_page_number(),)
+
+    def get_context_data(self, **kwargs):
+        context = super().get_context_data(**kwargs)
+
+        books = author_books(self.object.pk)
+        paginator = Paginator(books, self.paginate_books_by)
+        page = paginator.get_page(self.get_page_number())
+        context.update({
+            'book_list': add_availability(page.object_list),
+            'page_obj': page,
+            'is_paginated': page.has_other_pages(),
+            'show_status_breakdown': self.show_status_breakdown,
+        })
+        return context
 
 
 # LoginRequiredMixin acts similarly to the decorator @login_required
-class LoanedBooksByUserListView(LoginRequiredMixin, generic.ListView):
+class LoanedBooksByUserListView(LoginRequiredMixin, KeysetPaginationMixin, generic.ListView):
     model = BookInstance
     # Defining new path for template
     template_name = 'catalog/bookinstance_list_borrowed_user.html'
     paginate_by = 10
+    keyset_ordering = ('due_back', 'id')
 
     # Override this method to change the list of records returned
     def get_queryset(self):
         return (
             BookInstance.objects.filter(borrower=self.request.user)
             .filter(status__exact='o')
+            .select_related('book')
+            # Only the columns used by the template are loaded
+            .only('id', 'due_back', 'book__id', 'book__title')
             .order_by('due_back')
         )
 
 
-class LoanedBooksAllListView(PermissionRequiredMixin, generic.ListView):
+class LoanedBooksAllListView(PermissionRequiredMixin, KeysetPaginationMixin, generic.ListView):
     model = BookInstance
     # Behaves similar to decorator @permission_required
     permission_required = 'catalog.can_mark_returned'
     template_name = 'catalog/bookinstance_list_borrowed_all.html'
     paginate_by = 10
+    keyset_ordering = ('due_back', 'id')
+
+    # The loans can be shown up to max_paginate_by at a time with ?per_page=, to renew or return them together
+    max_paginate_by = 200
 
     def get_queryset(self):
-        return BookInstance.objects.filter(status__exact='o').order_by('due_back')
+        # The book and borrower shown for each copy are joined into the same query
+        # instead of being fetched by the template one row at a time.
+        return (
+            BookInstance.objects.filter(status__exact='o')
+            .select_related('book', 'borrower')
+            .only('id', 'due_back', 'book__id', 'book__title', 'borrower__id', 'borrower__username')
+            .order_by('due_back')
+        )
+
+    def get_paginate_by(self, queryset):
+        try:
+            return min(max(int(self.request.GET['per_page']), 1), self.max_paginate_by)
+        except (KeyError, ValueError):
+            return self.paginate_by
+
+    def get_context_data(self, **kwargs):
+        context = super().get_context_data(**kwargs)
+        per_page = self.get_paginate_by(None)
+        context['per_page'] = per_page
+        context['pagination_query'] = '&per_page={0}'.format(per_page) if per_page != self.paginate_by else ''
+        context['bulk_form'] = BulkLoanForm(
+            initial={'renewal_date': datetime.date.today() + datetime.timedelta(weeks=3)})
+        return context
+
+
+# Renews or returns the loans ticked in the list of all loans (LoanedBooksAllListView) with one UPDATE
+# (see ./loans.py), and reports the number of loans changed on the list.
+@login_required
+@permission_required('catalog.can_mark_returned', raise_exception=True)
+@require_POST
+def bulk_renew_return(request):
+    form = BulkLoanForm(request.POST)
+    next_url = request.POST.get('next', '')
+    if not url_has_allowed_host_and_scheme(next_url, allowed_hosts={request.get_host()},
+                                           require_https=request.is_secure()):
+        next_url = reverse('all-borrowed')
+
+    if not form.is_valid():
+        for errors in form.errors.values():
+            for error in errors:
+                messages.error(request, error)
+        return HttpResponseRedirect(next_url)
+
+    copy_ids = form.cleaned_data['copies']
+    if form.cleaned_data['action'] == BulkLoanForm.RENEW:
+        due_back = form.cleaned_data['renewal_date']
+        changed = bulk_renew(copy_ids, due_back)
+        messages.success(request, ngettext('Renewed {0} loan until {1}.', 'Renewed {0} loans until {1}.',
+                                           changed).format(changed, due_back))
+    else:
+        changed = bulk_return(copy_ids)
+        messages.success(request, ngettext('Marked {0} loan returned.', 'Marked {0} loans returned.',
+                                           changed).format(changed))
+    if changed < len(copy_ids):
+        skipped = len(copy_ids) - changed
+        messages.error(request, ngettext('{0} selected copy was no longer on loan.',
+                                         '{0} selected copies were no longer on loan.', skipped).format(skipped))
+    return HttpResponseRedirect(next_url)
 
 
 # If the user is logged in, then your view code will execute as normal.
@@ -101,28 +425,43 @@ class LoanedBooksAllListView(PermissionRequiredMixin, generic.ListView):
 @permission_required('catalog.can_mark_returned', raise_exception=True)
 # This function accepts pk argument because it is mapped to an url in ./urls.py that has pk url argument
 def renew_book_librarian(request, pk):
-    # Returns exception if unable to get object
-    book_instance = get_object_or_404(BookInstance, pk=pk)
+    # Returns exception if unable to get object. The book and borrower are shown in the page.
+    book_instances = BookInstance.objects.select_related('book', 'borrower')
+    book_instance = get_object_or_404(book_instances, pk=pk)
 
     if request.method == 'POST':
 
         # Creating the form we defined in ./forms.py.
         # Populate it with data from the request
-        form = RenewBookForm(request.POST)
+        # The form also checks that the copy is on loan
+        form = RenewLoanForm(request.POST, copy=book_instance)
 
         # Check if the form is valid:
         if form.is_valid():
-            book_instance.due_back = form.cleaned_data['renewal_date']
-            # Save the book instance data to db
-            book_instance.save()
-            # reverse('all-borrowed') returns the appropriate url named all-borrowed
-            # HttpResponseRedirect redirects to that url
-            return HttpResponseRedirect(reverse('all-borrowed'))
+            if form.cleaned_data['version'] is not None:
+                # Only renew the copy as the librarian saw it (see ./loans.py)
+                book_instance.version = form.cleaned_data['version']
+            try:
+                renew(book_instance, form.cleaned_data['renewal_date'])
+            except LoanConflict:
+                # Show the copy as it is now, so the librarian can decide again. A copy returned in the
+                # meantime fails the form's validation; otherwise only the version check failed.
+                book_instance = get_object_or_404(book_instances, pk=pk)
+                data = request.POST.copy()
+                data['version'] = book_instance.version
+                form = RenewLoanForm(data, copy=book_instance)
+                if form.is_valid():
+                    form.add_error(None, 'This copy was changed by someone else in the meantime. '
+                                         'Check it and submit again.')
+            else:
+                # reverse('all-borrowed') returns the appropriate url named all-borrowed
+                # HttpResponseRedirect redirects to that url
+                return HttpResponseRedirect(reverse('all-borrowed'))
 
     else:
         proposed_renewal_date = datetime.date.today() + datetime.timedelta(weeks=3)
         # Creating a new form with initial values
-        form = RenewBookForm(initial={'renewal_date': proposed_renewal_date})
+        form = RenewLoanForm(initial={'renewal_date': proposed_renewal_date, 'version': book_instance.version})
 
     context = {
         'form': form,
@@ -163,15 +502,16 @@ class AuthorDelete(PermissionRequiredMixin, DeleteView):
 
 
 # Classes created for the forms challenge
+# The author, genre and language choices are looked up as the user types (see BookForm in ./forms.py)
 class BookCreate(PermissionRequiredMixin, CreateView):
     model = Book
-    fields = ['title', 'author', 'summary', 'isbn', 'genre', 'language']
+    form_class = BookForm
     permission_required = 'catalog.can_mark_returned'
 
 
 class BookUpdate(PermissionRequiredMixin, UpdateView):
     model = Book
-    fields = ['title', 'author', 'summary', 'isbn', 'genre', 'language']
+    form_class = BookForm
     permission_required = 'catalog.can_mark_returned'
 
 
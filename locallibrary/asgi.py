@@ -0,0 +1,20 @@
+"""
+ASGI config for locallibrary project.
+
+It exposes the ASGI callable as a module-level variable named ``application``.
+
+Run it with gunicorn's uvicorn worker class, e.g.
+``gunicorn locallibrary.asgi:application -k uvicorn.workers.UvicornWorker``, and set
+CATALOG_ASYNC_VIEWS=True to serve the catalog pages with the async views of catalog/async_views.py.
+
+For more information on this file, see
+https://docs.djangoproject.com/en/4.0/howto/deployment/asgi/
+"""
+
+import os
+
+from django.core.asgi import get_asgi_application
+
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'locallibrary.settings')
+
+application = get_asgi_application()
@@ -65,6 +65,10 @@ MIDDLEWARE = [
     'django.middleware.csrf.CsrfViewMiddleware',
     # Associates users with requests using sessions
     'django.contrib.auth.middleware.AuthenticationMiddleware',
+    # Profiles single requests of staff users on demand (X-Profile header or ?_profile, see catalog/middleware.py)
+    'catalog.middleware.ProfilingMiddleware',
+    # Serves the catalog pages of anonymous visitors from a cache (see catalog/middleware.py)
+    'catalog.middleware.PageCacheMiddleware',
     # Enables cookie and session based messaging for one-time notifications between views
     'django.contrib.messages.middleware.MessageMiddleware',
     # Provides Clickjacking protection
@@ -116,6 +120,64 @@ DATABASES = {
 db_from_env = dj_database_url.config(conn_max_age=500)
 DATABASES['default'].update(db_from_env)
 
+# Cache used by the catalog app (see catalog/caching.py) for the cache versions, the index counts and the
+# autocomplete change log. The local-memory cache is private to each process, so with several workers (e.g.
+# WEB_CONCURRENCY for gunicorn) this must point at a backend shared by all of them, such as memcached or redis,
+# with CACHE_BACKEND and CACHE_LOCATION (https://docs.djangoproject.com/en/4.0/topics/cache/). The catalog.W001
+# system check warns while it is process-local and the detail or full-page cache is enabled.
+CACHES = {
+    'default': {
+        'BACKEND': os.environ.get('CACHE_BACKEND', 'django.core.cache.backends.locmem.LocMemCache'),
+        'LOCATION': os.environ.get('CACHE_LOCATION', ''),
+    },
+    # Full pages served to anonymous visitors (see catalog.middleware.PageCacheMiddleware). Any backend works,
+    # e.g. PAGE_CACHE_BACKEND=django.core.cache.backends.filebased.FileBasedCache with
+    # PAGE_CACHE_LOCATION=/var/tmp/catalog-pages, or a memcached/redis backend shared by all workers.
+    # The page keys include versions kept in the default cache, so a shared page cache needs a shared default
+    # cache as well; the catalog.E001 system check refuses to start otherwise (see catalog/checks.py).
+    'pages': {
+        'BACKEND': os.environ.get('PAGE_CACHE_BACKEND', 'django.core.cache.backends.locmem.LocMemCache'),
+        'LOCATION': os.environ.get('PAGE_CACHE_LOCATION', 'catalog-pages'),
+    },
+}
+
+# Number of seconds the index page record counts are cached for. They are also invalidated whenever
+# a Book, BookInstance or Author is saved or deleted.
+CATALOG_COUNTS_CACHE_TIMEOUT = 60 * 15
+
+# Number of seconds the content of book and author detail pages is cached for. A page is also re-rendered
+# as soon as its book/author, or anything else it shows, is changed.
+CATALOG_DETAIL_CACHE_TIMEOUT = 60 * 60
+
+# Cache alias (in CACHES) of the full-page cache for anonymous visitors, or None to disable it, and the number
+# of seconds pages are kept for. Pages are also dropped as soon as anything they show changes.
+CATALOG_PAGE_CACHE_ALIAS = os.environ.get('CATALOG_PAGE_CACHE_ALIAS', 'pages') or None
+CATALOG_PAGE_CACHE_TIMEOUT = 60 * 10
+
+# How the catalog list views are paginated: 'offset' uses page numbers (?page=3) and shows the number of pages,
+# 'keyset' uses opaque cursors (?cursor=...) which cost the same on every page and need no COUNT query.
+# See catalog/pagination.py.
+CATALOG_PAGINATION = os.environ.get('CATALOG_PAGINATION', 'offset')
+
+# Whether the index, book and author pages are served by the async views of catalog/async_views.py, which run
+# a page's independent queries concurrently. Only worth enabling when running under ASGI (locallibrary/asgi.py).
+CATALOG_ASYNC_VIEWS = os.environ.get('CATALOG_ASYNC_VIEWS', '') == 'True'
+
+# Number of rows above which the admin changelists of the catalog show the database's estimate of a table's size
+# instead of counting its rows, and filtered ones show "<threshold>+" (see catalog.pagination.EstimatedCountPaginator)
+CATALOG_ESTIMATED_COUNT_THRESHOLD = int(os.environ.get('CATALOG_ESTIMATED_COUNT_THRESHOLD', 100000))
+
+# Upper bound on the entries (book titles and author names) in each worker's autocomplete index,
+# which bounds its memory use (see catalog/autocomplete.py).
+CATALOG_AUTOCOMPLETE_MAX_ENTRIES = 500000
+
+# A worker that has missed more changes than this rebuilds its autocomplete index instead of replaying them
+CATALOG_AUTOCOMPLETE_MAX_REPLAY = 1000
+
+# Number of rows the copy counters of each book are split over (see catalog.models.BookAvailability).
+# More shards means less lock contention between concurrent loans/returns of the same book.
+BOOK_AVAILABILITY_SHARDS = 4
+
 #  List of validators that are used to check the strength of user's passwords.
 # (https://docs.djangoproject.com/en/4.0/ref/settings/#auth-password-validators)
 AUTH_PASSWORD_VALIDATORS = [
@@ -154,6 +216,11 @@ USE_I18N = True
 # Determines if Django will use timezone-aware datetimes
 USE_TZ = True
 
+# Where sessions are stored. The default keeps them in the database; 'django.contrib.sessions.backends.cached_db'
+# reads them from the cache first, and 'django.contrib.sessions.backends.signed_cookies' keeps them in the
+# client's cookie, with no server-side storage at all.
+SESSION_ENGINE = os.environ.get('SESSION_ENGINE', 'django.contrib.sessions.backends.db')
+
 # Redirect to home URL after login (Default redirects to /accounts/profile/)
 LOGIN_REDIRECT_URL = '/'
 